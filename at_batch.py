@@ -0,0 +1,75 @@
+#====================================================================
+# Batches of AT commands for the profile and PDP setup
+# Consecutive commands are chained into one AT line with ";"
+# (e.g. AT+UMQTT=0,"id";+UMQTT=2,"host";+UMQTTNV=2), so a batch costs one
+# round trip. The modem stops a chained line at the first failing command
+# and only returns ERROR, so a failed line is sent again command by command
+# to find the failing one. Setup commands are idempotent, the commands
+# before it are only written again.
+#====================================================================
+
+# commands which are never chained: data prompts, or they change the channel
+UNCHAINABLE = ('AT+UDWNFILE', 'AT+USOWR', 'AT+USOST', 'AT+IPR', 'AT+CFUN', 'ATD', 'ATO', 'ATZ', 'AT&F')
+
+# longest chained AT line, the modem rejects longer command lines
+AT_LINE_LIMIT = 512
+
+# result of a batch, failed is the command which did not return OK
+class BatchResult:
+	def __init__(self):
+		self.ok = True
+		self.failed = None
+		self.result = None
+		self.lines = []		# intermediate lines of all commands
+
+	def __repr__(self):
+		return 'OK' if self.ok else f'{self.failed} -> {self.result}'
+
+def chainable(at_cmd):
+	return at_cmd[0:2].upper() == 'AT' and at_cmd[2:3] == '+' and not at_cmd.upper().startswith(UNCHAINABLE)
+
+# group commands into AT lines, every line is a list of commands
+def chain(commands, lineLimit=AT_LINE_LIMIT):
+	groups = []
+	length = 0
+	for at_cmd in commands:
+		if groups and chainable(at_cmd) and chainable(groups[-1][-1]) and length + len(at_cmd) - 1 <= lineLimit:
+			groups[-1].append(at_cmd)
+			length += len(at_cmd) - 1	# 'AT' is replaced by ';'
+		else:
+			groups.append([at_cmd])
+			length = len(at_cmd)
+	return groups
+
+# the AT line of a group: AT+A;+B;+C
+def chain_line(group):
+	return group[0] + ''.join(';'+at_cmd[2:] for at_cmd in group[1:])
+
+# send(at_cmd, timeout) -> (result, lines) sends one AT line and waits for its final result code
+class ATBatch:
+	def __init__(self, send, chained=True, lineLimit=AT_LINE_LIMIT):
+		self.send = send
+		self.chained = chained
+		self.lineLimit = lineLimit
+
+	# send the commands in order, stop at the first failing one, timeout is per command
+	def run(self, commands, timeout=2):
+		batch = BatchResult()
+		groups = chain(commands, self.lineLimit) if self.chained else [[at_cmd] for at_cmd in commands]
+		for group in groups:
+			result, lines = self.send(chain_line(group), timeout*len(group))
+			if result == "OK":
+				batch.lines.extend(lines)
+				continue
+			if len(group) > 1:
+				# find the failing command of the chained line
+				for at_cmd in group:
+					result, lines = self.send(at_cmd, timeout)
+					batch.lines.extend(lines)
+					if result != "OK":
+						batch.ok, batch.failed, batch.result = False, at_cmd, result
+						return batch
+				continue
+			batch.ok, batch.failed, batch.result = False, group[0], result
+			return batch
+		return batch
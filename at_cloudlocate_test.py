@@ -10,15 +10,61 @@
 # Add UBX commands to switch GPS/GLONASS/Galileo/Beidou only for testing, however CloudLocate is only supported GPS so far.(2021/8/6)
 # Add MQTT-SN for testing using ThingStream's SIM card with "TSUDP", MQTTPubData is used for switching MQTT with "True" and MQTT-SN with "False" (2021/8/12)
 # The payload size of MQTT-SN is only supported 1017 bytes, thus epochs will be 1~2
+# Replace Waitfor() polling with an event-driven AT command engine, command_send() returns the final result code (2026/10/17)
+# Decode MEASX in one pass with measx_decoder, satellites are kept as arrays instead of dicts (2026/10/17)
+# Add SIMULATED_MODEM to replay "Test log.txt" with modem_simulator instead of opening SerialPort (2026/10/17)
+# Move the per-device state into CloudLocateDevice, so cloudlocate_fleet.py can drive many modems from one process (2026/10/17)
+# Add KEEP_CONNECTION to keep the PDP context and the broker session between runs, the profile is only written when it changed (2026/10/17)
+# The Response thread reads byte chunks into ubx_stream, MEASX frames are only used with a valid UBX checksum (2026/10/17)
+# Add PACK_PAYLOAD, epochs and satellites are packed into the 8192/1017 bytes limit instead of rejecting the payload (2026/10/17)
+# Keep the MEASX messages of a run in epoch_store with EPOCH_STORE_CAPACITY slots, cleared at the start of every run (2026/10/17)
+# Poll MEASX at the measurement rate with measx_scheduler, duplicate epochs are skipped and time.sleep(5) is replaced by the CFG-GNSS ACK and the first valid MEASX (2026/10/17)
+# Add PUBLISH_MODE, payloads within DIRECT_PUBLISH_LIMIT are published in the AT command without the FFS file, AT+UDWNFILE waits for the ">" prompt (2026/10/17)
+# Add QUEUE_PAYLOADS, payloads which cannot be published are kept in QUEUE_DIR by payload_queue and published after the next fix (2026/10/17)
+# Record the latency and serial bytes of every stage with cycle_metrics, into METRICS_FILE and on METRICS_PORT (2026/10/17)
+# Add ADAPTIVE_EPOCHS, the acquisition stops once the epochs so far reach QUALITY_TARGET, and tries the fallback after FALLBACK_AFTER of GNSS_READY_TIMEOUT (2026/10/17)
+# Send the profile and PDP setup commands as at_batch batches chained with ";", the failing command of a batch is printed (2026/10/17)
+# Add LINK_BAUDRATES, serial_link switches the UART to a higher rate with AT+IPR and reads chunks into one buffer (2026/10/17)
+# Add UPLINK "host", MQTT payloads are published over one mqtt_uplink connection of the host shared by all devices (2026/10/17)
+# Parse the CloudLocate reply into a Position and match it to its request with position_response, requestFix() returns a Future;
+# add POSITION_WAIT, False: the next run starts while the positions are still pending (2026/10/17)
+# Importing opens nothing, openSerial() opens the port on use and main() runs the console; add GNSS_KEEP_ON and
+# cloudlocate_daemon.py, which keeps the modem warm and serves fixes over a Unix socket (2026/10/17)
+# Print through the buffered log_buffer with LOG_LEVEL, satellites and MEASX hex are DEBUG; add CAPTURE_DIR to record
+# the raw serial bytes with raw_capture (2026/10/17)
+# Add PIPELINE, the next acquisition starts while the last payload is uploaded and its position awaited, run() reports fixes/hour (2026/10/17)
+# Add FIX_CACHE, a fix with nearly the same satellites as a recent one returns its position without FFS write, connect or publish (2026/10/17)
 #====================================================================
 
-import threading,serial,time,sys
+import threading,time,sys
+import concurrent.futures
+import collections
 import base64
 import codecs
 import struct
 
 import binascii
 import enum
+import os
+import re
+
+from at_engine import ATEngine
+from at_batch import ATBatch
+from serial_link import SerialLink, BASE_BAUDRATE
+from measx_decoder import MEASX_HEADER, MeasxEpoch, decode_hex
+from modem_simulator import SimulatedModem
+from ubx_stream import UBXStreamParser, AT_LINE, AT_PROMPT, UBX_FRAME
+from epoch_packer import pack_epochs, raw_budget, split_measx
+from epoch_store import EpochStore
+from measx_scheduler import MeasxScheduler
+from payload_queue import PayloadQueue
+from cycle_metrics import CycleMetrics, start_metrics_server
+from epoch_quality import QualityEstimator, required_quality
+from mqtt_uplink import pool as uplinkPool
+from position_response import PositionRequests, parse_read_line
+from log_buffer import BufferedLog, DEBUG, INFO
+from raw_capture import RawCapture
+from fix_cache import FixCache, measx_fingerprint
 
 # this class defines number of fallback configurations available, as enum
 class FallbackConfig(enum.Enum):
@@ -40,32 +86,103 @@ SerialPort = "COM5"  # uart port of SARA-R510M8s
 run_retry_times = 1  # To define how many times will be tested.
 run_wait_time = 30  #To define the waiting time for the next action.
 MQTTPubData = True # True:MQTT; False:MQTT-SN
+KEEP_CONNECTION = False # True: keep the PDP context and the MQTT/MQTT-SN session (and subscription) between runs
+AT_CHAINING = True # True: chain the setup commands of a batch with ";" into one AT line; False: one command after the other
+LINK_BAUDRATES = [] # e.g. [921600, 460800, 230400]: after the start at 115200, the first rate that works is set with AT+IPR; []: stay at 115200
+
+SIMULATED_MODEM = False # True: replay SIMULATED_LOG instead of opening SerialPort, no EVK needed
+SIMULATED_LOG = "Test log.txt"
+SIMULATED_TIME_SCALE = 1.0 # 1.0: recorded modem latencies; 0.1: ten times faster; 0: no delay
+
+GNSS_KEEP_ON = False # True: GNSS stays on between runs, every run after the first one gets a hot start
 
 TIMEOUT = 12 # in seconds
 CNO_THRESHOLD = 22
 MIN_NO_OF_SATELLITES = 6
 MULTIPATH_INDEX = 1 # 1:low 2:medium 3: high
 EPOCHS = 2
+EPOCH_STORE_CAPACITY = 64 # MEASX messages kept for the fallback logic, the oldest one is overwritten when it is full
+MEASX_RATE = 1000 # in ms, MEASX poll interval until the rate is read from UBX-CFG-RATE or from the gpsTOW of the epochs
+# in seconds, wait for the first valid MEASX (MIN_NO_OF_SATELLITES satellites within CNO_THRESHOLD and MULTIPATH_INDEX)
+# after UBX-CFG-GNSS; a cold start gets as long as the fixed 5 seconds and TIMEOUT of the original script
+GNSS_READY_TIMEOUT = 5 + TIMEOUT
+UBX_ACK_TIMEOUT = 1 # in seconds, wait for the UBX-ACK of UBX-CFG-GNSS
+
+# True: stop the acquisition as soon as the epochs so far are good enough, even with fewer than EPOCHS epochs
+# the requirement relaxes from QUALITY_TARGET at the first valid MEASX to QUALITY_MINIMUM at TIMEOUT.
+# Fewer than EPOCHS epochs are only sent as far as FALLBACK_METHODOLOGY allows it, see minimumEpochs()
+ADAPTIVE_EPOCHS = False
+QUALITY_TARGET = {"satellites": 8, "cno": 35, "doppler_spread": 800} # distinct satellites, their mean C/No and range of line-of-sight rate (m/s)
+QUALITY_MINIMUM = {"satellites": MIN_NO_OF_SATELLITES, "cno": CNO_THRESHOLD, "doppler_spread": 0}
+
+# payload limits of the JSON message
+MQTT_PAYLOAD_LIMIT = 8192
+MQTTSN_PAYLOAD_LIMIT = 1017
+# True: when the payload exceeds the limit, pack the epochs and drop the satellites of least value to fit it
+# False: a payload over the limit is not sent
+PACK_PAYLOAD = True
+PACK_DROP_OTHER_GNSS = True # satellites of other constellations than GNSS_TYPE are dropped first
+PACK_MIN_SATELLITES = 4 # a packed epoch keeps at least this number of satellites
+
+# "auto": a payload within DIRECT_PUBLISH_LIMIT is published in the AT command (hex mode), larger payloads through the FFS file
+# "file": always save the payload into FFS and publish the file
+PUBLISH_MODE = "auto"
+DIRECT_PUBLISH_LIMIT = 512 # in bytes, the message of AT+UMQTTC=2 / AT+UMQTTSNC=4 in hex mode
+
+# True: a payload which cannot be published (no coverage, PDP context or broker connection failed) is kept on the host
+# and published over the broker session of the next fix
+QUEUE_PAYLOADS = False
+QUEUE_DIR = "cloudlocate_queue" # a sub-directory per device
+QUEUE_MAX_BYTES = 1048576 # the oldest payloads are dropped above this size
+QUEUE_BATCH = 10 # queued payloads published after a fix, the others wait for the next one
+
+# "modem": publish with the MQTT client of the modem (AT+UMQTTC), one broker connection per fix
+# "host": publish MQTT payloads over the network of the host (gateway), the modem only acquires the MEASX;
+# one broker connection is kept open and shared by all devices of the process
+UPLINK = "modem"
+UPLINK_PORT = 8883 # 8883: MQTT over TLS; 1883: without TLS
+UPLINK_TLS = True
+UPLINK_WINDOW = 8 # publishes waiting for their PUBACK at the same time, e.g. queued payloads
+
+# True: wait for the position after the publish; False: the next run starts at once and the positions are read
+# as they arrive, this needs the broker session of KEEP_CONNECTION or UPLINK "host"
+POSITION_WAIT = True
+POSITION_TIMEOUT = 60 # in seconds, a request without position fails after this time
+# True: the fixes of "run" overlap, the acquisition of the next fix starts while the payload of the last one is uploaded
+# (UPLINK "host") and its position is awaited, the positions are read between the MEASX polls of the one AT channel;
+# run_wait_time is counted from the start of an acquisition, with GNSS_KEEP_ON every acquisition gets a hot start
+PIPELINE = False
+
+# True: for devices which do not move, a fix whose selected satellites are within FIX_CACHE_BOUNDS of a fix resolved in the
+# last FIX_CACHE_TTL seconds returns that position, the payload is not written, connected or published
+FIX_CACHE = False
+FIX_CACHE_TTL = 600 # in seconds, counted from the fix which was sent
+FIX_CACHE_SIZE = 16 # fingerprints kept, the least recently used one is dropped
+# shared satellites / all satellites, mean C/No change (dBHz), largest line-of-sight rate change without the common part (m/s)
+# plus doppler_drift m/s per second since the cached fix, compared only within doppler_window seconds of it (the rate of
+# every satellite drifts on its own, later only C/No and pseudorange are compared), mean change of the pseudorange RMS error index
+FIX_CACHE_BOUNDS = {"overlap": 0.8, "cno": 4, "doppler": 2.0, "doppler_drift": 0.2, "doppler_window": 30, "rms": 10}
+
+# "DEBUG": also every satellite, +UGUBX line and MEASX hex; "INFO"; "WARNING"
+# the console lines are printed by a writer thread, so a slow console does not delay the serial reads
+LOG_LEVEL = "INFO"
+# e.g. "captures": record the raw serial bytes of every device into <CAPTURE_DIR>/<port>-<time>.clcap, see raw_capture.py
+CAPTURE_DIR = None
+
+# latency of every stage, one JSON line per CloudLocate run, e.g. "cloudlocate_metrics.jsonl", None: not written
+METRICS_FILE = None
+METRICS_PORT = None # e.g. 9108: serve the stage histograms as Prometheus text on http://127.0.0.1:9108/metrics
 
 # set the fallback methodology to use in case main configuration does not yield desired MEASX message
 FALLBACK_METHODOLOGY = FallbackConfig.FALLBACK_EPOCHS
-
-# every MEASX message starts with this header
-# we need to break read bytes from the receiver based on this header value
-MEASX_HEADER = b"\xb5\x62\x02\x14"
-
-# this counter keeps track of the number of valid messages, messages that fit 
-# the configuration parameters above
-validMessageCounter = 0
+# with ADAPTIVE_EPOCHS: fraction of GNSS_READY_TIMEOUT without a valid epoch, after which the fallback methodology is tried with every new epoch
+FALLBACK_AFTER = 0.5
 
 # see if fallback methodology is set to extend the timeout. if so, add extended time to TIMEOUT
 extendedTime = 0
 if FALLBACK_METHODOLOGY == FallbackConfig.FALLBACK_EXTEND_TIMEOUT:
     extendedTime = FALLBACK_CONFIG[FallbackConfig.FALLBACK_EXTEND_TIMEOUT]
 
-# this variable will contain our desired MEASX message(s)
-MEASX_MESSAGE = bytearray()
-
 # Delivery platform and get the credentials
 Hostname = "mqtt.thingstream.io"
 DeviceID = "Your MQTT device ID"
@@ -97,48 +214,18 @@ MQTTSN_PUB_TOPIC = "CloudLocate/GNSS/request"
 # we will get a position back on this topic in the Flows, so we need to subscribe to it
 MQTTSN_SUB_TOPIC = "CloudLocate/GNSS/position"
 
-# an array to keep track of read MEASX messages, so we can pick the one based on fallback configuration,
-# if main configuration does not yield desired MEASX message
-READ_RAW_MEASX_MESSAGES = []
-
 #MQTT_MSG = ""
 #----------------------------------------------------------------------------- 
 # function to see how many satellites are required for fallback strategy when looking at MEASX messages
-def get_satellite_count_per_configuration(fl, mx):
+def get_satellite_count_per_configuration(fl, store, slot):
     if fl == FallbackConfig.FALLBACK_NO_OF_SATELLITIES_ONLY:
-        return len(mx['satellitesInfo'])
+        return store.gnssCount[slot]
     elif fl == FallbackConfig.FALLBACK_EPOCHS:
-	# lambda x: x[0] --> svID; lambda x: x[1]["cno"] --> C/No
-        filteredMEASX = dict(filter(lambda x: x[1]["cno"] >= CNO_THRESHOLD, mx['satellitesInfo'].items()))
-        print(f'... filteredMEASX : {filteredMEASX}')
-        return len(filteredMEASX)
-
-# function that goes through MEASX messages to find the one that matches selected fallback methodology
-def apply_fallback_logic(fallbackLogic, epochs, satellites):
-#	print(f'.. fallback message : {READ_RAW_MEASX_MESSAGES}')
-    # first check if we at least have enough messages (as per our required EPOCHS)
-	if len(READ_RAW_MEASX_MESSAGES) < epochs:
-		return False
+	# satellites of the selected constellation with C/No above CNO_THRESHOLD
+        return store.cnoCount[slot]
 
-	print(f'Using fallback configuration: {fallbackLogic.name}')
-    # sort saved messages as per highest CNO (carrier-to-noise)
-	READ_RAW_MEASX_MESSAGES.sort(key=lambda x: x['maxCNO'], reverse=True)
-	MEASX_MESSAGE = bytearray()
-    # start looking for a message that fulfills our fallback criteria
-    # index is used to keep track of number of messages that fits our criteria (to be compared against number of epochs)
-	index = 0
-	for measX in READ_RAW_MEASX_MESSAGES:
-		satCount = get_satellite_count_per_configuration(fallbackLogic, measX)
-		if satCount >= satellites:
-			MEASX_MESSAGE.extend(MEASX_HEADER)
-			MEASX_MESSAGE.extend(measX['measxMessage'])
-			index = index + 1
-        # no need to run the loop if we've found our desired number of epochs
-		if (index == epochs): break
-	if (index < epochs):
-		return False
-
-	return MEASX_MESSAGE
+# LOG_LEVEL is read at every call, it can be changed after the import
+log = BufferedLog(lambda: LOG_LEVEL)
 
 def getTime():
     timeArray = time.localtime()
@@ -150,450 +237,1122 @@ def getUTCTime():
     otherStyleTime = time.strftime("%Y-%m-%dT%H:%M:%S", timeArray)
     return otherStyleTime
 
-def remove_bytes(buffer, start, end):
-    fmt = '%ds %dx %ds' % (start, end-start, len(buffer)-end)  # 3 way split
-    return b''.join(struct.unpack(fmt, buffer))
-	
-def command_send(at_cmd):
-	global res_str_at_command
-	res_str_at_command = ''
-
-	print(getTime()+':input->'+at_cmd)
-	cmd = at_cmd+'\r\n'
-	ser.write(cmd.encode())
-
-def Waitfor(at_cmd, timeout):
-	global res_str_at_command
-	res_str_at_command = ''
-	when = int(time.time()) + int(timeout) # get the timestamp
-	while True:
-		now = int(time.time())
-		time.sleep(0.1) #0.05
-		if (now > when):
-			return False 
-		else :
-			if at_cmd in res_str_at_command:
-				return True
-			if "ERROR" in res_str_at_command: #ERROR
-				return False
-	
-def SaveJSON2FFS(str_payload):
-	length_str_payload = str(len(str_payload))
-	command_send('AT+UDWNFILE="CloudLocate_pub_data.txt",'+ length_str_payload)
-	time.sleep(1) #Waitfor(">",2)
-	command_send(str_payload)
-	Waitfor("OK", 25)
-	
-def DelJSON_FFS():
-	command_send('AT+UDELFILE="CloudLocate_pub_data.txt"')
-	Waitfor("OK", 2)
-#	time.sleep(2)
-				
-def PDP_Context_activate(activate_flag):
-	if (activate_flag==1):
-		print('.. PDP Context activate')
-		command_send('at+cops?;+CSQ;+CGATT?')
-		#time.sleep(2)
-		Waitfor("OK", 2)
-		
-		command_send('AT+UPSD=0,100,1')
-		time.sleep(0.1)
-	
-		command_send('AT+UPSD=0,0,0')
-		time.sleep(0.1)
-	
-		command_send('AT+UPSDA=0,3')
-		Waitfor("+UUPSDA", 5)
-	else:
-		print('.. PDP Context deactivate')
-		command_send('AT+UPSDA=0,4')
-		Waitfor("+UUPSDD", 5)
-
-def SetMQTTProfile():
-	print('.. Save MQTT profile')
-# Unique Client ID
-	command_send('AT+UMQTT=0,"'+DeviceID+'"')
-	time.sleep(0.5)
-
-# Host server
-	command_send('AT+UMQTT=2,"'+Hostname+'"')
-	time.sleep(0.5)
-
-# Username and password
-	command_send('AT+UMQTT=4,"'+Username+'","'+Password+'"')
-	time.sleep(0.5)
-	
-# keep alive time (seconds)
-	command_send('AT+UMQTT=10,60')  
-	time.sleep(0.5)
-
-# Save MQTT profile
-	command_send('AT+UMQTTNV=2')  
-	time.sleep(0.5)
-
-def SetMQTTSNProfile():
-	print('.. Save MQTT-SN profile')
-# Client ID
-	command_send('AT+UMQTTSN=0,"'+SNuniqueID+'"')
-	time.sleep(0.5)
-
-# Host and Port
-	command_send('AT+UMQTTSN=2,"'+SNSerevrIP+'",'+SNServerPort+'')
-	time.sleep(0.5)
-
-# Duration (seconds)
-	command_send('AT+UMQTTSN=8,'+SNServerDuration)  
-	time.sleep(0.5)
-
-# Save MQTT-SN profile
-#	command_send('AT+UMQTTSNNV=2')  
-#	time.sleep(0.5)
- 		
-def SubPOSTOPIC():
-	if MQTT_SUB_TOPIC:
-		print('.. Subscribe a TOPIC as '+ MQTT_SUB_TOPIC)
-		command_send('AT+UMQTTC=4,0,"'+MQTT_SUB_TOPIC+'"')
-		Waitfor("+UUMQTTC: 4,1,0,",30)
-
-def PubDataCloud():
-# Restore MQTT profile from NVM
-	command_send('AT+UMQTTNV=1')  
-	time.sleep(0.5)
-	
-# Connect MQTT broker
-	print('.. Connect MQTT broker')
-	command_send('AT+UMQTTC=1') 
-	if(Waitfor("+UUMQTTC: 1,1", 120)):
+# convert MEASX byte-array into base64 encoded string and wrap it in the JSON payload for CloudLocate
+def getJSONPayload(measxMessage, utcTime=None):
+	BASE64_ENC_PAYLOAD = base64.b64encode(measxMessage).decode()
+	return '{"body":"'+BASE64_ENC_PAYLOAD+'","headers":{"UTCDateTime":"'+(utcTime or getUTCTime())+'"}}'
 
-		#subscribe a topic for the positon
-		SubPOSTOPIC()
+# the fewest valid epochs ADAPTIVE_EPOCHS may send: those of the FALLBACK_EPOCHS fallback, otherwise all EPOCHS
+def minimumEpochs():
+	if FALLBACK_METHODOLOGY == FallbackConfig.FALLBACK_EPOCHS:
+		return FALLBACK_CONFIG[FallbackConfig.FALLBACK_EPOCHS]
+	return EPOCHS
 
-		# publish payload from FFS
-		print('.. Publish JSON to TS')
-		command_send('AT+UMQTTC=3,0,0,"'+ MQTT_PUB_TOPIC +'","CloudLocate_pub_data.txt"') 
-		Waitfor("+UUMQTTC: 3,1", 30)
-		
-		if MQTT_SUB_TOPIC:
-			if (Waitfor("+UUMQTTC: 6,1",30)):
-				command_send('AT+UMQTTC=6')
-				Waitfor("OK",5)
-				
-		# disconnect MQTT broker
-		command_send('AT+UMQTTC=0') 
-		Waitfor("+UUMQTTC: 0,1", 30)
-
-def MQTTSNPubDataCloud():
-# Restore MQTT profile from NVM
-#	command_send('AT+UMQTTSNNV=1')  
-#	time.sleep(0.5)
-
-# Connect MQTTSN Thing
-	print('.. Connect a MQTT-SN Thing')
-	command_send('AT+UMQTTSNC=1') 
-	if(Waitfor("+UUMQTTSNC: 1,1", 120)):
-		
-		#Register a Topic for CloudLocate
-		print('.. Register a Topic')
-		command_send('AT+UMQTTSNC=2,"'+MQTTSN_PUB_TOPIC+'"')
-		if(Waitfor("+UUMQTTSNC: 2,1,1", 60)):
+# whether a publish waits for its position, PIPELINE reads it later like POSITION_WAIT False
+def positionWait():
+	return POSITION_WAIT and not PIPELINE
+
+def showHelp():
+	log.flush()
+	print('================')
+	print('Press "run" to perform CloudLocate')
+	print('Press "AT" to perform AT commands')
+	print('Press "q" to exit')
+
+def getUBXPayload(payload):
+	# two hex characters convert to one byte, in a single pass
+	return decode_hex(payload)
+
+# this class keeps the state of one SARA-R510M8s, so several modems can run in one process
+class CloudLocateDevice:
+	def __init__(self, ser, name=''):
+		self.ser = ser
+		self.name = name
+		self.prefix = '['+name+'] ' if name else ''	# printed in front of input/output lines
+		self.aborted = False
+		self.gnssOn = False		# GNSS powered by at+UGPS=1 and kept on by GNSS_KEEP_ON
+
+		# this variable will contain our desired MEASX message(s)
+		self.MEASX_MESSAGE = bytearray()
+		# this counter keeps track of the number of valid messages, messages that fit 
+		# the configuration parameters above
+		self.validMessageCounter = 0
+		# a store to keep track of read MEASX messages, so we can pick the one based on fallback configuration,
+		# if main configuration does not yield desired MEASX message
+		self.epochStore = EpochStore(EPOCH_STORE_CAPACITY)
+		# quality of the valid epochs of a run, for ADAPTIVE_EPOCHS
+		self.quality = QualityEstimator(CONSTELLATION_TYPES[GNSS_TYPE], CNO_THRESHOLD, MULTIPATH_INDEX)
+		# times the MEASX polls and skips epochs with the gpsTOW of the last one
+		self.measxScheduler = MeasxScheduler(MEASX_RATE)
+		# (class, id) -> True for UBX-ACK-ACK, False for UBX-ACK-NAK, notified on ubxAckCondition
+		self.ubxAck = {}
+		self.ubxAckCondition = threading.Condition()
+		# payloads waiting for coverage, kept on disk so a restart does not lose them
+		self.payloadQueue = None
+		if QUEUE_PAYLOADS and ser is not None:
+			self.payloadQueue = PayloadQueue(os.path.join(QUEUE_DIR, re.sub(r'[^A-Za-z0-9_.-]', '_', name or 'default')), QUEUE_MAX_BYTES)
+		# the serial port with its rate and byte counters
+		self.link = SerialLink(ser, log=log) if ser is not None else None
+		if CAPTURE_DIR and ser is not None:
+			self.link.capture = RawCapture(os.path.join(CAPTURE_DIR, re.sub(r'[^A-Za-z0-9_.-]', '_', name or 'default')+time.strftime('-%Y%m%d-%H%M%S.clcap')))
+		# the shared broker connection of UPLINK "host", taken from the pool at the first publish
+		self.uplink = None
+		self.uplinkSubscribed = False
+		# published payloads waiting for their position, and the request of the last run
+		self.positions = PositionRequests(POSITION_TIMEOUT)
+		self.positions.callbacks.append(self.printPosition)
+		self.positionFuture = None
+		# (PUBACK Future, payload, position Future) of the host uplink publishes of PIPELINE, oldest first
+		self.uploads = collections.deque()
+		# positions of recent fixes for FIX_CACHE, and whether the last run got its position from there
+		self.fixCache = FixCache(FIX_CACHE_TTL, FIX_CACHE_SIZE, FIX_CACHE_BOUNDS) if FIX_CACHE else None
+		self.positionCached = False
+		self.metrics = CycleMetrics(name, lambda: (self.link.bytesIn, self.link.bytesOut) if self.link else (0, 0), METRICS_FILE if ser is not None else None)
+		# latest state reported by URCs, updated by the handlers registered in the engine
+		self.URC_STATE = {'pdpActive': False, 'pdpAddress': None,
+			'mqttConnected': False, 'mqttSubscribed': False,
+			'mqttsnConnected': False, 'mqttsnRegistered': False, 'mqttsnSubscribed': False,
+			'unreadMessages': 0}
+
+		self.engine = None
+		self.response = None
+		if ser is not None:
+			self.engine = ATEngine(self.link.write)
+			self.engine.register_urc('+UUPSDA', self.onPDPURC)
+			self.engine.register_urc('+UUPSDD', self.onPDPURC)
+			self.engine.register_urc('+UUMQTTC', self.onMQTTURC)
+			self.engine.register_urc('+UUMQTTSNC', self.onMQTTSNURC)
+			self.response = Response(ser, self)
+			self.response.start()
+
+	# find the rate of the modem, then switch to the first of LINK_BAUDRATES that works
+	def setupLink(self):
+		if not self.link.verify(self.engine.send, 1) and self.link.detect(self.engine.send, LINK_BAUDRATES) is None:
+			log.info('.. No response from the modem')
+			return False
+		if LINK_BAUDRATES:
+			log.info('.. Serial link at '+str(self.link.negotiate(self.command_send, LINK_BAUDRATES))+' baud')
+		return True
+
+	# send commands as one batch, see at_batch, return the BatchResult
+	def command_batch(self, commands, timeout=2):
+		batch = ATBatch(self.command_send, AT_CHAINING).run(commands, timeout)
+		if not batch.ok:
+			log.info('.. Command failed: '+batch.failed+' -> '+str(batch.result))
+		return batch
+
+	# stop the running flow, pending and further commands return at once
+	def abort(self):
+		self.aborted = True
+
+	def close(self):
+		# the next start opens the port at 115200
+		if self.response is not None:
+			self.link.restore(self.engine.send)
+			log.info('.. Serial link: '+str(self.link.throughput()))
+		self.abort()
+		if self.response is not None:
+			self.response.stop()
+			self.response.join()
+		if self.ser is not None:
+			self.ser.close()
+		if self.link is not None and self.link.capture is not None:
+			self.link.capture.close()
+		if self.payloadQueue is not None:
+			self.payloadQueue.close()
+		self.positions.cancel_all()
+		if self.uplink is not None:
+			if self.uplinkSubscribed:
+				self.uplink.unsubscribe(MQTT_SUB_TOPIC, self.onPosition)
+			uplinkPool.release(self.uplink)
+			self.uplink = None
+
+	# close the broker session and the PDP context kept open by KEEP_CONNECTION
+	def disconnect(self):
+		if self.URC_STATE['mqttConnected']:
+			self.command_send('AT+UMQTTC=0', 10)
+			self.Waitfor("+UUMQTTC: 0,1", 30)
+		if self.URC_STATE['mqttsnConnected']:
+			self.command_send('AT+UMQTTSNC=0', 10)
+			self.Waitfor("+UUMQTTSNC: 0,1", 30)
+		if self.URC_STATE['pdpActive']:
+			self.PDP_Context_activate(0)
+		if self.gnssOn:
+			self.command_send('at+UGPS=0', 10)
+			self.gnssOn = False
+
+	# Whether "tsudp" APN is set, it is needed for MQTT-SN
+	def checkAPN(self):
+		result, lines = self.command_send('at+cgdcont?', 2)
+		if not any("tsudp" in line for line in lines):
+			log.info(str(lines))
+			log.info('*** TS SIM card with "tsudp" is needed for MQTT-SN ***')
+			log.info('*** APN is incorrect ***')
+			return False
+		return True
+
+	# PDP context, profile and GNSS channel before the CloudLocate runs
+	# return False when the host uplink is used, it needs neither the PDP context nor the broker profile of the modem,
+	# None when the profile cannot be saved, nothing could be published with it
+	def prepare(self):
+		modemUplink = not (MQTTPubData and UPLINK == "host")
+		if modemUplink and not (KEEP_CONNECTION and self.isPDPActive()):
+			self.PDP_Context_activate(1)
 			
-			if(MQTTSN_SUB_TOPIC):
-				#Subscribe a Topic for getting back the position
-				print('.. Subscribe a Topic for getting back the position')
-				command_send('AT+UMQTTSNC=5,1,0,"'+MQTTSN_SUB_TOPIC+'"')
-				Waitfor("+UUMQTTSNC: 5,1,0,2", 15)
+		self.metrics.begin('profile_setup')
+		saved = True
+		if (MQTTPubData == True):
+			if modemUplink and not (KEEP_CONNECTION and self.MQTTProfileStored()):
+				saved = self.SetMQTTProfile()
+		else :
+			if not (KEEP_CONNECTION and self.MQTTSNProfileStored()):
+				saved = self.SetMQTTSNProfile()
+		self.metrics.end('profile_setup')
+		if not saved:
+			log.info('.. Cannot save the '+('MQTT' if MQTTPubData else 'MQTT-SN')+' profile')
+			if modemUplink and not KEEP_CONNECTION:
+				self.PDP_Context_activate(0)
+			return None
 			
-			# Publish a File within 1017 bytes to TopicID "1"
-			print('.. Publish message to TopicID "1"')
-			command_send('AT+UMQTTSNC=11,0,0,0,"1","CloudLocate_pub_data.txt"')
-			Waitfor("+UUMQTTSNC: 11,1",30)
-				
-			if (MQTTSN_SUB_TOPIC):
-				if(Waitfor("+UUMQTTSNC: 9,1",30)):
-					command_send('AT+UMQTTSNC=9,1')
-					Waitfor("OK",5)
-
-# disconnect MQTT broker
-	print('Disconnect a MQTT-SN Thing')
-	command_send('AT+UMQTTSNC=0')
-	Waitfor("+UUMQTTSNC: 0,1", 30)
-	
-def CloudLocate_run():
-	print('.. Retrieve UBX-RXM-MEASX')
-	# GNSS on
-	command_send('at+UGPS=1,1')  #no aiding:1,0; local aiding:1,1; offline:1,2; online:1,4; autonomous:1,8;   
-	Waitfor("OK", 10)
-
-	global MEASX_MESSAGE
-	global EPOCHS
-
-	FALLBACK_METHODOLOGY_STATUS = True
-	# this counter keeps track of the number of valid messages, messages that fit 
-	# the configuration parameters above
-	global validMessageCounter
-	validMessageCounter = 0
-	
-	if(GNSS_TYPE == "GPS"):
-		command_send('AT+UGUBX="B562063E3C000000200700081000010001010101030000000101020408000000010103081000000001010400080000000101050003000100050106080E0000000001307F"') #GPS+QZSS (UBX-CFG-GNSS)
-		Waitfor("OK", 1)
-	elif(GNSS_TYPE == "GALILEO"):
-		command_send('AT+UGUBX="B562063E3C000000200700081000000001010101030000000101020408000100010103081000000001010400080000000101050003000000000106080E00000000012A31"') #Galileo
-		Waitfor("OK", 1)
-	elif (GNSS_TYPE == "BEIDOU"):
-		command_send('AT+UGUBX="B562063E3C000000200700081000000001010101030000000101020408000000010103081000010001010400080000000101050003000000000106080E00000000012A29"') #Beidou
-		Waitfor("OK", 1)
-		command_send('AT+UGUBX="B5620617140000400002000000000100000100000000000000007550"') #extend3digit(UBX-CFG-NMEA)
-		Waitfor("OK", 1)
-	elif (GNSS_TYPE == "GLONASS"):
-		command_send('AT+UGUBX="B562063E3C000000200700081000000001010101030000000101020408000000010103081000000001010400080000000101050003000000000106080E00010001012B13"') #GLONASS
-		Waitfor("OK", 1)
-
-	time.sleep(5)
-	startTime = time.time()
-	while (time.time()-startTime) <= (TIMEOUT + extendedTime) and validMessageCounter < EPOCHS :
-		command_send('AT+UGUBX="B562021400001644"') #UBX-RXM-MEASX
-		Waitfor("OK", 10)	#timeout is defined by at commands manual	
-
-	# GNSS off
-	command_send('at+UGPS=0')
-	Waitfor("OK", 10)
-
-	# ninth step: see if we were able to get MEASX messages as per our requirement
-	if validMessageCounter < EPOCHS :
-	    # we did not find any MEASX message as per our requirement,
-		# so, we will check processed MEASX messages to see if they fall under our fallback criteria
-		if (FALLBACK_METHODOLOGY == FallbackConfig.FALLBACK_DO_NOT_SEND):
-			print("No fallback configuration selected. Please tweak your desired criteria (or choose a different fallback methodology) to get MEASX message")
-			FALLBACK_METHODOLOGY_STATUS = False  #exit()
-    
-		# if this fallback is selected, we've already extended the timeout in main loop, and we did not find any MEASX message
-		if (FALLBACK_METHODOLOGY == FallbackConfig.FALLBACK_EXTEND_TIMEOUT):
-			print('No message found while using fallback configuration. Please tweak your desired criteria (or choose a different fallback methodology) to get MEASX message')
-			FALLBACK_METHODOLOGY_STATUS = False  #exit()
+		self.command_send('at+UGPRF=1', 2)  #Set GNSS channel 
+		return modemUplink
+
+	# the "run" command: PDP context, profile and retry_times CloudLocate runs
+	# return the number of runs which published a MEASX message or got the position from FIX_CACHE
+	def run(self, retry_times=None, wait_time=None):
+		retry_times = int(run_retry_times if retry_times is None else retry_times)
+		wait_time = int(run_wait_time if wait_time is None else wait_time)
+		modemUplink = self.prepare()
+		if modemUplink is None:
+			return 0
+		if PIPELINE:
+			published = self.runPipelined(retry_times, wait_time, modemUplink)
+			log.info('... Measure Done')
+			if modemUplink and not KEEP_CONNECTION:
+				self.PDP_Context_activate(0)
+			return published
+		
+		published = 0
+		Measure_count=0
+		while True:
+			if (Measure_count >= retry_times or self.aborted):
+				# the positions of runs which did not wait for them
+				if not positionWait():
+					self.collectPositions(POSITION_TIMEOUT)
+				log.info('... Measure Done')
+				if modemUplink and not KEEP_CONNECTION:
+					self.PDP_Context_activate(0)
+				break
+			else:
+				Measure_count +=1
+				# the PDP context was dropped (+UUPSDD) while it was kept open
+				if modemUplink and KEEP_CONNECTION and not self.URC_STATE['pdpActive']:
+					self.PDP_Context_activate(1)
+				if self.CloudLocate_run():
+					published += 1
+					self.metrics.finish('cached' if self.positionCached else 'published')
+				else:
+					self.metrics.finish('failed')
+				if (Measure_count < retry_times):
+					log.info('.. Waiting '+str(wait_time)+ ' seconds for the next action. Remaining testing times : '+str(retry_times - Measure_count))
+					# waiting for the next action.
+					time.sleep(wait_time)
+		return published
+
+	# the runs of PIPELINE: the AT channel goes from one acquisition to the next, the uploads of the host uplink
+	# and the positions complete in between; return the number of runs which published a MEASX message or got the position from FIX_CACHE
+	def runPipelined(self, retry_times, wait_time, modemUplink):
+		if modemUplink and not KEEP_CONNECTION:
+			log.warning('.. PIPELINE without KEEP_CONNECTION: every publish waits for its position')
+		resolved = []
+		self.positions.callbacks.append(resolved.append)
+		startTime = time.time()
+		published = 0
+		Measure_count = 0
+		while Measure_count < retry_times and not self.aborted:
+			Measure_count += 1
+			cycleStart = time.time()
+			# the PDP context was dropped (+UUPSDD) while it was kept open
+			if modemUplink and KEEP_CONNECTION and not self.URC_STATE['pdpActive']:
+				self.PDP_Context_activate(1)
+			if self.CloudLocate_run():
+				published += 1
+				self.metrics.finish('cached' if self.positionCached else 'published')
+			else:
+				self.metrics.finish('failed')
+			# uploads which got their PUBACK during the acquisition
+			published -= self.settleUploads(False)
+			if Measure_count < retry_times:
+				nextStart = cycleStart + wait_time
+				log.info('.. Next acquisition in '+str(max(int(nextStart - time.time()), 0))+' seconds, '+str(len(self.positions))+' positions pending. Remaining testing times : '+str(retry_times - Measure_count))
+				# the positions are read while the next acquisition is not due
+				self.collectPositions(max(nextStart - time.time(), 0))
+				if nextStart > time.time():
+					time.sleep(nextStart - time.time())
+		published -= self.settleUploads(True)
+		self.collectPositions(POSITION_TIMEOUT)
+		self.positions.callbacks.remove(resolved.append)
+		elapsed = max(time.time() - startTime, 0.001)
+		log.info(f'.. Pipeline: {published} of {Measure_count} runs published, {len(resolved)} positions in {elapsed:.0f} seconds, {len(resolved)*3600/elapsed:.0f} fixes/hour')
+		return published
+
+	# the host uplink publishes of PIPELINE which got their PUBACK, block: wait for all of them
+	# a payload without PUBACK is queued and its position cancelled, return the number of those
+	def settleUploads(self, block):
+		acked = 0
+		failed = 0
+		while self.uploads and (block or self.uploads[0][0].done()):
+			future, MQTT_MSG, positionFuture = self.uploads.popleft()
+			if self.uplink.wait(future):
+				acked += 1
+				continue
+			failed += 1
+			if positionFuture is not None:
+				positionFuture.cancel()
+			if self.payloadQueue is not None:
+				dropped = self.payloadQueue.put(MQTT_MSG)
+				log.info('.. Payload without PUBACK queued, '+str(len(self.payloadQueue))+' in queue'+(', dropped the oldest '+str(dropped) if dropped else ''))
+		# the broker is reachable again, publish the payloads queued during a coverage gap
+		if acked and not failed:
+			self.drainQueueUplink()
+		return failed
+
+	# UBX frames other than MEASX, called from the Response thread
+	def onUBXFrame(self, frame):
+		msgClass, msgId = frame[2], frame[3]
+		# UBX-ACK-ACK / UBX-ACK-NAK carry class and id of the acknowledged message
+		if msgClass == 0x05 and len(frame) >= 10:
+			with self.ubxAckCondition:
+				self.ubxAck[(frame[6], frame[7])] = (msgId == 0x01)
+				self.ubxAckCondition.notify_all()
+		# UBX-CFG-RATE: measRate in ms
+		elif msgClass == 0x06 and msgId == 0x08 and len(frame) >= 14:
+			self.measxScheduler.set_rate(frame[6] | (frame[7] << 8))
+
+	# wait up to timeout seconds for the UBX-ACK of (class, id): True for ACK, False for NAK, None without one
+	def waitUBXAck(self, key, timeout):
+		with self.ubxAckCondition:
+			self.ubxAckCondition.wait_for(lambda: key in self.ubxAck or self.aborted, timeout)
+			return self.ubxAck.get(key)
+
+	# function that goes through MEASX messages to find the one that matches selected fallback methodology
+	def apply_fallback_logic(self, fallbackLogic, epochs, satellites):
+		# first check if we at least have enough messages (as per our required EPOCHS)
+		if len(self.epochStore) < epochs:
+			return False
 
-		if FALLBACK_METHODOLOGY == FallbackConfig.FALLBACK_NO_OF_SATELLITIES_ONLY:
-			fallback_result = apply_fallback_logic(FallbackConfig.FALLBACK_NO_OF_SATELLITIES_ONLY, EPOCHS, FALLBACK_CONFIG[FallbackConfig.FALLBACK_NO_OF_SATELLITIES_ONLY])
-			if fallback_result == False:
-				print('No message found while using fallback configuration. Please tweak your desired criteria (or choose a different fallback methodology) to get MEASX message')
-				FALLBACK_METHODOLOGY_STATUS = False  #exit()
-			MEASX_MESSAGE = fallback_result
+		# start looking for the messages with highest CNO (carrier-to-noise) that fulfill our fallback criteria
+		store = self.epochStore
+		selected = store.top_by_max_cno(epochs, lambda slot: get_satellite_count_per_configuration(fallbackLogic, store, slot) >= satellites)
+		if (len(selected) < epochs):
+			return False
 
-		elif FALLBACK_METHODOLOGY == FallbackConfig.FALLBACK_EPOCHS:
-			fallback_result = apply_fallback_logic(FallbackConfig.FALLBACK_EPOCHS, FALLBACK_CONFIG[FallbackConfig.FALLBACK_EPOCHS], MIN_NO_OF_SATELLITES)
-			if fallback_result == False:
-				print('No message found while using fallback configuration. Please tweak your desired criteria (or choose a different fallback methodology) to get MEASX message')
-				FALLBACK_METHODOLOGY_STATUS = False  #exit()
-			MEASX_MESSAGE = fallback_result
+		log.info(f'Using fallback configuration: {fallbackLogic.name}')
+		MEASX_MESSAGE = bytearray()
+		for slot in selected:
+			MEASX_MESSAGE.extend(MEASX_HEADER)
+			MEASX_MESSAGE.extend(store.messages[slot])
+		return MEASX_MESSAGE
 
-	if FALLBACK_METHODOLOGY_STATUS == False :
+	# the MEASX message of FALLBACK_METHODOLOGY from the messages read so far, False if there is none
+	def selectFallback(self):
+		if FALLBACK_METHODOLOGY == FallbackConfig.FALLBACK_NO_OF_SATELLITIES_ONLY:
+			return self.apply_fallback_logic(FallbackConfig.FALLBACK_NO_OF_SATELLITIES_ONLY, EPOCHS, FALLBACK_CONFIG[FallbackConfig.FALLBACK_NO_OF_SATELLITIES_ONLY])
+		elif FALLBACK_METHODOLOGY == FallbackConfig.FALLBACK_EPOCHS:
+			return self.apply_fallback_logic(FallbackConfig.FALLBACK_EPOCHS, FALLBACK_CONFIG[FallbackConfig.FALLBACK_EPOCHS], MIN_NO_OF_SATELLITES)
 		return False
 
-	print(f"Final Measx: {MEASX_MESSAGE.hex()}")
-	print(".. Measure time : "+ str(int((time.time()-startTime))) +" seconds")
+	# send an AT command, with a timeout it waits for the final result code and returns (result, lines)
+	# result is "OK", "ERROR", "+CME ERROR: ..." or None if the timeout expired
+	def command_send(self, at_cmd, timeout=None):
+		if self.aborted:
+			return (None, [])
+		log.stamped(self.prefix+'input->'+at_cmd)
+		return self.engine.send(at_cmd, timeout)
+
+	# wait for a line (e.g. a URC) received since the last command was sent
+	def Waitfor(self, at_cmd, timeout):
+		if self.aborted:
+			return False
+		return self.engine.wait_for(at_cmd, timeout)
+
+	# URC handlers, they run on the Response thread and only update self.URC_STATE
+	def onPDPURC(self, line):
+		if line.startswith('+UUPSDA:'):
+			self.URC_STATE['pdpAddress'] = line.split(',')[-1].strip('"')
+			self.URC_STATE['pdpActive'] = line.startswith('+UUPSDA: 0,')
+		else: #+UUPSDD
+			self.URC_STATE['pdpAddress'] = None
+			self.URC_STATE['pdpActive'] = False
+			self.URC_STATE['mqttConnected'] = False
+			self.URC_STATE['mqttsnConnected'] = False
+
+	def onMQTTURC(self, line):
+		# +UUMQTTC: 1,1 connected; +UUMQTTC: 0,<result> disconnected, requested or dropped by the broker
+		if line.startswith('+UUMQTTC: 1,'):
+			self.URC_STATE['mqttConnected'] = line.startswith('+UUMQTTC: 1,1')
+			self.URC_STATE['mqttSubscribed'] = False
+		elif line.startswith('+UUMQTTC: 0,'):
+			self.URC_STATE['mqttConnected'] = False
+			self.URC_STATE['mqttSubscribed'] = False
+		elif line.startswith('+UUMQTTC: 4,1,'):
+			self.URC_STATE['mqttSubscribed'] = True
+		elif line.startswith('+UUMQTTC: 6,'):
+			# number of received messages, read with AT+UMQTTC=6
+			self.URC_STATE['unreadMessages'] = int(line.split(',')[1])
+
+	def onMQTTSNURC(self, line):
+		if line.startswith('+UUMQTTSNC: 1,'):
+			self.URC_STATE['mqttsnConnected'] = line.startswith('+UUMQTTSNC: 1,1')
+			self.URC_STATE['mqttsnRegistered'] = False
+			self.URC_STATE['mqttsnSubscribed'] = False
+		elif line.startswith('+UUMQTTSNC: 0,'):
+			self.URC_STATE['mqttsnConnected'] = False
+			self.URC_STATE['mqttsnRegistered'] = False
+			self.URC_STATE['mqttsnSubscribed'] = False
+		elif line.startswith('+UUMQTTSNC: 2,1,'):
+			self.URC_STATE['mqttsnRegistered'] = True
+		elif line.startswith('+UUMQTTSNC: 5,1,'):
+			self.URC_STATE['mqttsnSubscribed'] = True
+		elif line.startswith('+UUMQTTSNC: 9,'):
+			self.URC_STATE['unreadMessages'] = int(line.split(',')[1])
+
+	# return True when the file is saved
+	def SaveJSON2FFS(self, str_payload):
+		length_str_payload = str(len(str_payload))
+		self.command_send('AT+UDWNFILE="CloudLocate_pub_data.txt",'+ length_str_payload)
+		# the file content is sent once the modem is ready for it
+		if not self.Waitfor(">", 5):
+			return False
+		result, lines = self.command_send(str_payload, 25)
+		return result == "OK"
+
+	def DelJSON_FFS(self):
+		self.command_send('AT+UDELFILE="CloudLocate_pub_data.txt"', 2)
+	#	time.sleep(2)
+
+	# +UPSND: 0,8,1 when the PDP context of profile 0 is active
+	def isPDPActive(self):
+		result, lines = self.command_send('AT+UPSND=0,8', 2)
+		self.URC_STATE['pdpActive'] = '+UPSND: 0,8,1' in lines
+		return self.URC_STATE['pdpActive']
+
+	def PDP_Context_activate(self, activate_flag):
+		if (activate_flag==1):
+			log.info('.. PDP Context activate')
+			self.metrics.begin('pdp_activate')
+			# network status and PDP profile in one round trip
+			self.command_batch(['at+cops?', 'at+CSQ', 'at+CGATT?', 'AT+UPSD=0,100,1', 'AT+UPSD=0,0,0'], 2)
+
+			self.command_send('AT+UPSDA=0,3', 10)
+			self.Waitfor("+UUPSDA", 5)
+			self.metrics.end('pdp_activate')
+		else:
+			log.info('.. PDP Context deactivate')
+			self.command_send('AT+UPSDA=0,4', 10)
+			self.Waitfor("+UUPSDD", 5)
+
+	# read profile parameters in one batch, e.g. ['AT+UMQTT=2'] -> {'AT+UMQTT=2': '2,"mqtt.thingstream.io",1883'}
+	def readProfiles(self, commands):
+		batch = self.command_batch(commands, 2)
+		values = {}
+		for at_cmd in commands:
+			prefix = at_cmd[2:].split('=')[0]+':'
+			op = at_cmd.split('=')[1]+','
+			values[at_cmd] = ''
+			for line in batch.lines:
+				value = line.split(':', 1)[1].strip() if line.startswith(prefix) else ''
+				if value.startswith(op):
+					values[at_cmd] = value
+					break
+		return values
+
+	# whether the MQTT profile stored in NVM already matches the credentials, so it need not be written again
+	def MQTTProfileStored(self):
+		self.command_send('AT+UMQTTNV=1', 2)
+		profile = self.readProfiles(['AT+UMQTT=0', 'AT+UMQTT=2', 'AT+UMQTT=4', 'AT+UMQTT=10'])
+		return (profile['AT+UMQTT=0'] == '0,"'+DeviceID+'"'
+			and profile['AT+UMQTT=2'].startswith('2,"'+Hostname+'"')
+			and profile['AT+UMQTT=4'].startswith('4,"'+Username+'"')
+			and profile['AT+UMQTT=10'].startswith('10,60'))
+
+	# the MQTT-SN profile is not saved in NVM, it is checked in the running configuration
+	def MQTTSNProfileStored(self):
+		profile = self.readProfiles(['AT+UMQTTSN=0', 'AT+UMQTTSN=2', 'AT+UMQTTSN=8'])
+		return (profile['AT+UMQTTSN=0'] == '0,"'+SNuniqueID+'"'
+			and profile['AT+UMQTTSN=2'] == '2,"'+SNSerevrIP+'",'+SNServerPort
+			and profile['AT+UMQTTSN=8'] == '8,'+SNServerDuration)
+
+	# return True when every command of the profile returned OK
+	def SetMQTTProfile(self):
+		log.info('.. Save MQTT profile')
+		return self.command_batch([
+			'AT+UMQTT=0,"'+DeviceID+'"',	# Unique Client ID
+			'AT+UMQTT=2,"'+Hostname+'"',	# Host server
+			'AT+UMQTT=4,"'+Username+'","'+Password+'"',	# Username and password
+			'AT+UMQTT=10,60',	# keep alive time (seconds)
+			'AT+UMQTTNV=2'		# Save MQTT profile
+			], 2).ok
+
+	# return True when every command of the profile returned OK
+	def SetMQTTSNProfile(self):
+		log.info('.. Save MQTT-SN profile')
+		return self.command_batch([
+			'AT+UMQTTSN=0,"'+SNuniqueID+'"',	# Client ID
+			'AT+UMQTTSN=2,"'+SNSerevrIP+'",'+SNServerPort,	# Host and Port
+			'AT+UMQTTSN=8,'+SNServerDuration	# Duration (seconds)
+			], 2).ok
+
+	# Save MQTT-SN profile
+	#	self.command_send('AT+UMQTTSNNV=2')  
+	#	time.sleep(0.5)
+
+	def SubPOSTOPIC(self):
+		if MQTT_SUB_TOPIC:
+			log.info('.. Subscribe a TOPIC as '+ MQTT_SUB_TOPIC)
+			self.command_send('AT+UMQTTC=4,0,"'+MQTT_SUB_TOPIC+'"', 10)
+			self.Waitfor("+UUMQTTC: 4,1,0,",30)
+
+	# connect the broker and subscribe, a session kept by KEEP_CONNECTION is reused
+	def MQTTConnect(self):
+		if KEEP_CONNECTION and self.URC_STATE['mqttConnected']:
+			log.info('.. Reuse MQTT broker session')
+		else:
+		# Restore MQTT profile from NVM
+			self.metrics.begin('broker_connect')
+			self.command_send('AT+UMQTTNV=1', 2)
+
+		# Connect MQTT broker
+			log.info('.. Connect MQTT broker')
+			self.command_send('AT+UMQTTC=1', 10)
+			connected = self.Waitfor("+UUMQTTC: 1,1", 120)
+			self.metrics.end('broker_connect')
+			if not connected:
+				return False
 
-    # tenth step: convert our MEASX byte-array into base64 encoded string
-	BASE64_ENC_PAYLOAD = base64.b64encode(MEASX_MESSAGE).decode()
-	MEASX_MESSAGE = bytearray()  #clear buffer
-	
-	# eleventh step: create JSON payload, which will be sent to CloudLocate, 
-	# exit if it exceeds 8KB
-	MQTT_MSG ='{"body":"'+BASE64_ENC_PAYLOAD+'","headers":{"UTCDateTime":"'+getUTCTime()+'"}}'
-#	print(MQTT_MSG)
-	
-	if (MQTTPubData == True):
-		if len(MQTT_MSG) > 8192:
-			print("Cannot send MQTT message greath than 8KB. Please reduce the number of EPOCHS in configuration parameters to reduce the size.")
+		#subscribe a topic for the positon
+		if not self.URC_STATE['mqttSubscribed']:
+			with self.metrics.span('subscribe'):
+				self.SubPOSTOPIC()
+		return True
+
+	# publish over the open broker session, the JSON payload in the command or the FFS file when payload is None,
+	# then read the position sent back on MQTT_SUB_TOPIC
+	def MQTTPublish(self, payload=None):
+		self.metrics.begin('publish')
+		if payload is None:
+			# publish payload from FFS
+			log.info('.. Publish JSON to TS')
+			self.command_send('AT+UMQTTC=3,0,0,"'+ MQTT_PUB_TOPIC +'","CloudLocate_pub_data.txt"', 10)
+			published = self.Waitfor("+UUMQTTC: 3,1", 30)
+		else:
+			# publish payload in the command, as hex because the JSON contains quotes
+			log.info('.. Publish JSON to TS without FFS file')
+			self.command_send('AT+UMQTTC=2,0,0,1,"'+ MQTT_PUB_TOPIC +'","'+ payload.encode().hex().upper() +'"', 10)
+			published = self.Waitfor("+UUMQTTC: 2,1", 30)
+		self.metrics.end('publish')
+
+		if published and MQTT_SUB_TOPIC and (positionWait() or not KEEP_CONNECTION):
+			with self.metrics.span('position_response'):
+				if (self.Waitfor("+UUMQTTC: 6,",30)):
+					self.readPositions()
+		return published
+
+	# connect, publish and disconnect, see MQTTPublish() for payload
+	def PubDataCloud(self, payload=None):
+		published = False
+		connected = False
+		# with KEEP_CONNECTION a dropped session (+UUMQTTC: 0 or keep-alive failure) is connected once more
+		for attempt in range(2 if KEEP_CONNECTION else 1):
+			connected = self.MQTTConnect()
+			if not connected:
+				break
+			published = self.MQTTPublish(payload)
+			if published or not KEEP_CONNECTION:
+				break
+			log.info('.. MQTT broker session dropped, connect again')
+			self.URC_STATE['mqttConnected'] = False
+
+		if connected:
+			# the broker is reachable again, publish the payloads queued during a coverage gap
+			if published:
+				self.drainQueue(self.MQTTPublish, MQTT_PAYLOAD_LIMIT)
+
+			# disconnect MQTT broker
+			if not KEEP_CONNECTION:
+				self.command_send('AT+UMQTTC=0', 10)
+				self.Waitfor("+UUMQTTC: 0,1", 30)
+		return published
+
+	# the position sent back on MQTT_SUB_TOPIC over the host uplink, called from its reader thread
+	def onPosition(self, topic, payload):
+		log.stamped(self.prefix+'position->'+payload.decode(errors='replace'))
+		self.positions.resolve(topic, payload)
+
+	# connect the shared host uplink unless it is open and subscribe MQTT_SUB_TOPIC
+	def HostConnect(self):
+		if self.uplink is None:
+			self.uplink = uplinkPool.acquire(Hostname, UPLINK_PORT, DeviceID, username=Username, password=Password,
+				keepalive=60, window=UPLINK_WINDOW, tls=UPLINK_TLS, log=log)
+		if self.uplink.connected:
+			log.info('.. Reuse MQTT uplink of the host')
+		else:
+			log.info('.. Connect MQTT uplink of the host to '+Hostname+':'+str(UPLINK_PORT))
+			with self.metrics.span('broker_connect'):
+				if not self.uplink.connect():
+					return False
+		if MQTT_SUB_TOPIC and not self.uplinkSubscribed:
+			log.info('.. Subscribe a TOPIC as '+ MQTT_SUB_TOPIC)
+			with self.metrics.span('subscribe'):
+				self.uplinkSubscribed = self.uplink.subscribe(MQTT_SUB_TOPIC, self.onPosition)
+		return True
+
+	# publish the JSON payload over the host uplink instead of the modem, no FFS file is written
+	# then wait for the position sent back on MQTT_SUB_TOPIC
+	def HostPubDataCloud(self, MQTT_MSG):
+		if not self.HostConnect():
 			return False
-	else :
-		if len(MQTT_MSG) > 1017:
-			print("Cannot send MQTT-SN message greath than 1017 Bytes. Please reduce the number of EPOCHS in configuration parameters to reduce the size.")
+		log.info('.. Publish JSON to TS over the host uplink')
+		if PIPELINE:
+			# the PUBACK is settled by settleUploads(), the next acquisition starts at once
+			self.uploads.append((self.uplink.publish_async(MQTT_PUB_TOPIC, MQTT_MSG), MQTT_MSG, self.positionFuture))
+			return True
+		with self.metrics.span('publish'):
+			published = self.uplink.publish(MQTT_PUB_TOPIC, MQTT_MSG)
+		if published and MQTT_SUB_TOPIC and positionWait() and self.positionFuture is not None:
+			with self.metrics.span('position_response'):
+				concurrent.futures.wait([self.positionFuture], 30)
+		# the broker is reachable again, publish the payloads queued during a coverage gap
+		if published:
+			self.drainQueueUplink()
+		return published
+
+	# read the received messages of the modem and resolve the requests of their positions
+	def readPositions(self):
+		self.URC_STATE['unreadMessages'] = 0
+		if MQTTPubData:
+			result, lines = self.command_send('AT+UMQTTC=6', 5)
+		else:
+			result, lines = self.command_send('AT+UMQTTSNC=9,1', 5)
+		for line in lines:
+			message = parse_read_line(line)
+			if message is not None and self.positions.resolve(*message) is None:
+				log.info('.. Message matches no request: '+message[1])
+
+	# wait up to timeout seconds for the positions still pending, e.g. before the session is closed
+	def collectPositions(self, timeout):
+		deadline = time.time() + timeout
+		while len(self.positions) and not self.aborted and time.time() < deadline:
+			if self.uplink is not None and MQTTPubData and UPLINK == "host":
+				time.sleep(0.1)
+			elif self.URC_STATE['unreadMessages']:
+				self.readPositions()
+			else:
+				self.Waitfor("+UUMQTTC: 6," if MQTTPubData else "+UUMQTTSNC: 9,", min(1, max(deadline - time.time(), 0)))
+
+	def printPosition(self, position):
+		log.info('.. Position: '+repr(position))
+
+	# one CloudLocate run, return the Future of its Position
+	# it is cancelled when no payload was published, and fails with PositionTimeout without reply
+	# the spans of the run are finished here, as run() does for its runs
+	def requestFix(self):
+		published = False
+		try:
+			published = self.CloudLocate_run()
+		finally:
+			self.metrics.finish(('cached' if self.positionCached else 'published') if published else 'failed')
+		if self.positionFuture is None:
+			future = concurrent.futures.Future()
+			future.cancel()
+			return future
+		return self.positionFuture
+
+	# connect the MQTT-SN Thing, register the topic and subscribe, a session kept by KEEP_CONNECTION is reused
+	def MQTTSNConnect(self):
+	# Restore MQTT profile from NVM
+	#	self.command_send('AT+UMQTTSNNV=1')  
+	#	time.sleep(0.5)
+
+		if KEEP_CONNECTION and self.URC_STATE['mqttsnConnected']:
+			log.info('.. Reuse MQTT-SN session')
+		else:
+		# Connect MQTTSN Thing
+			log.info('.. Connect a MQTT-SN Thing')
+			with self.metrics.span('broker_connect'):
+				self.command_send('AT+UMQTTSNC=1', 10)
+				connected = self.Waitfor("+UUMQTTSNC: 1,1", 120)
+			if not connected:
+				return False
+
+		# topic registration and subscription
+		with self.metrics.span('subscribe'):
+			return self.MQTTSNSubscribe()
+
+	# register MQTTSN_PUB_TOPIC and subscribe MQTTSN_SUB_TOPIC, unless the kept session has done it
+	def MQTTSNSubscribe(self):
+		if not self.URC_STATE['mqttsnRegistered']:
+			#Register a Topic for CloudLocate
+			log.info('.. Register a Topic')
+			self.command_send('AT+UMQTTSNC=2,"'+MQTTSN_PUB_TOPIC+'"', 10)
+			if not self.Waitfor("+UUMQTTSNC: 2,1,1", 60):
+				return False
+
+		if(MQTTSN_SUB_TOPIC) and not self.URC_STATE['mqttsnSubscribed']:
+			#Subscribe a Topic for getting back the position
+			log.info('.. Subscribe a Topic for getting back the position')
+			self.command_send('AT+UMQTTSNC=5,1,0,"'+MQTTSN_SUB_TOPIC+'"', 10)
+			self.Waitfor("+UUMQTTSNC: 5,1,0,2", 15)
+		return True
+
+	# publish over the open MQTT-SN session, the JSON payload in the command or the FFS file when payload is None,
+	# then read the position sent back on MQTTSN_SUB_TOPIC
+	def MQTTSNPublish(self, payload=None):
+		self.metrics.begin('publish')
+		if payload is None:
+			# Publish a File within 1017 bytes to TopicID "1"
+			log.info('.. Publish message to TopicID "1"')
+			self.command_send('AT+UMQTTSNC=11,0,0,0,"1","CloudLocate_pub_data.txt"', 10)
+			published = self.Waitfor("+UUMQTTSNC: 11,1",30)
+		else:
+			# Publish the message as hex to TopicID "1", without FFS file
+			log.info('.. Publish message to TopicID "1" without FFS file')
+			self.command_send('AT+UMQTTSNC=4,0,0,1,0,"1","'+ payload.encode().hex().upper() +'"', 10)
+			published = self.Waitfor("+UUMQTTSNC: 4,1",30)
+		self.metrics.end('publish')
+
+		if published and (MQTTSN_SUB_TOPIC) and (positionWait() or not KEEP_CONNECTION):
+			with self.metrics.span('position_response'):
+				if(self.Waitfor("+UUMQTTSNC: 9,",30)):
+					self.readPositions()
+		return published
+
+	# connect, publish and disconnect, see MQTTSNPublish() for payload
+	def MQTTSNPubDataCloud(self, payload=None):
+		published = False
+		# with KEEP_CONNECTION a dropped session is connected once more
+		for attempt in range(2 if KEEP_CONNECTION else 1):
+			if not self.MQTTSNConnect():
+				break
+			published = self.MQTTSNPublish(payload)
+			if published or not KEEP_CONNECTION:
+				break
+			log.info('.. MQTT-SN session dropped, connect again')
+			self.URC_STATE['mqttsnConnected'] = False
+			self.URC_STATE['mqttsnRegistered'] = False
+			self.URC_STATE['mqttsnSubscribed'] = False
+
+		# the Thing is reachable again, publish the payloads queued during a coverage gap
+		if published:
+			self.drainQueue(self.MQTTSNPublish, MQTTSN_PAYLOAD_LIMIT)
+
+	# disconnect MQTT broker
+		if not KEEP_CONNECTION:
+			log.info('Disconnect a MQTT-SN Thing')
+			self.command_send('AT+UMQTTSNC=0', 10)
+			self.Waitfor("+UUMQTTSNC: 0,1", 30)
+		return published
+
+	# save MQTT_MSG into FFS unless it is published in the AT command,
+	# return the payload argument of PubDataCloud() / MQTTSNPubDataCloud(), False when the file cannot be saved
+	def stagePayload(self, MQTT_MSG):
+		# a small payload is published in the AT command, no flash write
+		if PUBLISH_MODE == "auto" and len(MQTT_MSG) <= DIRECT_PUBLISH_LIMIT:
+			return MQTT_MSG
+		with self.metrics.span('ffs_write'):
+			# Delet JSON file on FFS
+			self.DelJSON_FFS()
+			# Save JSON file into FFS
+			saved = self.SaveJSON2FFS(MQTT_MSG)
+		if not saved:
+			log.info('.. Cannot save JSON file into FFS')
 			return False
+		return None
+
+	# publish up to QUEUE_BATCH queued payloads, oldest first, one at a time so the modem is not overrun
+	# a payload is removed from the queue once it is published, the others wait for the next session.
+	# A payload which can never be published (above limit) is dropped, so it does not hold back the ones
+	# behind it; a failed FFS write is temporary, the payload stays queued
+	def drainQueue(self, publish, limit):
+		if self.payloadQueue is None or len(self.payloadQueue) == 0:
+			return
+		log.info('.. Publish queued payloads, '+str(len(self.payloadQueue))+' in queue')
+		for position, MQTT_MSG in self.payloadQueue.peek(QUEUE_BATCH):
+			if len(MQTT_MSG) > limit:
+				log.info('.. Queued payload of '+str(len(MQTT_MSG))+' bytes is above '+str(limit)+' bytes, dropped')
+				self.payloadQueue.ack(position)
+				continue
+			payload = self.stagePayload(MQTT_MSG)
+			if payload is False:
+				log.info('.. Queued payload cannot be saved into FFS, kept')
+				break
+			if not publish(payload):
+				break
+			self.payloadQueue.ack(position)
+		log.info('.. '+str(len(self.payloadQueue))+' payloads left in queue')
+
+	# publish up to QUEUE_BATCH queued payloads over the host uplink, UPLINK_WINDOW of them in flight at a time
+	# every payload with its PUBACK is removed from the queue; after the first one without PUBACK
+	# no more are started, those in flight are still waited for so they are not published twice
+	def drainQueueUplink(self):
+		if self.payloadQueue is None or len(self.payloadQueue) == 0:
+			return
+		log.info('.. Publish queued payloads, '+str(len(self.payloadQueue))+' in queue')
+		waiting = collections.deque(self.payloadQueue.peek(QUEUE_BATCH))
+		inflight = collections.deque()
+		failed = False
+		while inflight or (waiting and not failed):
+			while waiting and not failed and len(inflight) < UPLINK_WINDOW:
+				position, MQTT_MSG = waiting.popleft()
+				inflight.append((position, self.uplink.publish_async(MQTT_PUB_TOPIC, MQTT_MSG)))
+			position, future = inflight.popleft()
+			if self.uplink.wait(future):
+				self.payloadQueue.remove(position)
+			else:
+				failed = True
+		log.info('.. '+str(len(self.payloadQueue))+' payloads left in queue')
+
+	# GNSS on and UBX-CFG-GNSS for GNSS_TYPE, unless GNSS_KEEP_ON has kept it on since the last run
+	def GNSSOn(self):
+		if self.gnssOn:
+			log.info('.. GNSS kept on, hot start')
+			return
+		# GNSS on
+		with self.metrics.span('gnss_on'):
+			self.command_send('at+UGPS=1,1', 10)  #no aiding:1,0; local aiding:1,1; offline:1,2; online:1,4; autonomous:1,8;   
+		self.gnssOn = True
+
+		with self.ubxAckCondition:
+			self.ubxAck.pop((0x06, 0x3E), None)
+		self.metrics.begin('cfg_gnss_ack')
+		if(GNSS_TYPE == "GPS"):
+			self.command_send('AT+UGUBX="B562063E3C000000200700081000010001010101030000000101020408000000010103081000000001010400080000000101050003000100050106080E0000000001307F"', 1) #GPS+QZSS (UBX-CFG-GNSS)
+		elif(GNSS_TYPE == "GALILEO"):
+			self.command_send('AT+UGUBX="B562063E3C000000200700081000000001010101030000000101020408000100010103081000000001010400080000000101050003000000000106080E00000000012A31"', 1) #Galileo
+		elif (GNSS_TYPE == "BEIDOU"):
+			self.command_send('AT+UGUBX="B562063E3C000000200700081000000001010101030000000101020408000000010103081000010001010400080000000101050003000000000106080E00000000012A29"', 1) #Beidou
+			self.command_send('AT+UGUBX="B5620617140000400002000000000100000100000000000000007550"', 1) #extend3digit(UBX-CFG-NMEA)
+		elif (GNSS_TYPE == "GLONASS"):
+			self.command_send('AT+UGUBX="B562063E3C000000200700081000000001010101030000000101020408000000010103081000000001010400080000000101050003000000000106080E00010001012B13"', 1) #GLONASS
+
+		# the receiver applies the configuration before its UBX-ACK-ACK
+		acknowledged = self.waitUBXAck((0x06, 0x3E), UBX_ACK_TIMEOUT)
+		self.metrics.end('cfg_gnss_ack')
+		if acknowledged is False:
+			log.info('.. UBX-CFG-GNSS is not acknowledged')
+		elif acknowledged is None:
+			log.info('.. No UBX-ACK of UBX-CFG-GNSS within '+str(UBX_ACK_TIMEOUT)+' seconds')
+
+	# keep the resolved position of a published fingerprint for FIX_CACHE
+	def cacheFix(self, fingerprint, future):
+		if not future.cancelled() and future.exception() is None:
+			self.fixCache.add(fingerprint, future.result())
+
+	def CloudLocate_run(self):
+		self.positionFuture = None
+		self.positionCached = False
+		# positions of earlier runs which arrived meanwhile
+		if self.URC_STATE['unreadMessages']:
+			self.readPositions()
+		log.info('.. Retrieve UBX-RXM-MEASX')
+		self.GNSSOn()
+
+		FALLBACK_METHODOLOGY_STATUS = True
+		# this counter keeps track of the number of valid messages, messages that fit 
+		# the configuration parameters above
+		self.validMessageCounter = 0
+		# messages of an earlier run are not used
+		self.MEASX_MESSAGE = bytearray()
+		self.epochStore.reset()
+		self.quality = QualityEstimator(CONSTELLATION_TYPES[GNSS_TYPE], CNO_THRESHOLD, MULTIPATH_INDEX)
+		# True when the messages so far are sent, with fewer than EPOCHS valid messages
+		enough = False
+
+		if self.measxScheduler.rateSource != 'CFG-RATE':
+			self.command_send('AT+UGUBX="B562060800000E30"', 1) #UBX-CFG-RATE, the measurement rate of the receiver
+
+		# no fixed delay: poll until the first valid MEASX, TIMEOUT starts from there
+		# then poll once per measurement, so every poll returns a new epoch
+		self.measxScheduler.reset()
+		readyTime = time.time()
+		startTime = None
+		self.metrics.begin('first_measx')
+		while self.validMessageCounter < EPOCHS and not self.aborted :
+			if startTime is None and (time.time()-readyTime) > GNSS_READY_TIMEOUT:
+				log.info('.. No valid MEASX within '+str(GNSS_READY_TIMEOUT)+' seconds')
+				break
+			if startTime is not None and (time.time()-startTime) > (TIMEOUT + extendedTime):
+				break
+			if self.URC_STATE['unreadMessages']:
+				self.readPositions()
+			self.command_send('AT+UGUBX="B562021400001644"', 10) #UBX-RXM-MEASX, timeout is defined by at commands manual
+			if startTime is None and self.measxScheduler.ready():
+				startTime = self.measxScheduler.readyTime
+				self.metrics.end('first_measx')
+				self.metrics.begin('epochs')
+				log.info(f'.. GNSS ready after {startTime-readyTime:.1f} seconds, MEASX every {self.measxScheduler.rate} ms ({self.measxScheduler.rateSource})')
+			if startTime is not None and self.validMessageCounter < EPOCHS:
+				fraction = (time.time()-startTime)/(TIMEOUT + extendedTime)
+				# good sky: the valid messages so far reach the (relaxing) quality requirement
+				if ADAPTIVE_EPOCHS and self.validMessageCounter >= minimumEpochs() and self.quality.meets(required_quality(QUALITY_TARGET, QUALITY_MINIMUM, fraction)):
+					log.info(f'.. Quality reached with {self.validMessageCounter} of {EPOCHS} epochs: {self.quality.quality()}')
+					enough = True
+					break
+			# poor sky: no valid message yet, use the fallback as soon as it finds one
+			if ADAPTIVE_EPOCHS and startTime is None and (time.time()-readyTime) >= FALLBACK_AFTER*GNSS_READY_TIMEOUT:
+				fallback_result = self.selectFallback()
+				if fallback_result:
+					self.MEASX_MESSAGE = fallback_result
+					enough = True
+					break
+			if self.validMessageCounter < EPOCHS :
+				time.sleep(self.measxScheduler.delay(time.time()))
+		self.metrics.end('first_measx')
+		self.metrics.end('epochs')
+		if startTime is None:
+			startTime = readyTime
+		# at TIMEOUT the valid messages so far are sent when they reach QUALITY_MINIMUM and minimumEpochs()
+		if ADAPTIVE_EPOCHS and not enough and minimumEpochs() <= self.validMessageCounter < EPOCHS and self.quality.meets(QUALITY_MINIMUM):
+			log.info(f'.. Timeout, send {self.validMessageCounter} of {EPOCHS} epochs: {self.quality.quality()}')
+			enough = True
+
+		# GNSS off, GNSS_KEEP_ON keeps it on for a hot start of the next run
+		if not GNSS_KEEP_ON:
+			self.command_send('at+UGPS=0', 10)
+			self.gnssOn = False
+
+		# ninth step: see if we were able to get MEASX messages as per our requirement
+		if self.validMessageCounter < EPOCHS and not enough :
+		    # we did not find any MEASX message as per our requirement,
+			# so, we will check processed MEASX messages to see if they fall under our fallback criteria
+			if (FALLBACK_METHODOLOGY == FallbackConfig.FALLBACK_DO_NOT_SEND):
+				log.info("No fallback configuration selected. Please tweak your desired criteria (or choose a different fallback methodology) to get MEASX message")
+				FALLBACK_METHODOLOGY_STATUS = False  #exit()
 
-	# Delet JSON file on FFS
-	DelJSON_FFS()
-	# Save JSON file into FFS
-	SaveJSON2FFS(MQTT_MSG)
-	
-	# Publish data out ThingStream	
-	if (MQTTPubData == True):
-		PubDataCloud()
-	else :
-		MQTTSNPubDataCloud()
-		
-def showHelp():
-	print('================')
-	print('Press "run" to perform CloudLocate')
-	print('Press "AT" to perform AT commands')
-	print('Press "q" to exit')
+			# if this fallback is selected, we've already extended the timeout in main loop, and we did not find any MEASX message
+			if (FALLBACK_METHODOLOGY == FallbackConfig.FALLBACK_EXTEND_TIMEOUT):
+				log.info('No message found while using fallback configuration. Please tweak your desired criteria (or choose a different fallback methodology) to get MEASX message')
+				FALLBACK_METHODOLOGY_STATUS = False  #exit()
 
-def getINTnum(number):
-#	print(str(number))
-	if number >= 48 and number <= 57:
-		number -= 48
-	if number >= 65 and number <= 90:
-		number -= 65
-		number += 10
-	if number >= 97 and number <= 122:
-		number -= 97
-		number += 10
+			if FALLBACK_METHODOLOGY == FallbackConfig.FALLBACK_NO_OF_SATELLITIES_ONLY:
+				fallback_result = self.apply_fallback_logic(FallbackConfig.FALLBACK_NO_OF_SATELLITIES_ONLY, EPOCHS, FALLBACK_CONFIG[FallbackConfig.FALLBACK_NO_OF_SATELLITIES_ONLY])
+				if fallback_result == False:
+					log.info('No message found while using fallback configuration. Please tweak your desired criteria (or choose a different fallback methodology) to get MEASX message')
+					FALLBACK_METHODOLOGY_STATUS = False  #exit()
+				self.MEASX_MESSAGE = fallback_result
+
+			elif FALLBACK_METHODOLOGY == FallbackConfig.FALLBACK_EPOCHS:
+				fallback_result = self.apply_fallback_logic(FallbackConfig.FALLBACK_EPOCHS, FALLBACK_CONFIG[FallbackConfig.FALLBACK_EPOCHS], MIN_NO_OF_SATELLITES)
+				if fallback_result == False:
+					log.info('No message found while using fallback configuration. Please tweak your desired criteria (or choose a different fallback methodology) to get MEASX message')
+					FALLBACK_METHODOLOGY_STATUS = False  #exit()
+				self.MEASX_MESSAGE = fallback_result
+
+		if FALLBACK_METHODOLOGY_STATUS == False :
+			return False
 
-	return number
+		if log.enabled(DEBUG):
+			log.debug(f"Final Measx: {self.MEASX_MESSAGE.hex()}")
+		log.info(".. Measure time : "+ str(int((time.time()-startTime))) +" seconds")
+
+		# the device has not moved since a recent fix: its position, without FFS write, connect and publish
+		fingerprint = None
+		if self.fixCache is not None:
+			fingerprint = measx_fingerprint(self.MEASX_MESSAGE, CONSTELLATION_TYPES[GNSS_TYPE])
+			position = self.fixCache.lookup(fingerprint)
+			if position is not None:
+				log.info('.. Position from the fix cache, '+str(self.fixCache.hits)+' hits, '+str(self.fixCache.misses)+' misses')
+				self.printPosition(position)
+				self.MEASX_MESSAGE = bytearray()
+				self.positionFuture = concurrent.futures.Future()
+				self.positionFuture.set_result(position)
+				self.positionCached = True
+				return True
 
-def getUBXPayload(payload):
-	UBXpayload = b''
-
-	i = 0
-	while i < (len(payload)):
-		#two bytes convert to one byte
-		UBXpayload += bytes([(getINTnum(payload[i])*16 +getINTnum(payload[i+1]))])
-		i += 2
-	return UBXpayload
-
-def getNMEASX(rawMessage):
-	# third step: read message from receiver
-	# rawMessage = ser.read_until(MEASX_HEADER)
-	
-	# fourth step: calculate size of payload contained inside read MEASX message
-	size = (rawMessage[1]<<8)|rawMessage[0]
-	#checking size for a valid measx message
-	if(size <= 33) :
-		print(f"Message skipped: {rawMessage.hex()}")
-		#skipping this message
-		#continue
-	# fifth step: extract actual MEASX payload (without header, and checksum)
-	measxMessagePayload = rawMessage[2:size+2]
-	# sixth step: get the number of satellites contained in this message
-	numSv = measxMessagePayload[34]
-	print("Number of satellites: ", numSv)
-	# need to save this message for fallback logic
-	processedMeasxMessage = {
-		'measxMessage': rawMessage[0:size+4],
-		'maxCNO': 0,
-		'satellitesInfo': { }
-	}
-	satelliteCount = 0
-	# seventh step: for the number of satellites contained in the message
-	# we need to see if every satellite's data falls as per our configuration
-	# because a single MEASX message can contain more than one satellite's information
-	for i in range(0, numSv):
-	# eight step: only accept the message if it fulfills our criteria, based on configuration parameters above
-		gnss = measxMessagePayload[44+24*i]
-		if gnss == CONSTELLATION_TYPES[GNSS_TYPE]: 
-			# carrier-to-noise ratio
-			cNO = measxMessagePayload[46+24*i]
-			# save maximum CNO value as a separate key in stored measx message
-			if cNO > processedMeasxMessage['maxCNO']:
-				processedMeasxMessage['maxCNO'] = cNO
-			multipathIndex = measxMessagePayload[47+24*i]
-			svID = measxMessagePayload[45+24*i]
-			processedMeasxMessage['satellitesInfo'][svID] = {'cno': cNO, 'mpi': multipathIndex }
-			if cNO >= CNO_THRESHOLD and multipathIndex <= MULTIPATH_INDEX:    
-				satelliteCount = satelliteCount + 1
-				print(f"gnss: {gnss} ... svID:{svID} ... cNO: {cNO} ... multipathIndex: {multipathIndex}")
-	# saving processed message for fallback logic  
-	READ_RAW_MEASX_MESSAGES.append(processedMeasxMessage)
-
-	if satelliteCount >= MIN_NO_OF_SATELLITES:
-#		global MEASX_MESSAGE
-		MEASX_MESSAGE.extend(MEASX_HEADER)
-		MEASX_MESSAGE.extend(bytearray(rawMessage[0:size+4]))
-		global validMessageCounter
-		validMessageCounter = validMessageCounter + 1
+		# tenth and eleventh step: create base64 encoded JSON payload, which will be sent to CloudLocate, 
+		# pack it into the limit of MQTT (8KB) or MQTT-SN (1017 bytes) or exit if it exceeds the limit
+		utcTime = getUTCTime()
+		limit = MQTT_PAYLOAD_LIMIT if MQTTPubData else MQTTSN_PAYLOAD_LIMIT
+		if PACK_PAYLOAD:
+			budget = raw_budget(limit, len(getJSONPayload(b'', utcTime)))
+			packed = pack_epochs(split_measx(self.MEASX_MESSAGE), budget, CONSTELLATION_TYPES[GNSS_TYPE], PACK_MIN_SATELLITES, PACK_DROP_OTHER_GNSS)
+			if packed is not None:
+				if packed.droppedEpochs or packed.droppedSatellites:
+					log.info(f'.. Packed {packed.epochs} epochs with {packed.satellites} satellites into {limit} bytes, dropped {packed.droppedEpochs} epochs and {packed.droppedSatellites} satellites')
+				self.MEASX_MESSAGE = packed.measxMessage
+		MQTT_MSG = getJSONPayload(self.MEASX_MESSAGE, utcTime)
+		self.MEASX_MESSAGE = bytearray()  #clear buffer
+	#	log.info(MQTT_MSG)
+
+		if (MQTTPubData == True):
+			if len(MQTT_MSG) > limit:
+				log.info("Cannot send MQTT message greath than 8KB. Please reduce the number of EPOCHS in configuration parameters to reduce the size.")
+				return False
+		else :
+			if len(MQTT_MSG) > limit:
+				log.info("Cannot send MQTT-SN message greath than 1017 Bytes. Please reduce the number of EPOCHS in configuration parameters to reduce the size.")
+				return False
+
+		# the position of this payload, resolved when its reply arrives on the subscribed topic
+		# MQTT-SN read lines carry the topic ID, so any topic matches there
+		if (MQTT_SUB_TOPIC if MQTTPubData else MQTTSN_SUB_TOPIC):
+			self.positionFuture = self.positions.submit(MQTT_SUB_TOPIC if MQTTPubData else None, utcTime)
+			if fingerprint is not None:
+				self.positionFuture.add_done_callback(lambda future: self.cacheFix(fingerprint, future))
+
+		# Publish data out ThingStream	
+		published = False
+		if (MQTTPubData == True) and UPLINK == "host":
+			published = self.HostPubDataCloud(MQTT_MSG)
+		else:
+			payload = self.stagePayload(MQTT_MSG)
+			if payload is False:
+				pass
+			elif (MQTTPubData == True):
+				published = self.PubDataCloud(payload)
+			else :
+				published = self.MQTTSNPubDataCloud(payload)
+
+		if not published and self.positionFuture is not None:
+			self.positionFuture.cancel()
+		# no coverage: keep the payload with its UTCDateTime for the next broker session
+		if not published and self.payloadQueue is not None:
+			dropped = self.payloadQueue.put(MQTT_MSG)
+			log.info('.. Payload queued, '+str(len(self.payloadQueue))+' in queue'+(', dropped the oldest '+str(dropped) if dropped else ''))
+		return published
+
+	def getNMEASX(self, rawMessage):
+		# third step: read message from receiver
+		# rawMessage = ser.read_until(MEASX_HEADER)
+
+		# fourth and fifth step: decode the MEASX header and check the size of the payload
+		try:
+			epoch = MeasxEpoch(rawMessage)
+		except ValueError:
+			log.warning(f"Message skipped: {bytes(rawMessage).hex()}")
+			#skipping this message
+			return
+		# sixth step: get the number of satellites contained in this message
+		log.debug(f"Number of satellites: {epoch.numSv}")
+		# the receiver is not ready before it reports satellites
+		if epoch.numSv == 0:
+			return
+		# a poll before the next measurement returns the last epoch again
+		now = time.time()
+		if not self.measxScheduler.accept(epoch.gpsTOW, now):
+			log.debug(f"Duplicate epoch skipped, gpsTOW: {epoch.gpsTOW}")
+			return
+		gnssType = CONSTELLATION_TYPES[GNSS_TYPE]
+		maxCNO = 0
+		gnssCount = 0
+		cnoCount = 0
+		satelliteCount = 0
+		debug = log.enabled(DEBUG)
+		# seventh step: for the number of satellites contained in the message
+		# we need to see if every satellite's data falls as per our configuration
+		# because a single MEASX message can contain more than one satellite's information
+		for gnss, svID, cNO, multipathIndex in zip(epoch.gnssId, epoch.svId, epoch.cNo, epoch.mpathIndic):
+		# eight step: only accept the message if it fulfills our criteria, based on configuration parameters above
+			if gnss == gnssType:
+				gnssCount = gnssCount + 1
+				# save maximum CNO value for the fallback logic
+				if cNO > maxCNO:
+					maxCNO = cNO
+				if cNO >= CNO_THRESHOLD:
+					cnoCount = cnoCount + 1
+					if multipathIndex <= MULTIPATH_INDEX:
+						satelliteCount = satelliteCount + 1
+						if debug:
+							log.debug(f"gnss: {gnss} ... svID:{svID} ... cNO: {cNO} ... multipathIndex: {multipathIndex}")
+		# saving processed message for fallback logic  
+		self.epochStore.add(epoch.message, epoch.gpsTOW, maxCNO, gnssCount, cnoCount, satelliteCount)
+
+		if satelliteCount >= MIN_NO_OF_SATELLITES:
+			self.quality.add(epoch)
+			self.MEASX_MESSAGE.extend(MEASX_HEADER)
+			self.MEASX_MESSAGE.extend(epoch.message)
+			self.validMessageCounter = self.validMessageCounter + 1
+			# TIMEOUT starts from the first valid MEASX
+			self.measxScheduler.mark_valid(now)
 
 class Response(threading.Thread):
-	def __init__(self, ser):
+	def __init__(self, ser, device):
 		super().__init__()
 		self.ser =ser
+		self.device = device
+		self.engine = device.engine
 		self.flag= True
 	def run(self):
-		ser = self.ser
+		parser = UBXStreamParser()
 		while self.flag:
-			res_bytes=self.ser.readline()
-			res_str=str(res_bytes.decode()).replace('\r\n','')
-			if len(res_str) >1:
-				print(getTime()+':output->'+res_str)
-				global res_str_at_command #creating global scope variable
-				res_str_at_command = res_str
-# Convert UBX-RXM-MEASX to base64			
-			if b'\x42\x35\x36\x32\x30\x32\x31\x34' in res_bytes: #+UGUBX: "B5620214
-				res_bytes = remove_bytes(res_bytes,0,9) # remove <+UGUBX: ">
-				if b'\x0d\x0a' in res_bytes:
-					res_bytes = remove_bytes(res_bytes,(len(res_bytes)-3),len(res_bytes)) #remove <"\x0d\x0a>
-					res_bytes = remove_bytes(res_bytes,0,8) #12
-					getNMEASX(getUBXPayload(res_bytes))
+			# read what is waiting (at least one byte, or nothing after the serial timeout)
+			res_bytes = self.device.link.read_chunk()
+			for kind, value in parser.feed(res_bytes):
+				if kind == AT_LINE:
+					if len(value) >1:
+						# the MEASX hex lines are the bulk of the output
+						log.stamped(self.device.prefix+'output->'+value, DEBUG if value.startswith('+UGUBX:') else INFO)
+						self.engine.on_line(value)
+				elif kind == AT_PROMPT:
+					self.engine.on_line(value)
+# UBX-RXM-MEASX, the message without the B5620214 header
+				elif kind == UBX_FRAME and value[0:4] == MEASX_HEADER:
+					self.device.getNMEASX(memoryview(value)[4:])
+				elif kind == UBX_FRAME:
+					self.device.onUBXFrame(value)
 	
 	def stop(self):
 		self.flag = False
 
-try:
-    ser = serial.Serial(port=SerialPort, baudrate=115200, timeout=2)
-except Exception:
-    print('connect serial error!')
-    sys.exit(1)
-print('connect..')
-
-response = Response(ser)
-response.start()
-
-print('=== Startup ===')
-command_send('ate0')
-time.sleep(0.1)
-
-showHelp()
-
-while True:
-	at = input('')
- 
-	if at=='':
-		continue
-	if at == 'HELP':
-		showHelp()
-	if at=='q':
-		response.stop()
-		sys.exit()
-	if at == 'run':
-
-# Whether "tsudp" APN is set.
-		if(MQTTPubData == False): # MQTT-SN
-			command_send('at+cgdcont?')
-			when = int(time.time()) + int(2) # waiting for 2 seconds
-			while True:
-				now = int(time.time())
-				if (now > when):
-					print(res_str_at_command)
-					print('*** TS SIM card with "tsudp" is needed for MQTT-SN ***')
-					print('*** APN is incorrect ***')
-					response.stop()
-					sys.exit()
-				else :
-					if "tsudp" in res_str_at_command:
-						break
+# open the serial port of the modem (SerialPort), or the simulated modem with SIMULATED_MODEM
+# pyserial is imported here, so importing this module opens nothing
+def openSerial(port=None, simulated=None):
+	if SIMULATED_MODEM if simulated is None else simulated:
+		return SimulatedModem(SIMULATED_LOG, time_scale=SIMULATED_TIME_SCALE, port=port or "SIM")
+	import serial
+	return serial.Serial(port=port or SerialPort, baudrate=BASE_BAUDRATE, timeout=2)
+
+# the console: "run", AT commands and "q"
+def main():
+	try:
+		ser = openSerial()
+	except Exception:
+		print('connect serial error!')
+		sys.exit(1)
+	print('connect..')
+	if METRICS_PORT:
+		start_metrics_server(METRICS_PORT)
+		print('.. Metrics on http://127.0.0.1:'+str(METRICS_PORT)+'/metrics')
+
+	device = CloudLocateDevice(ser)
+
+	print('=== Startup ===')
+	device.setupLink()
+	device.command_send('ate0', 2)
+
+	showHelp()
 
-		PDP_Context_activate(1)
-			
-		if (MQTTPubData == True):
-			SetMQTTProfile()
-		else :
-			SetMQTTSNProfile()
-			
-		command_send('at+UGPRF=1')  #Set GNSS channel 
-		Waitfor("OK", 2)
-		
-		Measure_count=0
-		while True:
-			if (Measure_count >= int(run_retry_times)):
-				print('... Measure Done')
-				PDP_Context_activate(0)
-				showHelp()
-				break
-			else:
-				Measure_count +=1
-				CloudLocate_run()
-				if (Measure_count < int(run_retry_times)):
-					print('.. Waiting '+str(run_wait_time)+ ' seconds for the next action. Remaining testing times : '+str(run_retry_times - Measure_count))
-					# waiting for the next action.
-					time.sleep(int(run_wait_time))
-			
-	else:
-		command_send(at)
+	while True:
+		at = input('')
+	 
+		if at=='':
+			continue
+		if at == 'HELP':
+			showHelp()
+		if at=='q':
+			if KEEP_CONNECTION or GNSS_KEEP_ON:
+				device.disconnect()
+			device.close()
+			sys.exit()
+		if at == 'run':
+			if(MQTTPubData == False): # MQTT-SN
+				if not device.checkAPN():
+					device.close()
+					sys.exit()
+			device.run()
+			showHelp()
+		else:
+			device.command_send(at)
 
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,106 @@
+#====================================================================
+# Event-driven AT command engine for SARA-R510M8s
+# The Response thread hands every received line to ATEngine.on_line(),
+# command_send() sleeps on a condition variable until the final result code
+# of its own command arrives, and URCs are dispatched to registered handlers.
+#====================================================================
+
+import threading,time
+import collections
+
+# every AT command is terminated by one of these final result codes
+FINAL_RESULT_CODES = ("OK", "ERROR", "+CME ERROR", "+CMS ERROR", "ABORTED", "NO CARRIER")
+
+# unsolicited result codes never belong to the command in progress
+URC_PREFIXES = ("+UUMQTTC:", "+UUMQTTSNC:", "+UUPSDA:", "+UUPSDD:", "+CSCON:")
+
+# number of received lines kept for Waitfor(), older lines are dropped
+LINE_HISTORY = 256
+
+# this class keeps the response queue of a single AT command
+class ATCommand:
+	def __init__(self, at_cmd):
+		self.at_cmd = at_cmd
+		self.lines = []		# intermediate lines, without URCs
+		self.result = None	# final result code, None until it has arrived
+		self.sentTime = time.time()
+
+class ATEngine:
+	def __init__(self, write):
+		self.write = write			# callable sending bytes to the modem
+		self.cond = threading.Condition()
+		self.channel = threading.Lock()	# a single command in progress on the AT channel
+		self.pending = None			# ATCommand waiting for its final result code
+		self.lines = collections.deque(maxlen=LINE_HISTORY)	# every line since the last command, for Waitfor()
+		self.urcHandlers = {}		# URC prefix -> list of handlers
+
+	# handler(line) is called from the reader thread, so it must not block or send AT commands
+	def register_urc(self, prefix, handler):
+		self.urcHandlers.setdefault(prefix, []).append(handler)
+
+	def unregister_urc(self, prefix, handler):
+		if handler in self.urcHandlers.get(prefix, []):
+			self.urcHandlers[prefix].remove(handler)
+
+	# called by the reader thread for every received line
+	def on_line(self, line):
+		isURC = line.startswith(URC_PREFIXES)
+		with self.cond:
+			self.lines.append(line)
+			command = self.pending
+			if not isURC and command is not None and command.result is None:
+				if line.startswith(FINAL_RESULT_CODES):
+					command.result = line
+				else:
+					command.lines.append(line)
+			self.cond.notify_all()
+
+		if isURC:
+			for prefix, handlers in list(self.urcHandlers.items()):
+				if line.startswith(prefix):
+					for handler in list(handlers):
+						handler(line)
+
+	# send an AT command and wait up to timeout seconds for its final result code
+	# return (result, lines), result is None when the timeout expired
+	# with timeout=None the command is sent without waiting, like a command typed in the console
+	def send(self, at_cmd, timeout=None):
+		command = ATCommand(at_cmd)
+		if timeout is None:
+			with self.cond:
+				self.pending = command
+				self.lines.clear()
+			self.write((at_cmd+'\r\n').encode())
+			return (None, command.lines)
+
+		with self.channel:
+			with self.cond:
+				self.pending = command
+				self.lines.clear()
+			self.write((at_cmd+'\r\n').encode())
+			deadline = time.monotonic() + timeout
+			with self.cond:
+				while command.result is None:
+					remaining = deadline - time.monotonic()
+					if remaining <= 0:
+						break
+					self.cond.wait(remaining)
+		return (command.result, command.lines)
+
+	# wait for a line containing at_cmd (e.g. a URC) received since the last command was sent
+	# lines up to the matched one are consumed, so the same URC is not matched twice
+	# return False on timeout or when an error line arrives first
+	def wait_for(self, at_cmd, timeout):
+		deadline = time.monotonic() + timeout
+		with self.cond:
+			while True:
+				while self.lines:
+					line = self.lines.popleft()
+					if at_cmd in line:
+						return True
+					if "ERROR" in line:
+						return False
+				remaining = deadline - time.monotonic()
+				if remaining <= 0:
+					return False
+				self.cond.wait(remaining)
@@ -0,0 +1,284 @@
+#====================================================================
+# Benchmark of the host-side MEASX pipeline: parse -> select -> encode
+# Synthetic MEASX frames with different numSv, constellation mixes and C/No
+# distributions are pushed through every stage, with -o the results are
+# saved as JSON so they can be compared between revisions:
+#   python benchmark.py -o before.json
+#   python benchmark.py -o after.json --compare before.json
+# --uplink measures the fixes/s of the host MQTT uplink against a local
+# broker stand-in instead, a connection per fix and pooled with windows:
+#   python benchmark.py --uplink --latency 0.02
+#====================================================================
+
+import time
+import os
+import json
+import random
+import struct
+import platform
+import subprocess
+import tracemalloc
+import contextlib
+
+import at_cloudlocate_test as app
+from measx_decoder import MEASX_HEADER, MEASX_HEAD, MEASX_BLOCK, MeasxEpoch, ubx_checksum
+from ubx_stream import UBXStreamParser
+from epoch_packer import pack_epochs, raw_budget, split_measx
+from mqtt_uplink import MQTTUplink
+from broker_simulator import SimulatedBroker
+
+# gnssId values of the constellation mixes
+CONSTELLATION_MIXES = {
+	"GPS": [0],
+	"GPS+GLONASS": [0, 6],
+	"ALL": [0, 2, 3, 6],
+}
+
+# (mean, standard deviation) of C/No in dBHz
+CNO_DISTRIBUTIONS = {
+	"open-sky": (40, 4),
+	"urban": (28, 7),
+	"indoor": (18, 5),
+}
+
+NUM_SV = [8, 16, 32]
+
+# build a MEASX message (length + payload + checksum, without MEASX_HEADER)
+def make_measx_message(numSv, gnssIds, cnoDistribution, gpsTOW, rng):
+	mean, deviation = cnoDistribution
+	payload = bytearray(MEASX_HEAD.pack(1, gpsTOW, gpsTOW, gpsTOW, gpsTOW, 500, 0, 0, 0, numSv, 0))
+	for i in range(numSv):
+		cNo = max(0, min(63, int(rng.gauss(mean, deviation))))
+		payload += MEASX_BLOCK.pack(rng.choice(gnssIds), i+1, cNo, rng.choice((1, 1, 1, 2, 3)),
+			rng.randint(-50000, 50000), rng.randint(-50000, 50000), rng.randint(0, 1022),
+			rng.randint(0, 1023), rng.randint(0, 2**21), 0, rng.randint(0, 60))
+	frame = MEASX_HEADER[2:] + struct.pack('<H', len(payload)) + payload
+	return bytes(frame[2:]) + ubx_checksum(frame)
+
+# the +UGUBX hex characters handed to getUBXPayload() by the Response thread
+def make_hex(message):
+	return message.hex().upper().encode()
+
+# a device without serial port, only its MEASX processing is used
+device = app.CloudLocateDevice(None)
+
+def reset_app():
+	device.epochStore.reset()
+	device.measxScheduler.reset()
+	device.quality.reset()
+	device.MEASX_MESSAGE.clear()
+	device.validMessageCounter = 0
+
+# every stage is (name, setup(messages) -> argument, function(argument))
+def stages(messages):
+	hexLines = [make_hex(m) for m in messages]
+
+	def parse_legacy_input():
+		return hexLines
+	def decode_all(lines):
+		for line in lines:
+			app.getUBXPayload(line)
+
+	# the serial stream as the Response thread receives it, in 64-byte chunks
+	def stream_input():
+		stream = b''.join(b'+UGUBX: "B5620214'+line+b'"\r\nOK\r\n' for line in hexLines)
+		return [stream[i:i+64] for i in range(0, len(stream), 64)]
+	def parse_stream(chunks):
+		parser = UBXStreamParser()
+		for chunk in chunks:
+			parser.feed(chunk)
+
+	def decode_epochs(msgs):
+		for m in msgs:
+			MeasxEpoch(m)
+
+	def select_all(msgs):
+		reset_app()
+		for m in msgs:
+			device.getNMEASX(m)
+
+	# the selection does not change the store, it is filled once
+	def fallback_input():
+		reset_app()
+		for m in messages:
+			device.getNMEASX(m)
+	def fallback(unused):
+		device.apply_fallback_logic(app.FallbackConfig.FALLBACK_EPOCHS, app.FALLBACK_CONFIG[app.FallbackConfig.FALLBACK_EPOCHS], app.MIN_NO_OF_SATELLITES)
+
+	def payload_input():
+		measx = bytearray()
+		for m in messages[:app.EPOCHS]:
+			measx.extend(MEASX_HEADER)
+			measx.extend(m)
+		return measx
+	# pack all epochs into the MQTT-SN limit
+	def pack_input():
+		measx = bytearray()
+		for m in messages:
+			measx.extend(MEASX_HEADER)
+			measx.extend(m)
+		return measx
+	def pack(measx):
+		budget = raw_budget(app.MQTTSN_PAYLOAD_LIMIT, len(app.getJSONPayload(b'', "2021-08-16T04:55:21")))
+		pack_epochs(split_measx(measx), budget, 0, app.PACK_MIN_SATELLITES)
+
+	def payload(measx):
+		app.getJSONPayload(measx, "2021-08-16T04:55:21")
+
+	return [
+		("getUBXPayload", parse_legacy_input, decode_all),
+		("UBXStreamParser", stream_input, parse_stream),
+		("MeasxEpoch", lambda: messages, decode_epochs),
+		("getNMEASX", lambda: messages, select_all),
+		("apply_fallback_logic", fallback_input, fallback),
+		("pack_epochs", pack_input, pack),
+		("getJSONPayload", payload_input, payload),
+	]
+
+def percentile(sortedValues, p):
+	index = min(len(sortedValues)-1, int(round(p/100.0*(len(sortedValues)-1))))
+	return sortedValues[index]
+
+# time one stage: latency per call, epochs/s and bytes allocated per call
+def run_stage(function, argument, epochsPerCall, repeat):
+	samples = []
+	for _ in range(repeat):
+		start = time.perf_counter_ns()
+		function(argument)
+		samples.append(time.perf_counter_ns() - start)
+	samples.sort()
+
+	tracemalloc.start()
+	tracemalloc.reset_peak()
+	before = tracemalloc.get_traced_memory()[0]
+	function(argument)
+	peak = tracemalloc.get_traced_memory()[1] - before
+	tracemalloc.stop()
+
+	total = sum(samples)
+	return {
+		"p50_us": percentile(samples, 50)/1000.0,
+		"p99_us": percentile(samples, 99)/1000.0,
+		"epochs_per_s": epochsPerCall*repeat*1e9/total if total else 0.0,
+		"bytes_allocated": peak,
+	}
+
+def git_revision():
+	try:
+		return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def run_benchmark(epochs=20, repeat=200, seed=1):
+	results = []
+	# per-satellite prints of the pipeline are not part of the measurement
+	with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+		for numSv in NUM_SV:
+			for mixName, gnssIds in CONSTELLATION_MIXES.items():
+				for cnoName, cnoDistribution in CNO_DISTRIBUTIONS.items():
+					rng = random.Random(seed)
+					messages = [make_measx_message(numSv, gnssIds, cnoDistribution, 5000+500*i, rng) for i in range(epochs)]
+					for name, setup, function in stages(messages):
+						argument = setup()
+						epochsPerCall = 1 if name in ("apply_fallback_logic", "getJSONPayload") else epochs
+						result = run_stage(function, argument, epochsPerCall, repeat)
+						result.update({"stage": name, "numSv": numSv, "mix": mixName, "cno": cnoName})
+						results.append(result)
+		# the buffered log lines of the stages go to devnull as well
+		app.log.flush()
+	reset_app()
+	return {
+		"revision": git_revision(),
+		"python": platform.python_version(),
+		"time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
+		"epochs": epochs,
+		"repeat": repeat,
+		"results": results,
+	}
+
+# publish fixes CloudLocate payloads to a local broker whose CONNACK and PUBACK take latency seconds
+# "per-fix": connect, publish and disconnect like the modem flow; "pooled": one connection, window publishes in flight
+def run_uplink_benchmark(fixes=200, windows=(1, 4, 16), latency=0.02, seed=1):
+	rng = random.Random(seed)
+	measx = bytearray()
+	for i in range(app.EPOCHS):
+		measx.extend(MEASX_HEADER)
+		measx.extend(make_measx_message(16, [0], CNO_DISTRIBUTIONS["open-sky"], 5000+1000*i, rng))
+	payload = app.getJSONPayload(measx, "2021-08-16T04:55:21")
+	broker = SimulatedBroker(latency=latency, response_delay=None)
+	results = []
+	try:
+		count = max(1, fixes//10)	# a connection per fix is slow, fewer fixes are enough
+		start = time.perf_counter()
+		for _ in range(count):
+			uplink = MQTTUplink(broker.host, broker.port, 'benchmark', window=1)
+			uplink.publish(app.MQTT_PUB_TOPIC, payload)
+			uplink.close()
+		results.append({"mode": "per-fix", "window": 1, "fixes": count, "fixes_per_s": count/(time.perf_counter()-start)})
+		for window in windows:
+			uplink = MQTTUplink(broker.host, broker.port, 'benchmark', window=window)
+			uplink.connect()
+			start = time.perf_counter()
+			futures = [uplink.publish_async(app.MQTT_PUB_TOPIC, payload) for _ in range(fixes)]
+			published = sum(1 for future in futures if uplink.wait(future))
+			results.append({"mode": "pooled", "window": window, "fixes": published, "fixes_per_s": published/(time.perf_counter()-start)})
+			uplink.close()
+	finally:
+		broker.close()
+	return {
+		"revision": git_revision(),
+		"python": platform.python_version(),
+		"time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
+		"payload_bytes": len(payload),
+		"latency": latency,
+		"uplink": results,
+	}
+
+def print_uplink_report(report):
+	print(f'revision {report["revision"]}, python {report["python"]}, payload {report["payload_bytes"]} bytes, round trip {report["latency"]*1000:.0f} ms')
+	print(f'{"mode":<10}{"window":>8}{"fixes":>8}{"fixes/s":>12}')
+	for r in report["uplink"]:
+		print(f'{r["mode"]:<10}{r["window"]:>8}{r["fixes"]:>8}{r["fixes_per_s"]:>12.1f}')
+
+def result_key(result):
+	return (result["stage"], result["numSv"], result["mix"], result["cno"])
+
+def print_report(report, baseline=None):
+	old = {}
+	if baseline:
+		old = {result_key(r): r for r in baseline["results"]}
+	print(f'revision {report["revision"]}, python {report["python"]}')
+	print(f'{"stage":<22}{"numSv":>6} {"mix":<12}{"cno":<9}{"p50 us":>10}{"p99 us":>10}{"epochs/s":>12}{"bytes":>9}  change')
+	for r in report["results"]:
+		change = ''
+		previous = old.get(result_key(r))
+		if previous and previous["p50_us"]:
+			change = f'{r["p50_us"]/previous["p50_us"]:.2f}x p50'
+		print(f'{r["stage"]:<22}{r["numSv"]:>6} {r["mix"]:<12}{r["cno"]:<9}{r["p50_us"]:>10.1f}{r["p99_us"]:>10.1f}{r["epochs_per_s"]:>12.0f}{r["bytes_allocated"]:>9}  {change}')
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description='Benchmark the MEASX parse -> select -> encode pipeline')
+	parser.add_argument('-o', '--output', default=None, help='JSON file for the results, default: only the report is printed')
+	parser.add_argument('--compare', help='JSON results of another revision')
+	parser.add_argument('--epochs', type=int, default=20, help='MEASX epochs per run')
+	parser.add_argument('--repeat', type=int, default=200, help='timed runs per stage')
+	parser.add_argument('--uplink', action='store_true', help='measure the fixes/s of the host MQTT uplink instead')
+	parser.add_argument('--fixes', type=int, default=200, help='payloads published per uplink mode')
+	parser.add_argument('--latency', type=float, default=0.02, help='seconds before every CONNACK and PUBACK of the broker stand-in')
+	args = parser.parse_args()
+
+	if args.uplink:
+		report = run_uplink_benchmark(args.fixes, latency=args.latency)
+		print_uplink_report(report)
+	else:
+		report = run_benchmark(args.epochs, args.repeat)
+		baseline = None
+		if args.compare:
+			with open(args.compare) as f:
+				baseline = json.load(f)
+		print_report(report, baseline)
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump(report, f, indent=1)
+		print('.. Results saved to '+args.output)
@@ -0,0 +1,166 @@
+#====================================================================
+# Local MQTT broker stand-in for the host uplink
+# A small MQTT 3.1.1 broker (QoS 0/1, subscriptions with + and #, no
+# retained messages or sessions) which also plays CloudLocate: a request
+# published on CloudLocate/GNSS/request is answered after response_delay on
+# CloudLocate/<client id>/GNSS/response with a position in the format of the
+# Thingstream reply, MeasxTime is the UTCDateTime of the request. latency
+# delays every CONNACK and PUBACK like a network round trip:
+#   python broker_simulator.py --port 1883 --latency 0.05
+#====================================================================
+
+import threading,time,sys
+import json
+import base64
+import struct
+import socketserver
+
+from mqtt_uplink import (CONNECT, CONNACK, PUBLISH, PUBACK, SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK,
+	PINGREQ, PINGRESP, DISCONNECT, encode_packet, encode_publish, decode_publish, read_packet, topic_matches)
+from measx_decoder import MEASX_HEADER
+
+REQUEST_TOPIC = "CloudLocate/GNSS/request"
+RESPONSE_TOPIC = "CloudLocate/{}/GNSS/response"
+# the position of the reply in "Test log.txt"
+POSITION = {"Lat": 25.0804284, "Lon": 121.5606483, "Alt": 82.648, "Acc": 32.92}
+
+# one client connection
+class BrokerSession(socketserver.BaseRequestHandler):
+	def setup(self):
+		self.clientId = None
+		self.writeLock = threading.Lock()
+		self.subscriptions = {}		# topic filter -> qos
+
+	def send(self, data):
+		with self.writeLock:
+			try:
+				self.request.sendall(data)
+			except OSError:
+				pass
+
+	def handle(self):
+		broker = self.server.broker
+		while True:
+			try:
+				packet = read_packet(self.request)
+			except OSError:
+				break
+			if packet is None:
+				break
+			packetType, flags, body = packet
+			if packetType == CONNECT:
+				length = struct.unpack_from('>H', body, 10)[0]
+				self.clientId = bytes(body[12:12+length]).decode()
+				broker.add(self)
+				broker.later(broker.latency, self.send, encode_packet(CONNACK, 0, b'\x00\x00'))
+			elif packetType == PUBLISH:
+				topic, packetId, qos, payload = decode_publish(flags, body)
+				if qos:
+					broker.later(broker.latency, self.send, encode_packet(PUBACK, 0, struct.pack('>H', packetId)))
+				broker.publish(topic, payload, self)
+			elif packetType == SUBSCRIBE:
+				packetId = struct.unpack_from('>H', body)[0]
+				offset = 2
+				codes = bytearray()
+				while offset < len(body):
+					length = struct.unpack_from('>H', body, offset)[0]
+					topicFilter = bytes(body[offset+2:offset+2+length]).decode()
+					qos = min(body[offset+2+length], 1)
+					self.subscriptions[topicFilter] = qos
+					codes.append(qos)
+					offset += 3 + length
+				self.send(encode_packet(SUBACK, 0, struct.pack('>H', packetId) + bytes(codes)))
+			elif packetType == UNSUBSCRIBE:
+				packetId = struct.unpack_from('>H', body)[0]
+				length = struct.unpack_from('>H', body, 2)[0]
+				self.subscriptions.pop(bytes(body[4:4+length]).decode(), None)
+				self.send(encode_packet(UNSUBACK, 0, struct.pack('>H', packetId)))
+			elif packetType == PINGREQ:
+				self.send(encode_packet(PINGRESP, 0))
+			elif packetType == DISCONNECT:
+				break
+
+	def finish(self):
+		self.server.broker.remove(self)
+
+class SimulatedBroker:
+	def __init__(self, host='127.0.0.1', port=0, latency=0.0, response_delay=0.5, position=None):
+		self.latency = latency					# seconds before every CONNACK and PUBACK
+		self.response_delay = response_delay	# seconds before the CloudLocate reply, None: no reply
+		self.position = position or POSITION
+		self.lock = threading.Lock()
+		self.sessions = []
+		self.requests = 0
+		self.messages = 0
+		self.server = socketserver.ThreadingTCPServer((host, port), BrokerSession)
+		self.server.daemon_threads = True
+		self.server.broker = self
+		self.host, self.port = self.server.server_address
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+	def add(self, session):
+		with self.lock:
+			self.sessions.append(session)
+
+	def remove(self, session):
+		with self.lock:
+			if session in self.sessions:
+				self.sessions.remove(session)
+
+	def later(self, delay, function, *args):
+		if delay:
+			threading.Timer(delay, function, args).start()
+		else:
+			function(*args)
+
+	# forward to the subscribers, and answer CloudLocate requests
+	def publish(self, topic, payload, sender=None):
+		with self.lock:
+			self.messages += 1
+			sessions = list(self.sessions)
+		for session in sessions:
+			for topicFilter, qos in list(session.subscriptions.items()):
+				if topic_matches(topicFilter, topic):
+					# forwarded with qos 0, the stand-in does not resend
+					session.send(encode_publish(topic, payload, 0))
+					break
+		if topic == REQUEST_TOPIC and sender is not None and self.response_delay is not None:
+			with self.lock:
+				self.requests += 1
+			reply = self.reply(payload)
+			if reply is not None:
+				self.later(self.response_delay, self.publish, RESPONSE_TOPIC.format(sender.clientId), reply)
+
+	# the CloudLocate position of a request payload
+	def reply(self, payload):
+		try:
+			request = json.loads(payload)
+			measx = base64.b64decode(request['body'])
+		except (ValueError, KeyError, TypeError):
+			return None
+		position = dict(self.position)
+		position['MeasxTime'] = request.get('headers', {}).get('UTCDateTime')
+		position['Epochs'] = measx.count(MEASX_HEADER)
+		return json.dumps(position, separators=(',', ':')).encode()
+
+	def close(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description='Local MQTT broker which answers CloudLocate requests')
+	parser.add_argument('--host', default='127.0.0.1')
+	parser.add_argument('--port', type=int, default=1883)
+	parser.add_argument('--latency', type=float, default=0.0, help='seconds before every CONNACK and PUBACK')
+	parser.add_argument('--response-delay', type=float, default=0.5, help='seconds before the position reply')
+	args = parser.parse_args()
+
+	broker = SimulatedBroker(args.host, args.port, args.latency, args.response_delay)
+	print('Simulated broker on '+broker.host+':'+str(broker.port))
+	try:
+		while True:
+			time.sleep(1)
+	except KeyboardInterrupt:
+		broker.close()
+		sys.exit()
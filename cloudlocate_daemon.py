@@ -0,0 +1,210 @@
+#====================================================================
+# Daemon mode: keep one SARA-R510M8s warm and serve fixes to local clients
+# The modem is set up once: PDP context, broker session (KEEP_CONNECTION)
+# and GNSS kept on (GNSS_KEEP_ON), so a fix request only costs the MEASX
+# acquisition and the publish. Clients connect to a Unix socket and send
+# one JSON line per request:
+#   {"cmd": "fix", "timeout": 60}  ->  {"ok": true, "position": {...}, "seconds": 4.2}
+#   {"cmd": "status"}              ->  {"ok": true, "fixes": 3, "pending": 0, ...}
+# One worker thread owns the AT channel and runs the acquisitions one after
+# the other, the positions are awaited by the client threads, so the next
+# acquisition starts while earlier replies are pending:
+#   python cloudlocate_daemon.py serve --socket /tmp/cloudlocate.sock
+#   python cloudlocate_daemon.py fix --socket /tmp/cloudlocate.sock
+#====================================================================
+
+import threading,time,sys
+import os
+import json
+import queue
+import socket
+import socketserver
+import concurrent.futures
+
+import at_cloudlocate_test as app
+from position_response import PositionTimeout
+
+SOCKET_PATH = "/tmp/cloudlocate.sock"
+
+# the timeout of a request in seconds, None if it is not a number >= 0
+def parse_timeout(value):
+	try:
+		timeout = float(value)
+	except (TypeError, ValueError):
+		return None
+	return timeout if 0 <= timeout < float('inf') else None
+
+# the client gave up: the position of a fix still running is not awaited once it is published
+def cancel_position(request):
+	if not request.cancelled() and request.exception() is None:
+		request.result().cancel()
+
+# one client connection, one JSON line per request and per reply
+class ClientHandler(socketserver.StreamRequestHandler):
+	def handle(self):
+		daemon = self.server.cloudlocate
+		for line in self.rfile:
+			try:
+				request = json.loads(line)
+			except ValueError:
+				reply = {'ok': False, 'error': 'invalid JSON'}
+			else:
+				if not isinstance(request, dict):
+					reply = {'ok': False, 'error': 'invalid request'}
+				elif request.get('cmd') == 'fix':
+					timeout = parse_timeout(request.get('timeout', app.POSITION_TIMEOUT))
+					reply = daemon.fix(timeout) if timeout is not None else {'ok': False, 'error': 'invalid timeout'}
+				elif request.get('cmd') == 'status':
+					reply = daemon.status()
+				else:
+					reply = {'ok': False, 'error': 'unknown cmd'}
+			self.wfile.write((json.dumps(reply)+'\n').encode())
+			self.wfile.flush()
+
+class CloudLocateDaemon:
+	def __init__(self, port=None, path=SOCKET_PATH, lazy=False):
+		self.port = port
+		self.path = path
+		self.device = None
+		self.deviceLock = threading.Lock()	# opening the device
+		self.requests = queue.Queue()		# Future of the position Future of every fix request
+		self.running = True
+		self.fixes = 0
+		self.failed = 0
+		if not lazy:
+			self.open()
+		self.worker = threading.Thread(target=self.work, daemon=True)
+		self.worker.start()
+		if os.path.exists(path):
+			os.remove(path)
+		self.server = socketserver.ThreadingUnixStreamServer(path, ClientHandler)
+		self.server.daemon_threads = True
+		self.server.cloudlocate = self
+
+	# open the port and bring the modem up: PDP context, profile, broker session and GNSS
+	def open(self):
+		with self.deviceLock:
+			if self.device is not None:
+				return self.device
+			device = app.CloudLocateDevice(app.openSerial(self.port), name=self.port or '')
+			app.log.info('=== Startup ===')
+			if not device.setupLink():
+				device.close()
+				raise RuntimeError('no response from the modem')
+			device.command_send('ate0', 2)
+			if app.MQTTPubData == False and not device.checkAPN():
+				device.close()
+				raise RuntimeError('APN "tsudp" is needed for MQTT-SN')
+			modemUplink = device.prepare()
+			if modemUplink is None:
+				device.close()
+				raise RuntimeError('the broker profile cannot be saved')
+			if not modemUplink:
+				device.HostConnect()
+			elif app.MQTTPubData:
+				device.MQTTConnect()
+			else:
+				device.MQTTSNConnect()
+			device.GNSSOn()
+			app.log.info('.. Modem warm, serving fixes on '+self.path)
+			self.device = device
+			return device
+
+	# the worker owns the AT channel: acquisitions one after the other, and the replies while idle
+	def work(self):
+		while self.running:
+			try:
+				request = self.requests.get(timeout=0.5)
+			except queue.Empty:
+				if self.device is not None and len(self.device.positions):
+					self.device.collectPositions(0.5)
+				continue
+			if not request.set_running_or_notify_cancel():
+				continue
+			try:
+				device = self.open()
+				# the PDP context was dropped (+UUPSDD) while it was kept open
+				if not (app.MQTTPubData and app.UPLINK == "host") and not device.URC_STATE['pdpActive']:
+					device.PDP_Context_activate(1)
+				request.set_result(device.requestFix())
+			except Exception as e:
+				request.set_exception(e)
+
+	# run one fix and wait for its position, called from the client threads
+	def fix(self, timeout):
+		startTime = time.time()
+		request = concurrent.futures.Future()
+		self.requests.put(request)
+		try:
+			position = request.result(timeout).result(max(timeout - (time.time()-startTime), 0))
+		except concurrent.futures.CancelledError:
+			self.failed += 1
+			return {'ok': False, 'error': 'no MEASX payload published'}
+		except (concurrent.futures.TimeoutError, PositionTimeout):
+			# a request still queued is not acquired at all
+			if not request.cancel():
+				request.add_done_callback(cancel_position)
+			self.failed += 1
+			return {'ok': False, 'error': 'no position within '+str(timeout)+' seconds'}
+		except Exception as e:
+			self.failed += 1
+			return {'ok': False, 'error': str(e)}
+		self.fixes += 1
+		return {'ok': True, 'seconds': round(time.time()-startTime, 3),
+			'position': {'lat': position.lat, 'lon': position.lon, 'alt': position.alt, 'accuracy': position.accuracy,
+				'timestamp': position.timestamp, 'epochs': position.epochs}}
+
+	def status(self):
+		device = self.device
+		return {'ok': True, 'open': device is not None, 'fixes': self.fixes, 'failed': self.failed,
+			'queued': self.requests.qsize(), 'pending': len(device.positions) if device else 0,
+			'gnssOn': device.gnssOn if device else False}
+
+	def serve_forever(self):
+		self.server.serve_forever()
+
+	def close(self):
+		self.running = False
+		self.server.shutdown()
+		self.server.server_close()
+		if os.path.exists(self.path):
+			os.remove(self.path)
+		self.worker.join()
+		if self.device is not None:
+			self.device.disconnect()
+			self.device.close()
+
+# ask a running daemon for a fix, return its JSON reply
+def request_fix(path=SOCKET_PATH, timeout=None):
+	timeout = app.POSITION_TIMEOUT if timeout is None else timeout
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+		sock.settimeout(timeout + 5)
+		sock.connect(path)
+		sock.sendall((json.dumps({'cmd': 'fix', 'timeout': timeout})+'\n').encode())
+		return json.loads(sock.makefile().readline())
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description='Keep a SARA-R510M8s warm and serve CloudLocate fixes over a Unix socket')
+	parser.add_argument('mode', choices=['serve', 'fix'], help='serve: run the daemon; fix: request one fix from it')
+	parser.add_argument('--socket', default=SOCKET_PATH, help='path of the Unix socket')
+	parser.add_argument('--port', default=None, help='serial port, default SerialPort')
+	parser.add_argument('--lazy', action='store_true', help='open the modem at the first fix request')
+	parser.add_argument('--timeout', type=float, default=app.POSITION_TIMEOUT, help='seconds to wait for a position')
+	args = parser.parse_args()
+
+	if args.mode == 'fix':
+		reply = request_fix(args.socket, args.timeout)
+		print(json.dumps(reply))
+		sys.exit(0 if reply.get('ok') else 1)
+
+	# the broker session and GNSS stay up between the requests
+	app.KEEP_CONNECTION = True
+	app.GNSS_KEEP_ON = True
+	app.POSITION_WAIT = False
+	daemon = CloudLocateDaemon(args.port, args.socket, args.lazy)
+	try:
+		daemon.serve_forever()
+	except KeyboardInterrupt:
+		daemon.close()
+		sys.exit()
@@ -0,0 +1,131 @@
+#====================================================================
+# Fleet mode: drive many SARA-R510M8s modems from one process
+# Every serial port gets its own CloudLocateDevice (AT engine, Response thread,
+# MEASX state). An asyncio scheduler runs the devices concurrently with bounded
+# parallelism and a timeout per device:
+#   python cloudlocate_fleet.py COM5 COM6 COM7 --parallel 2 --timeout 300
+#   python cloudlocate_fleet.py --simulated 8 --time-scale 0.1
+#====================================================================
+
+import asyncio
+import threading,time,sys
+from concurrent.futures import ThreadPoolExecutor
+
+import at_cloudlocate_test as app
+from modem_simulator import SimulatedModem
+from cycle_metrics import start_metrics_server
+
+# result of one device in the fleet
+class DeviceResult:
+	def __init__(self, port):
+		self.port = port
+		self.status = 'pending'	# 'done', 'failed', 'timeout' or 'error'
+		self.published = 0
+		self.elapsed = 0.0
+		self.error = None
+
+	def __repr__(self):
+		return f'{self.port}: {self.status}, published {self.published}, {self.elapsed:.1f} s'
+
+# asyncio wrapper around one CloudLocateDevice, the blocking flow runs in the executor
+class DeviceSession:
+	def __init__(self, port, executor, retry_times=None, wait_time=None, simulated=False, time_scale=1.0):
+		self.port = port
+		self.executor = executor
+		self.retry_times = retry_times
+		self.wait_time = wait_time
+		self.simulated = simulated
+		self.time_scale = time_scale
+		self.device = None
+		self.lock = threading.Lock()	# the device and aborted
+		self.aborted = False
+		self.result = DeviceResult(port)
+
+	def open_device(self):
+		if self.simulated:
+			ser = SimulatedModem(app.SIMULATED_LOG, time_scale=self.time_scale, port=self.port)
+		else:
+			ser = app.openSerial(self.port, simulated=False)
+		device = app.CloudLocateDevice(ser, name=self.port)
+		# run() has given up while the port was opened, nobody else closes it
+		with self.lock:
+			if self.aborted:
+				device.close()
+				raise RuntimeError('aborted')
+			self.device = device
+		if not self.device.setupLink():
+			raise RuntimeError('no response from the modem')
+		self.device.command_send('ate0', 2)
+		if app.MQTTPubData == False and not self.device.checkAPN():
+			raise RuntimeError('APN "tsudp" is needed for MQTT-SN')
+
+	def run_device(self):
+		self.open_device()
+		published = self.device.run(self.retry_times, self.wait_time)
+		if app.KEEP_CONNECTION or app.GNSS_KEEP_ON:
+			self.device.disconnect()
+		return published
+
+	async def run(self, timeout):
+		loop = asyncio.get_running_loop()
+		startTime = time.time()
+		try:
+			self.result.published = await asyncio.wait_for(loop.run_in_executor(self.executor, self.run_device), timeout)
+			self.result.status = 'done' if self.result.published else 'failed'
+		except asyncio.TimeoutError:
+			self.result.status = 'timeout'
+		except Exception as e:
+			self.result.status = 'error'
+			self.result.error = e
+		finally:
+			self.result.elapsed = time.time() - startTime
+			# a device opened after this point is closed by open_device()
+			with self.lock:
+				self.aborted = True
+				device = self.device
+			if device is not None:
+				# the executor thread leaves the flow as soon as the device is aborted
+				device.abort()
+				await loop.run_in_executor(None, device.close)
+		return self.result
+
+# run every port once, at most parallel devices at the same time
+async def run_fleet(ports, parallel=4, timeout=300, retry_times=None, wait_time=None, simulated=False, time_scale=1.0):
+	semaphore = asyncio.Semaphore(parallel)
+	executor = ThreadPoolExecutor(max_workers=parallel)
+
+	async def run_one(port):
+		async with semaphore:
+			session = DeviceSession(port, executor, retry_times, wait_time, simulated, time_scale)
+			return await session.run(timeout)
+
+	try:
+		return await asyncio.gather(*(run_one(port) for port in ports))
+	finally:
+		executor.shutdown(wait=False)
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description='Run CloudLocate on many SARA-R510M8s modems')
+	parser.add_argument('ports', nargs='*', help='serial ports, e.g. COM5 COM6')
+	parser.add_argument('--parallel', type=int, default=4, help='devices running at the same time')
+	parser.add_argument('--timeout', type=float, default=300, help='seconds per device')
+	parser.add_argument('--retry-times', type=int, default=None, help='CloudLocate runs per device (run_retry_times)')
+	parser.add_argument('--wait-time', type=int, default=None, help='seconds between runs (run_wait_time)')
+	parser.add_argument('--simulated', type=int, default=0, help='number of simulated modems replaying SIMULATED_LOG')
+	parser.add_argument('--time-scale', type=float, default=1.0, help='time scale of the simulated modems')
+	parser.add_argument('--metrics-port', type=int, default=app.METRICS_PORT, help='serve the stage histograms of all devices on http://127.0.0.1:<port>/metrics')
+	args = parser.parse_args()
+
+	ports = args.ports or ['SIM'+str(i) for i in range(args.simulated)]
+	if not ports:
+		parser.error('no serial port given')
+	if args.metrics_port:
+		start_metrics_server(args.metrics_port)
+	startTime = time.time()
+	results = asyncio.run(run_fleet(ports, args.parallel, args.timeout, args.retry_times, args.wait_time, args.simulated > 0, args.time_scale))
+	print('=== Fleet result ===')
+	for result in results:
+		print(result)
+	print('.. Fleet time : '+str(int(time.time()-startTime))+' seconds')
+	sys.exit(0 if all(result.status == 'done' for result in results) else 1)
@@ -0,0 +1,159 @@
+#====================================================================
+# Latency spans of the CloudLocate cycle
+# Every stage (PDP activate, profile setup, GNSS on, CFG-GNSS ACK, first
+# valid MEASX, EPOCHS epochs, FFS write, broker connect, subscribe, publish,
+# position response) is recorded as a span with its duration and the
+# serial bytes sent and received meanwhile. Each cycle is appended as one
+# JSON line to METRICS_FILE, and the spans of all devices are summed into
+# histograms which can be served as Prometheus text:
+#   curl http://localhost:9108/metrics
+#====================================================================
+
+import time
+import json
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# upper bounds of the histogram buckets in seconds
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+class Histogram:
+	def __init__(self):
+		self.counts = [0]*(len(BUCKETS)+1)	# the last one is +Inf
+		self.sum = 0.0
+		self.count = 0
+
+	def observe(self, value):
+		index = 0
+		while index < len(BUCKETS) and value > BUCKETS[index]:
+			index += 1
+		self.counts[index] += 1
+		self.sum += value
+		self.count += 1
+
+# histograms and counters of every device and stage, shared by all devices of the process
+class MetricsRegistry:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.histograms = {}	# (device, stage) -> Histogram
+		self.serialBytes = {}	# (device, stage, direction) -> bytes
+		self.cycles = {}		# (device, result) -> cycles
+
+	def observe(self, device, stage, seconds, bytesIn, bytesOut):
+		with self.lock:
+			self.histograms.setdefault((device, stage), Histogram()).observe(seconds)
+			self.serialBytes[(device, stage, 'in')] = self.serialBytes.get((device, stage, 'in'), 0) + bytesIn
+			self.serialBytes[(device, stage, 'out')] = self.serialBytes.get((device, stage, 'out'), 0) + bytesOut
+
+	def count_cycle(self, device, result):
+		with self.lock:
+			self.cycles[(device, result)] = self.cycles.get((device, result), 0) + 1
+
+	# Prometheus text exposition format
+	def render(self):
+		lines = []
+		with self.lock:
+			lines.append('# HELP cloudlocate_stage_seconds Duration of the CloudLocate stages')
+			lines.append('# TYPE cloudlocate_stage_seconds histogram')
+			for (device, stage), histogram in sorted(self.histograms.items()):
+				labels = f'device="{device}",stage="{stage}"'
+				cumulative = 0
+				for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+					cumulative += count
+					lines.append(f'cloudlocate_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+				lines.append(f'cloudlocate_stage_seconds_sum{{{labels}}} {histogram.sum:.6f}')
+				lines.append(f'cloudlocate_stage_seconds_count{{{labels}}} {histogram.count}')
+			lines.append('# HELP cloudlocate_serial_bytes_total Serial bytes sent (out) and received (in) per stage')
+			lines.append('# TYPE cloudlocate_serial_bytes_total counter')
+			for (device, stage, direction), value in sorted(self.serialBytes.items()):
+				lines.append(f'cloudlocate_serial_bytes_total{{device="{device}",stage="{stage}",direction="{direction}"}} {value}')
+			lines.append('# HELP cloudlocate_cycles_total CloudLocate cycles per result')
+			lines.append('# TYPE cloudlocate_cycles_total counter')
+			for (device, result), value in sorted(self.cycles.items()):
+				lines.append(f'cloudlocate_cycles_total{{device="{device}",result="{result}"}} {value}')
+		return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+# spans of one device, counters() returns the serial (bytesIn, bytesOut) so far
+class CycleMetrics:
+	def __init__(self, device, counters, path=None, registry=registry):
+		self.device = device or 'default'
+		self.counters = counters
+		self.path = path			# JSON lines file, None: not written
+		self.registry = registry
+		self.lock = threading.Lock()
+		self.cycle = 0
+		self.reset()
+
+	def reset(self):
+		self.cycleStart = None
+		self.spans = []
+		self.open = {}		# stage -> (start, bytesIn, bytesOut)
+
+	def begin(self, stage):
+		now = time.time()
+		bytesIn, bytesOut = self.counters()
+		with self.lock:
+			if self.cycleStart is None:
+				self.cycleStart = now
+			self.open[stage] = (now, bytesIn, bytesOut)
+
+	# a stage which was not begun is ignored
+	def end(self, stage):
+		now = time.time()
+		bytesIn, bytesOut = self.counters()
+		with self.lock:
+			if stage not in self.open:
+				return
+			start, startIn, startOut = self.open.pop(stage)
+			span = {'stage': stage, 'start': round(start - self.cycleStart, 3), 'seconds': round(now - start, 3),
+				'bytesIn': bytesIn - startIn, 'bytesOut': bytesOut - startOut}
+			self.spans.append(span)
+		self.registry.observe(self.device, stage, now - start, span['bytesIn'], span['bytesOut'])
+
+	@contextlib.contextmanager
+	def span(self, stage):
+		self.begin(stage)
+		try:
+			yield
+		finally:
+			self.end(stage)
+
+	# write the spans of the cycle as one JSON line and start the next cycle
+	def finish(self, result):
+		with self.lock:
+			self.cycle += 1
+			record = {'device': self.device, 'cycle': self.cycle,
+				'time': time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(self.cycleStart or time.time())),
+				'result': result, 'spans': self.spans}
+			self.reset()
+		self.registry.count_cycle(self.device, result)
+		if self.path:
+			with open(self.path, 'a') as f:
+				f.write(json.dumps(record) + '\n')
+		return record
+
+class MetricsHandler(BaseHTTPRequestHandler):
+	def do_GET(self):
+		if self.path.split('?')[0] != '/metrics':
+			self.send_error(404)
+			return
+		body = self.server.registry.render().encode()
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/plain; version=0.0.4')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	# requests are not printed between the AT lines
+	def log_message(self, format, *args):
+		pass
+
+# serve http://<host>:<port>/metrics from a daemon thread
+def start_metrics_server(port, host='127.0.0.1', registry=registry):
+	server = ThreadingHTTPServer((host, port), MetricsHandler)
+	server.registry = registry
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return server
@@ -0,0 +1,113 @@
+#====================================================================
+# Byte-budget-aware epoch packer
+# Fits the most measurement value into the payload limit of the transport
+# (8192 bytes for MQTT, 1017 bytes for MQTT-SN). The limit applies to the
+# JSON message, so the budget is converted to raw MEASX bytes through the
+# exact base64 size. Epochs are ranked by a quality score, and when they do
+# not fit as they are, the satellite blocks with the lowest value (other
+# constellations, low C/No, high multipath index) are dropped first.
+#====================================================================
+
+import struct
+
+from measx_decoder import MEASX_HEADER, MEASX_HEAD_SIZE, MEASX_BLOCK_SIZE, MeasxEpoch, ubx_checksum
+
+# sync chars, class, id, length and checksum around the MEASX payload
+FRAME_OVERHEAD = 8
+# a MEASX frame without satellites
+EPOCH_OVERHEAD = FRAME_OVERHEAD + MEASX_HEAD_SIZE
+
+# value of a satellite is divided by this weight for its multipath index (1:low 2:medium 3:high)
+MULTIPATH_WEIGHT = {0: 1.0, 1: 1.0, 2: 1.5, 3: 3.0}
+
+# raw MEASX bytes which fit into limit once they are base64 encoded and wrapped with overhead JSON characters
+def raw_budget(limit, overhead):
+	return max(0, (limit - overhead)//4)*3
+
+# split a concatenation of MEASX frames (as built in MEASX_MESSAGE) into MeasxEpoch objects
+def split_measx(measxMessage):
+	epochs = []
+	view = memoryview(measxMessage)
+	pos = 0
+	while pos + 6 <= len(view) and view[pos:pos+4] == MEASX_HEADER:
+		epoch = MeasxEpoch(view[pos+4:])
+		epochs.append(epoch)
+		pos += 4 + len(epoch.message)
+	return epochs
+
+# value of every satellite block of an epoch, 0 means the block is dropped first
+def block_values(epoch, gnssType, dropOtherGnss, minCNO):
+	values = []
+	for gnss, cNO, multipathIndex in zip(epoch.gnssId, epoch.cNo, epoch.mpathIndic):
+		if (dropOtherGnss and gnss != gnssType) or cNO < minCNO:
+			values.append(0.0)
+		else:
+			values.append(cNO / MULTIPATH_WEIGHT.get(multipathIndex, 3.0))
+	return values
+
+# a MEASX frame of epoch with only the satellite blocks in keep, numSv, length and checksum are rebuilt
+def build_frame(epoch, keep):
+	payload = bytearray(epoch.payload[0:MEASX_HEAD_SIZE])
+	payload[34] = len(keep)
+	for index in keep:
+		start = MEASX_HEAD_SIZE + MEASX_BLOCK_SIZE*index
+		payload += epoch.payload[start:start+MEASX_BLOCK_SIZE]
+	body = MEASX_HEADER[2:] + struct.pack('<H', len(payload)) + payload
+	return MEASX_HEADER[0:2] + body + ubx_checksum(body)
+
+# this class keeps the result of a packing, for the printout in CloudLocate_run()
+class PackResult:
+	def __init__(self, measxMessage, epochs, satellites, droppedEpochs, droppedSatellites, score):
+		self.measxMessage = measxMessage
+		self.epochs = epochs
+		self.satellites = satellites
+		self.droppedEpochs = droppedEpochs
+		self.droppedSatellites = droppedSatellites
+		self.score = score
+
+# choose epochs and satellite blocks with the highest total value within budget raw bytes
+# every packed epoch keeps at least minSatellites blocks with a value, return None if nothing fits
+def pack_epochs(epochs, budget, gnssType, minSatellites, dropOtherGnss=True, minCNO=0):
+	totalSize = sum(EPOCH_OVERHEAD + MEASX_BLOCK_SIZE*epoch.numSv for epoch in epochs)
+	if totalSize <= budget:
+		measxMessage = bytearray()
+		for epoch in epochs:
+			measxMessage += epoch.frame()
+		return PackResult(measxMessage, len(epochs), sum(epoch.numSv for epoch in epochs), 0, 0, None)
+
+	# blocks of every epoch, best first, without blocks of no value
+	ranked = []
+	for epoch in epochs:
+		values = block_values(epoch, gnssType, dropOtherGnss, minCNO)
+		order = sorted((i for i in range(epoch.numSv) if values[i] > 0), key=lambda i: values[i], reverse=True)
+		if len(order) >= minSatellites:
+			ranked.append((epoch, order, [values[i] for i in order]))
+	# epochs with the best satellites first
+	ranked.sort(key=lambda r: sum(r[2][0:minSatellites]), reverse=True)
+
+	best = None
+	for count in range(1, len(ranked)+1):
+		chosen = ranked[0:count]
+		blocks = (budget - EPOCH_OVERHEAD*count)//MEASX_BLOCK_SIZE
+		if blocks < minSatellites*count:
+			break
+		# every epoch keeps its best minSatellites blocks, the remaining room goes to the best blocks of all epochs
+		keep = [minSatellites]*count
+		extra = sorted(((values[k], e) for e, (epoch, order, values) in enumerate(chosen) for k in range(minSatellites, len(order))), reverse=True)
+		for value, e in extra[0:blocks - minSatellites*count]:
+			keep[e] += 1
+		score = sum(sum(values[0:keep[e]]) for e, (epoch, order, values) in enumerate(chosen))
+		if best is None or score > best[0]:
+			best = (score, chosen, keep)
+	if best is None:
+		return None
+
+	score, chosen, keep = best
+	# frames in the order they were measured
+	packed = sorted(((epoch, sorted(order[0:keep[e]])) for e, (epoch, order, values) in enumerate(chosen)), key=lambda p: epochs.index(p[0]))
+	measxMessage = bytearray()
+	for epoch, blocks in packed:
+		measxMessage += build_frame(epoch, blocks)
+	satellites = sum(keep)
+	return PackResult(measxMessage, len(packed), satellites, len(epochs) - len(packed),
+		sum(epoch.numSv for epoch, blocks in packed) - satellites, score)
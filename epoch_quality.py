@@ -0,0 +1,50 @@
+#====================================================================
+# Online quality estimate of the MEASX epochs accepted in a run
+# Every accepted epoch updates the estimate, so the acquisition can stop as
+# soon as the epochs so far are good enough for CloudLocate instead of
+# waiting for EPOCHS epochs or the timeout. The accuracy proxy is
+#   satellites      distinct satellites of the selected constellation which
+#                   pass CNO_THRESHOLD and MULTIPATH_INDEX
+#   cno             mean of their best C/No in dBHz
+#   doppler_spread  range of their line-of-sight rate (dopplerMS) in m/s
+# MEASX has no azimuth or elevation, satellites spread over the sky have
+# different line-of-sight rates, so the Doppler range stands in for the
+# geometry of the set.
+#====================================================================
+
+# dopplerMS of UBX-RXM-MEASX is in 0.04 m/s
+DOPPLER_MS_SCALE = 0.04
+
+class QualityEstimator:
+	def __init__(self, gnssType, cnoThreshold, multipathIndex):
+		self.gnssType = gnssType
+		self.cnoThreshold = cnoThreshold
+		self.multipathIndex = multipathIndex
+		self.reset()
+
+	def reset(self):
+		self.cno = {}		# svId -> best C/No
+		self.doppler = {}	# svId -> line-of-sight rate (m/s) at the best C/No
+
+	def add(self, epoch):
+		for gnss, svId, cNo, multipathIndex, dopplerMS, *rest in epoch.blocks():
+			if gnss == self.gnssType and cNo >= self.cnoThreshold and multipathIndex <= self.multipathIndex:
+				if cNo > self.cno.get(svId, -1):
+					self.cno[svId] = cNo
+					self.doppler[svId] = dopplerMS*DOPPLER_MS_SCALE
+
+	def quality(self):
+		if not self.cno:
+			return {'satellites': 0, 'cno': 0.0, 'doppler_spread': 0.0}
+		return {'satellites': len(self.cno),
+			'cno': sum(self.cno.values())/len(self.cno),
+			'doppler_spread': max(self.doppler.values()) - min(self.doppler.values())}
+
+	def meets(self, required):
+		quality = self.quality()
+		return all(quality[key] >= value for key, value in required.items())
+
+# the requirement after fraction of the timeout, relaxed linearly from target to minimum
+def required_quality(target, minimum, fraction):
+	fraction = min(max(fraction, 0.0), 1.0)
+	return {key: target[key] + (minimum.get(key, 0) - target[key])*fraction for key in target}
@@ -0,0 +1,77 @@
+#====================================================================
+# Bounded epoch store for the fallback logic
+# Keeps the MEASX messages of one run in a fixed number of slots, with the
+# per-epoch aggregates computed once when the epoch is added (maxCNO and the
+# satellite counts) in array-backed columns. A max-heap on maxCNO gives the
+# best epochs first: the fallback selection walks the heap from its root
+# through a small frontier heap, so it visits about k entries instead of
+# copying the heap or sorting and refiltering every message. When the store
+# is full the oldest epoch is overwritten, so memory stays flat over long runs.
+#====================================================================
+
+import heapq
+from array import array
+
+class EpochStore:
+	def __init__(self, capacity):
+		self.capacity = capacity
+		self.messages = [None]*capacity		# MEASX message without MEASX_HEADER
+		self.gpsTOW = array('I', bytes(4*capacity))
+		self.maxCNO = array('B', bytes(capacity))
+		self.gnssCount = array('B', bytes(capacity))	# satellites of the selected constellation
+		self.cnoCount = array('B', bytes(capacity))		# ... with C/No >= CNO_THRESHOLD
+		self.validCount = array('B', bytes(capacity))	# ... and multipath index <= MULTIPATH_INDEX
+		self.seqs = [-1]*capacity			# sequence number of the epoch in every slot
+		self.heap = []						# (-maxCNO, seq, slot), entries of overwritten slots are skipped
+		self.seq = 0
+		self.count = 0
+
+	def __len__(self):
+		return self.count
+
+	# start a new run
+	def reset(self):
+		self.messages = [None]*self.capacity
+		self.seqs = [-1]*self.capacity
+		self.heap = []
+		self.seq = 0
+		self.count = 0
+
+	# store an epoch and its aggregates, return its slot
+	def add(self, message, gpsTOW, maxCNO, gnssCount, cnoCount, validCount):
+		slot = self.seq % self.capacity
+		self.messages[slot] = bytes(message)
+		self.gpsTOW[slot] = gpsTOW
+		self.maxCNO[slot] = min(maxCNO, 255)
+		self.gnssCount[slot] = min(gnssCount, 255)
+		self.cnoCount[slot] = min(cnoCount, 255)
+		self.validCount[slot] = min(validCount, 255)
+		self.seqs[slot] = self.seq
+		heapq.heappush(self.heap, (-maxCNO, self.seq, slot))
+		self.seq += 1
+		self.count = min(self.count + 1, self.capacity)
+		# drop the entries of overwritten slots once they are the majority
+		if len(self.heap) > 2*self.capacity:
+			self.heap = [entry for entry in self.heap if self.seqs[entry[2]] == entry[1]]
+			heapq.heapify(self.heap)
+		return slot
+
+	# slots of the stored epochs, newest last
+	def slots(self):
+		first = self.seq - self.count
+		return [seq % self.capacity for seq in range(first, self.seq)]
+
+	# up to k slots with the highest maxCNO that pass accept(slot), best first
+	# the children of a visited heap entry are the next candidates, the heap itself is not changed
+	def top_by_max_cno(self, k, accept):
+		heap = self.heap
+		selected = []
+		frontier = [(heap[0], 0)] if heap else []		# (entry, index in heap), entries are unique
+		while frontier and len(selected) < k:
+			(negCNO, seq, slot), index = heapq.heappop(frontier)
+			if self.seqs[slot] == seq and accept(slot):
+				selected.append(slot)
+			for child in (2*index + 1, 2*index + 2):
+				if child < len(heap):
+					heapq.heappush(frontier, (heap[child], child))
+		return selected
@@ -0,0 +1,106 @@
+#====================================================================
+# Position cache for devices which do not move
+# The MEASX epochs selected for a payload are reduced to a fingerprint:
+# the satellites of GNSS_TYPE with their best C/No, line-of-sight rate
+# (dopplerMS) and pseudorange RMS error index. When a new fingerprint is
+# close to one whose position was resolved within the TTL, that position is
+# returned and the request is not sent. Close means
+#   overlap        shared satellites / all satellites of both
+#   cno            mean C/No change of the shared satellites in dBHz
+#   doppler        largest change of a line-of-sight rate in m/s, after the
+#                  median change (clock drift) is removed; a moving device
+#                  adds its velocity here. The rate of every satellite drifts
+#                  by its own 0.1-0.2 m/s per second, so doppler_drift m/s per
+#                  second since the cached fix is allowed, and it is only
+#                  compared within doppler_window seconds of the cached fix
+#   rms            mean change of the pseudorange RMS error index
+# The code phase of MEASX repeats every millisecond and moves by hundreds
+# of meters per second with the satellite, so it is not compared.
+# The least recently used fingerprint is dropped when the cache is full.
+#====================================================================
+
+import threading,time
+import collections
+
+from epoch_packer import split_measx
+from epoch_quality import DOPPLER_MS_SCALE
+
+class Fingerprint:
+	def __init__(self, satellites, gpsTOW, time):
+		self.satellites = satellites	# svId -> (cNo, line-of-sight rate in m/s, pseudorange RMS error index)
+		self.gpsTOW = gpsTOW			# of the last epoch
+		self.time = time				# host time of the fix
+		self.key = bytes(sorted(satellites))
+
+# the fingerprint of the MEASX frames of a payload, with the best C/No of every satellite of gnssType
+def measx_fingerprint(measxMessage, gnssType, now=None):
+	satellites = {}
+	gpsTOW = None
+	for epoch in split_measx(measxMessage):
+		gpsTOW = epoch.gpsTOW
+		for gnss, svId, cNo, multipathIndex, dopplerMS, dopplerHz, wholeChips, fracChips, codePhase, intCodePhase, pseuRangeRMSErr in epoch.blocks():
+			if gnss == gnssType and cNo > satellites.get(svId, (-1,))[0]:
+				satellites[svId] = (cNo, dopplerMS*DOPPLER_MS_SCALE, pseuRangeRMSErr)
+	return Fingerprint(satellites, gpsTOW, time.time() if now is None else now)
+
+# how far fingerprint is from cached within bounds, None if it is outside
+def distance(cached, fingerprint, bounds):
+	common = cached.satellites.keys() & fingerprint.satellites.keys()
+	union = cached.satellites.keys() | fingerprint.satellites.keys()
+	if not common or len(common) < bounds['overlap']*len(union):
+		return None
+	cno = sum(abs(fingerprint.satellites[svId][0] - cached.satellites[svId][0]) for svId in common)/len(common)
+	changes = sorted(fingerprint.satellites[svId][1] - cached.satellites[svId][1] for svId in common)
+	median = changes[len(changes)//2]
+	doppler = max(abs(change - median) for change in changes)
+	rms = sum(abs(fingerprint.satellites[svId][2] - cached.satellites[svId][2]) for svId in common)/len(common)
+	elapsed = abs(fingerprint.time - cached.time)
+	if elapsed > bounds['doppler_window']:
+		doppler = 0
+	if cno > bounds['cno'] or rms > bounds['rms'] or doppler > bounds['doppler'] + bounds['doppler_drift']*elapsed:
+		return None
+	return (1 - len(common)/len(union)) + cno/max(bounds['cno'], 1) + doppler/max(bounds['doppler'], 0.1)
+
+class FixCache:
+	def __init__(self, ttl, capacity, bounds):
+		self.ttl = ttl				# seconds a resolved position is reused
+		self.capacity = capacity
+		self.bounds = bounds
+		self.entries = collections.OrderedDict()	# key -> (Fingerprint, Position), least recently used first
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	def __len__(self):
+		return len(self.entries)
+
+	def expire(self, now):
+		for key in [key for key, (fingerprint, position) in self.entries.items() if now - fingerprint.time > self.ttl]:
+			del self.entries[key]
+
+	# the position of the closest cached fingerprint within the bounds, None on a miss
+	def lookup(self, fingerprint):
+		with self.lock:
+			self.expire(fingerprint.time)
+			best = None
+			for key, (cached, position) in self.entries.items():
+				value = distance(cached, fingerprint, self.bounds)
+				if value is not None and (best is None or value < best[0]):
+					best = (value, key, position)
+			if best is None:
+				self.misses += 1
+				return None
+			self.entries.move_to_end(best[1])
+			self.hits += 1
+			return best[2]
+
+	# keep the resolved position of a fingerprint, the time of the fix starts its TTL
+	def add(self, fingerprint, position):
+		if not fingerprint.satellites:
+			return
+		with self.lock:
+			self.entries[fingerprint.key] = (fingerprint, position)
+			self.entries.move_to_end(fingerprint.key)
+			while len(self.entries) > self.capacity:
+				self.entries.popitem(last=False)
+			self.expire(fingerprint.time)
@@ -0,0 +1,110 @@
+#====================================================================
+# Buffered leveled console log
+# log.info() and friends only append (time, text) to a deque, a writer
+# thread formats and prints the records every interval, so a slow console
+# cannot stall the Response thread between two serial reads. The timestamp
+# of the "input->" / "output->" lines keeps the "Test log.txt" format
+# (2021-08-16 12:55:02:output->OK), it is formatted by the writer and only
+# once per second. When the writer falls behind by capacity records, the
+# oldest ones are dropped and counted; the count is approximate, two threads
+# appending to a full buffer at the same time may count one record too many.
+# The level can be a function, e.g. lambda: LOG_LEVEL, it is read at every
+# call, so a level changed at run time takes effect at once.
+#====================================================================
+
+import threading,time,sys
+import atexit
+import collections
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = {"DEBUG": DEBUG, "INFO": INFO, "WARNING": WARNING, "ERROR": ERROR}
+
+class BufferedLog:
+	def __init__(self, level=INFO, stream=None, capacity=65536, interval=0.05):
+		self.level = level			# DEBUG..ERROR, its name, or a function returning one of them
+		self.stream = stream		# None: sys.stdout at the time of writing
+		self.interval = interval
+		self.records = collections.deque(maxlen=capacity)	# (time, stamped, text), the oldest is dropped when it is full
+		self.writeLock = threading.Lock()
+		self.droppedLock = threading.Lock()	# dropped is counted by the logging threads and reset by the writer
+		self.dropped = 0
+		self.second = None			# second of the cached timestamp
+		self.secondText = ''
+		self.writer = None
+
+	# the level in effect now
+	def threshold(self):
+		level = self.level() if callable(self.level) else self.level
+		return LEVELS.get(level, INFO) if isinstance(level, str) else level
+
+	def enabled(self, level):
+		return level >= self.threshold()
+
+	def log(self, level, text, stamped=False):
+		if level < self.threshold():
+			return
+		if len(self.records) == self.records.maxlen:
+			with self.droppedLock:
+				self.dropped += 1
+		self.records.append((time.time(), stamped, text))
+		if self.writer is None:
+			self.start()
+
+	def debug(self, text):
+		self.log(DEBUG, text)
+
+	def info(self, text):
+		self.log(INFO, text)
+
+	def warning(self, text):
+		self.log(WARNING, text)
+
+	def error(self, text):
+		self.log(ERROR, text)
+
+	# a line with the time of the call in front, e.g. a serial line
+	def stamped(self, text, level=INFO):
+		self.log(level, text, True)
+
+	def start(self):
+		with self.writeLock:
+			if self.writer is None:
+				self.writer = threading.Thread(target=self.write_loop, daemon=True)
+				self.writer.start()
+				# the records of the last interval are printed at exit
+				atexit.register(self.flush)
+
+	# "2021-08-16 12:55:02", strftime only runs once per second
+	def stamp(self, t):
+		second = int(t)
+		if second != self.second:
+			self.secondText = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+			self.second = second
+		return self.secondText
+
+	def write_loop(self):
+		while True:
+			time.sleep(self.interval)
+			self.flush()
+
+	# print the records so far, e.g. before the console waits for input
+	def flush(self):
+		with self.writeLock:
+			if not self.records:
+				return
+			lines = []
+			records = self.records
+			while records:
+				t, stamped, text = records.popleft()
+				lines.append(self.stamp(t)+':'+text if stamped else text)
+			with self.droppedLock:
+				dropped, self.dropped = self.dropped, 0
+			if dropped:
+				lines.append('.. Log dropped '+str(dropped)+' records')
+			stream = self.stream or sys.stdout
+			stream.write('\n'.join(lines)+'\n')
+			stream.flush()
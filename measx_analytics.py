@@ -0,0 +1,360 @@
+#====================================================================
+# Offline tuning of the acquisition thresholds over MEASX archives
+# Reads recorded MEASX epochs from "Test log.txt" style logs, files of
+# +UGUBX lines (also .gz) and raw_capture .clcap files, and replays the
+# acceptance rule of CloudLocate_run() for every combination of
+# CNO_THRESHOLD, MULTIPATH_INDEX, MIN_NO_OF_SATELLITES, EPOCHS and fallback.
+# The files are decoded in a process pool into one byte per epoch and
+# threshold (satellites of GNSS_TYPE which pass it). A configuration is
+# then a bytes.translate() of such a column and a prefix sum, so every
+# acquisition costs a few bisects, and the configurations are swept in the
+# pool as well. An acquisition ends where the gpsTOW steps by more than
+# RUN_GAP, its times are taken from the gpsTOW of its epochs, TIMEOUT counts
+# from its first valid epoch within GNSS_READY_TIMEOUT:
+#   python measx_analytics.py logs/ captures/ --cno 18,22,26 --epochs 1,2,3
+#   python measx_analytics.py logs/ --fallback EPOCHS:1,NO_OF_SATELLITES_ONLY:4 -o sweep.json
+# Of ADAPTIVE_EPOCHS only the fallback after FALLBACK_AFTER is replayed, a
+# configuration waits for EPOCHS epochs.
+#====================================================================
+
+import time
+import os
+import re
+import sys
+import json
+import gzip
+import bisect
+import itertools
+import operator
+import concurrent.futures
+from array import array
+
+import at_cloudlocate_test as app
+from at_cloudlocate_test import FallbackConfig
+from measx_decoder import MEASX_HEADER, MeasxEpoch, decode_hex
+from measx_scheduler import WEEK_MS
+from ubx_stream import UBX_FRAME, ubx_frame_size
+from raw_capture import replay
+
+# a MEASX frame in a +UGUBX line, or a line of only its hex characters
+UGUBX_MEASX = re.compile(rb'(?:\+UGUBX: "|^)(B5620214[0-9A-F]+)', re.I)
+RUN_GAP = 10000 # ms of gpsTOW, a longer step starts a new acquisition
+
+# seconds of the stages after the acquisition, from "Test log.txt"
+GNSS_OFF_SECONDS = 8	# at+UGPS=0
+FILE_SECONDS = 2		# AT+UDELFILE and AT+UDWNFILE
+CONNECT_SECONDS = 5		# AT+UMQTTNV=1, connect and subscribe
+
+# JSON characters around the base64 MEASX
+JSON_OVERHEAD = len(app.getJSONPayload(b'', '2021-08-16T04:55:21'))
+
+# translate() tables: an epoch count becomes 1 when it reaches the index of the table
+THRESHOLD_TABLES = [bytes(int(count >= threshold) for count in range(256)) for threshold in range(256)]
+
+# the MEASX frames of a file, in the order they were received
+def read_frames(path):
+	if path.endswith('.clcap'):
+		for t, kind, value in replay(path):
+			if kind == UBX_FRAME and value[0:4] == MEASX_HEADER:
+				yield bytes(value)
+		return
+	opener = gzip.open if path.endswith('.gz') else open
+	with opener(path, 'rb') as f:
+		for line in f:
+			match = UGUBX_MEASX.search(line)
+			if match is None:
+				continue
+			try:
+				frame = decode_hex(match.group(1))
+			except ValueError:
+				continue
+			if ubx_frame_size(frame):
+				yield frame
+
+# the files of the paths, directories are walked
+def archive_files(paths):
+	files = []
+	for path in paths:
+		if os.path.isdir(path):
+			for directory, names, filenames in os.walk(path):
+				files.extend(os.path.join(directory, name) for name in sorted(filenames))
+		else:
+			files.append(path)
+	return files
+
+# the epochs of one or more files as columns, one value per epoch
+class Archive:
+	def __init__(self, cnoThresholds, multipathIndexes):
+		self.cnoThresholds = cnoThresholds
+		self.multipathIndexes = multipathIndexes
+		self.offset = array('I')		# ms since the first epoch of its acquisition
+		self.size = array('H')			# bytes of the MEASX frame
+		self.maxCNO = bytearray()
+		self.gnssCount = bytearray()	# satellites of GNSS_TYPE
+		self.cnoCount = {cno: bytearray() for cno in cnoThresholds}		# ... with C/No >= cno
+		self.validCount = {(cno, multipath): bytearray() for cno in cnoThresholds for multipath in multipathIndexes}	# ... and multipath index <= multipath
+		self.runs = array('I')			# index of the first epoch of every acquisition
+		self.files = 0
+		self.frames = 0
+		self.duplicates = 0
+
+	def __len__(self):
+		return len(self.offset)
+
+	def add_file(self, path, gnssType):
+		self.files += 1
+		lastGpsTOW = None
+		for frame in read_frames(path):
+			self.frames += 1
+			try:
+				epoch = MeasxEpoch(memoryview(frame)[4:])
+			except ValueError:
+				continue
+			if epoch.numSv == 0:
+				continue
+			step = None if lastGpsTOW is None else (epoch.gpsTOW - lastGpsTOW) % WEEK_MS
+			# the same epoch polled again, as skipped by measx_scheduler
+			if step == 0 or (step is not None and step > WEEK_MS//2 and WEEK_MS - step <= RUN_GAP):
+				self.duplicates += 1
+				continue
+			if step is None or step > RUN_GAP:
+				self.runs.append(len(self.offset))
+				runGpsTOW = epoch.gpsTOW
+			lastGpsTOW = epoch.gpsTOW
+			self.add_epoch(epoch, (epoch.gpsTOW - runGpsTOW) % WEEK_MS, gnssType)
+
+	def add_epoch(self, epoch, offset, gnssType):
+		satellites = [(cNo, multipathIndex) for gnss, cNo, multipathIndex in zip(epoch.gnssId, epoch.cNo, epoch.mpathIndic) if gnss == gnssType]
+		self.offset.append(offset)
+		self.size.append(len(MEASX_HEADER) + len(epoch.message))
+		self.maxCNO.append(max((cNo for cNo, multipathIndex in satellites), default=0))
+		self.gnssCount.append(min(len(satellites), 255))
+		for cno in self.cnoThresholds:
+			passed = [multipathIndex for cNo, multipathIndex in satellites if cNo >= cno]
+			self.cnoCount[cno].append(min(len(passed), 255))
+			for multipath in self.multipathIndexes:
+				self.validCount[(cno, multipath)].append(min(sum(1 for m in passed if m <= multipath), 255))
+
+	# append the columns of another archive
+	def extend(self, other):
+		base = len(self.offset)
+		self.runs.extend(run + base for run in other.runs)
+		self.offset.extend(other.offset)
+		self.size.extend(other.size)
+		self.maxCNO += other.maxCNO
+		self.gnssCount += other.gnssCount
+		for cno in self.cnoThresholds:
+			self.cnoCount[cno] += other.cnoCount[cno]
+		for key in self.validCount:
+			self.validCount[key] += other.validCount[key]
+		self.files += other.files
+		self.frames += other.frames
+		self.duplicates += other.duplicates
+
+	# start index and end index of every acquisition
+	def ranges(self):
+		ends = list(self.runs[1:]) + [len(self.offset)]
+		return list(zip(self.runs, ends))
+
+# decode one file in a worker process
+def decode_file(path, gnssType, cnoThresholds, multipathIndexes):
+	archive = Archive(cnoThresholds, multipathIndexes)
+	archive.add_file(path, gnssType)
+	return archive
+
+def load_archive(paths, gnssType, cnoThresholds, multipathIndexes, jobs=None):
+	archive = Archive(cnoThresholds, multipathIndexes)
+	files = archive_files(paths)
+	with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+		futures = [executor.submit(decode_file, path, gnssType, cnoThresholds, multipathIndexes) for path in files]
+		for future in futures:
+			archive.extend(future.result())
+	return archive
+
+# seconds from the last accepted epoch until the payload is sent, with the settings of at_cloudlocate_test
+def send_seconds(jsonSize, baudrate):
+	seconds = 0 if app.GNSS_KEEP_ON else GNSS_OFF_SECONDS
+	direct = app.PUBLISH_MODE == "auto" and jsonSize <= app.DIRECT_PUBLISH_LIMIT
+	if not direct:
+		seconds += FILE_SECONDS
+	if not app.KEEP_CONNECTION:
+		seconds += CONNECT_SECONDS
+	# the hex mode sends two characters per byte, 10 bits per character
+	return seconds + jsonSize*(2 if direct else 1)*10/baudrate
+
+def json_size(measxSize):
+	return JSON_OVERHEAD + (measxSize + 2)//3*4
+
+def percentile(values, fraction):
+	if not values:
+		return None
+	values = sorted(values)
+	return values[min(int(fraction*len(values)), len(values)-1)]
+
+# the archive of the sweep workers, set once per process
+sweepArchive = None
+sweepColumns = {}
+
+def set_archive(archive, timeout, baudrate):
+	global sweepArchive
+	sweepArchive = (archive, archive.ranges(), timeout, baudrate)
+	sweepColumns.clear()
+
+# prefix sums of a column reaching threshold: hits[i] epochs before i, sizes[i] their MEASX bytes
+def prefix_sums(key, threshold):
+	if (key, threshold) not in sweepColumns:
+		archive = sweepArchive[0]
+		column = archive.gnssCount if key is None else archive.cnoCount[key] if isinstance(key, int) else archive.validCount[key]
+		flags = column.translate(THRESHOLD_TABLES[min(threshold, 255)])
+		hits = array('I', itertools.accumulate(flags, initial=0))
+		sizes = array('Q', itertools.accumulate(map(operator.mul, flags, archive.size), initial=0))
+		sweepColumns[(key, threshold)] = (flags, hits, sizes)
+	return sweepColumns[(key, threshold)]
+
+# replay the acceptance of CloudLocate_run() and the fallback over every acquisition
+def evaluate(config):
+	cno, multipath, satellites, epochs, fallback, fallbackValue = config
+	archive, ranges, timeout, baudrate = sweepArchive
+	if fallback == FallbackConfig.FALLBACK_EXTEND_TIMEOUT:
+		timeout += fallbackValue
+	flags, hits, sizes = prefix_sums((cno, multipath), satellites)
+	# apply_fallback_logic(): epochs with enough satellites, the ones with the highest maxCNO are sent
+	if fallback == FallbackConfig.FALLBACK_EPOCHS:
+		fallbackFlags, fallbackHits, unused = prefix_sums(cno, satellites)
+		fallbackEpochs = fallbackValue
+	elif fallback == FallbackConfig.FALLBACK_NO_OF_SATELLITIES_ONLY:
+		fallbackFlags, fallbackHits, unused = prefix_sums(None, fallbackValue)
+		fallbackEpochs = epochs
+	else:
+		fallbackHits = None
+	offset = archive.offset
+	timeoutMs = timeout*1000
+	readyMs = app.GNSS_READY_TIMEOUT*1000
+	fallbackMs = app.FALLBACK_AFTER*readyMs
+
+	passed = fallbacks = censored = 0
+	epochsToAccept = 0
+	seconds = []
+	payloads = []
+	for start, end in ranges:
+		# TIMEOUT starts from the first valid epoch within GNSS_READY_TIMEOUT, without one the acquisition ends there
+		firstValid = bisect.bisect_left(hits, hits[start]+1, start+1, end+1) - 1
+		windowMs = offset[firstValid] + timeoutMs if firstValid < end and offset[firstValid] <= readyMs else readyMs
+		windowEnd = bisect.bisect_right(offset, windowMs, start, end)
+		firstValid = min(firstValid, windowEnd)
+		# the EPOCHS-th valid epoch within TIMEOUT
+		accepted = bisect.bisect_left(hits, hits[start]+epochs, start+1, windowEnd+1) - 1
+		measxSize = None
+		last = None
+		if fallbackHits is not None:
+			found = bisect.bisect_left(fallbackHits, fallbackHits[start]+fallbackEpochs, start+1, windowEnd+1) - 1
+			tried = max(found, bisect.bisect_left(offset, fallbackMs, start, windowEnd))
+			# ADAPTIVE_EPOCHS: without a valid epoch after FALLBACK_AFTER of GNSS_READY_TIMEOUT, the fallback is tried with every new epoch
+			if app.ADAPTIVE_EPOCHS and tried < windowEnd and tried < firstValid:
+				last = tried
+			# at TIMEOUT the fallback is applied to all epochs of the window
+			elif accepted >= windowEnd and found < windowEnd:
+				last = windowEnd - 1
+		if last is not None:
+			chosen = sorted((i for i in range(start, last+1) if fallbackFlags[i]), key=lambda i: archive.maxCNO[i], reverse=True)[0:fallbackEpochs]
+			measxSize = sum(archive.size[i] for i in chosen)
+			accepted = last
+			fallbacks += 1
+		elif accepted < windowEnd:
+			measxSize = sizes[accepted+1] - sizes[start]
+		if measxSize is None:
+			# the recording stopped before TIMEOUT, the outcome is unknown
+			if offset[end-1] < windowMs:
+				censored += 1
+			continue
+		passed += 1
+		epochsToAccept += accepted - start + 1
+		payloads.append(json_size(measxSize))
+		seconds.append(offset[accepted]/1000 + send_seconds(payloads[-1], baudrate))
+
+	runs = len(ranges)
+	return {'cno': cno, 'multipath': multipath, 'satellites': satellites, 'epochs': epochs,
+		'fallback': fallback.name[len('FALLBACK_'):] + ('' if fallback == FallbackConfig.FALLBACK_DO_NOT_SEND else ':'+str(fallbackValue)),
+		'runs': runs, 'passed': passed, 'pass_rate': passed/runs if runs else 0.0,
+		'fallback_rate': fallbacks/runs if runs else 0.0, 'censored': censored,
+		'epochs_to_accept': epochsToAccept/passed if passed else None,
+		'payload_mean': sum(payloads)/len(payloads) if payloads else None,
+		'over_mqttsn': sum(1 for size in payloads if size > app.MQTTSN_PAYLOAD_LIMIT)/passed if passed else None,
+		'over_mqtt': sum(1 for size in payloads if size > app.MQTT_PAYLOAD_LIMIT)/passed if passed else None,
+		'send_p50': percentile(seconds, 0.5), 'send_p90': percentile(seconds, 0.9)}
+
+def sweep(archive, configs, timeout, baudrate, jobs=None):
+	with concurrent.futures.ProcessPoolExecutor(jobs, initializer=set_archive, initargs=(archive, timeout, baudrate)) as executor:
+		return list(executor.map(evaluate, configs, chunksize=max(1, len(configs)//(4*(jobs or os.cpu_count() or 1)))))
+
+# the value of FALLBACK_CONFIG, FALLBACK_DO_NOT_SEND has none
+def fallback_value(fallback):
+	value = app.FALLBACK_CONFIG[fallback]
+	return 0 if value is True else value
+
+# "EPOCHS:1" -> (FallbackConfig.FALLBACK_EPOCHS, 1)
+def parse_fallback(text):
+	name, _, value = text.partition(':')
+	fallback = FallbackConfig['FALLBACK_'+name.upper()]
+	return fallback, int(value) if value else fallback_value(fallback)
+
+def parse_list(text):
+	return [int(value) for value in text.split(',')]
+
+def format_value(value, pattern):
+	return '-' if value is None else pattern.format(value)
+
+def print_report(results, current, top):
+	print(f'{"":1} {"cno":>4} {"mpath":>5} {"sats":>4} {"epochs":>6} {"fallback":<26} {"pass":>6} {"fallb":>6} {"epochs":>6} {"p50 s":>6} {"p90 s":>6} {"bytes":>6} {">1017":>6} {">8192":>6} {"cens":>5}')
+	for result in results[0:top]:
+		mark = '*' if current == (result['cno'], result['multipath'], result['satellites'], result['epochs'], result['fallback']) else ''
+		print(f'{mark:1} {result["cno"]:>4} {result["multipath"]:>5} {result["satellites"]:>4} {result["epochs"]:>6} {result["fallback"]:<26} '
+			f'{result["pass_rate"]:>6.1%} {result["fallback_rate"]:>6.1%} {format_value(result["epochs_to_accept"], "{:.1f}"):>6} '
+			f'{format_value(result["send_p50"], "{:.1f}"):>6} {format_value(result["send_p90"], "{:.1f}"):>6} '
+			f'{format_value(result["payload_mean"], "{:.0f}"):>6} {format_value(result["over_mqttsn"], "{:.0%}"):>6} {format_value(result["over_mqtt"], "{:.0%}"):>6} {result["censored"]:>5}')
+
+if __name__ == '__main__':
+	import argparse
+	fallbacks = ','.join(member.name[len('FALLBACK_'):] for member in FallbackConfig)
+	parser = argparse.ArgumentParser(description='Sweep the CloudLocate acquisition thresholds over recorded MEASX epochs')
+	parser.add_argument('paths', nargs='+', help='logs, +UGUBX line files (.gz) and .clcap captures, or directories of them')
+	parser.add_argument('--cno', type=parse_list, default=[18, 22, 26, 30], help='CNO_THRESHOLD values')
+	parser.add_argument('--multipath', type=parse_list, default=[1, 2, 3], help='MULTIPATH_INDEX values')
+	parser.add_argument('--satellites', type=parse_list, default=[4, 5, 6, 7, 8], help='MIN_NO_OF_SATELLITES values')
+	parser.add_argument('--epochs', type=parse_list, default=[1, 2, 3], help='EPOCHS values')
+	parser.add_argument('--fallback', default=fallbacks, help='fallback methodologies, NAME:value overrides FALLBACK_CONFIG, e.g. EPOCHS:2')
+	parser.add_argument('--timeout', type=float, default=app.TIMEOUT, help='TIMEOUT in seconds')
+	parser.add_argument('--baudrate', type=int, default=(app.LINK_BAUDRATES or [115200])[0], help='serial rate of the payload transfer')
+	parser.add_argument('--jobs', type=int, default=None, help='worker processes, default one per CPU')
+	parser.add_argument('--top', type=int, default=20, help='configurations printed')
+	parser.add_argument('-o', '--output', help='save all results as JSON')
+	args = parser.parse_args()
+
+	fallbackConfigs = [parse_fallback(text) for text in args.fallback.split(',')]
+	startTime = time.time()
+	archive = load_archive(args.paths, app.CONSTELLATION_TYPES[app.GNSS_TYPE], args.cno, args.multipath, args.jobs)
+	decodeTime = time.time() - startTime
+	print(f'{len(archive)} epochs in {len(archive.runs)} acquisitions from {archive.files} files '
+		f'({archive.frames} MEASX frames, {archive.duplicates} duplicates) decoded in {decodeTime:.1f} seconds')
+	if not len(archive):
+		sys.exit(1)
+
+	configs = [(cno, multipath, satellites, epochs, fallback, value)
+		for cno in args.cno for multipath in args.multipath for satellites in args.satellites
+		for epochs in args.epochs for fallback, value in fallbackConfigs]
+	startTime = time.time()
+	results = sweep(archive, configs, args.timeout, args.baudrate, args.jobs)
+	print(f'{len(configs)} configurations swept in {time.time()-startTime:.1f} seconds')
+	results.sort(key=lambda result: (-result['pass_rate'], result['send_p50'] if result['send_p50'] is not None else float('inf')))
+
+	currentFallback = app.FALLBACK_METHODOLOGY.name[len('FALLBACK_'):]
+	if app.FALLBACK_METHODOLOGY != FallbackConfig.FALLBACK_DO_NOT_SEND:
+		currentFallback += ':'+str(fallback_value(app.FALLBACK_METHODOLOGY))
+	print_report(results, (app.CNO_THRESHOLD, app.MULTIPATH_INDEX, app.MIN_NO_OF_SATELLITES, app.EPOCHS, currentFallback), args.top)
+	print('* the configuration of at_cloudlocate_test.py; pass/fallb: acquisitions sent / sent with the fallback; '
+		'epochs: polled until sent; p50/p90 s: from the first MEASX until the payload is sent; bytes: JSON payload; '
+		'cens: not sent, but the recording stopped before TIMEOUT')
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump({'epochs': len(archive), 'acquisitions': len(archive.runs), 'timeout': args.timeout, 'results': results}, f, indent=1)
+		print('.. Results saved to '+args.output)
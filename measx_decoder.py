@@ -0,0 +1,83 @@
+#====================================================================
+# UBX-RXM-MEASX decoder
+# The hex string from +UGUBX is decoded in one pass, the 44-byte MEASX header
+# is unpacked with struct and the 24-byte satellite blocks are read as strided
+# columns over a memoryview, so no per-satellite objects are created.
+#====================================================================
+
+import struct
+import binascii
+from array import array
+from itertools import accumulate
+
+# every MEASX message starts with this header (sync chars, class 0x02, id 0x14)
+MEASX_HEADER = b"\xb5\x62\x02\x14"
+
+# MEASX payload layout (UBX-RXM-MEASX, version 1)
+# version, gpsTOW, gloTOW, bdsTOW, qzssTOW, gpsTOWacc, gloTOWacc, bdsTOWacc, qzssTOWacc, numSv, flags
+MEASX_HEAD = struct.Struct('<B3xIII4xIHHH2xHBB8x')
+# gnssId, svId, cNo, mpathIndic, dopplerMS, dopplerHz, wholeChips, fracChips, codePhase, intCodePhase, pseuRangeRMSErr
+MEASX_BLOCK = struct.Struct('<BBBBiiHHIBB2x')
+
+MEASX_HEAD_SIZE = MEASX_HEAD.size	# 44
+MEASX_BLOCK_SIZE = MEASX_BLOCK.size	# 24
+
+# offsets of the one-byte fields inside a satellite block
+GNSS_ID_OFFSET = 0
+SV_ID_OFFSET = 1
+CNO_OFFSET = 2
+MPATH_OFFSET = 3
+
+# 8-bit Fletcher checksum of a UBX frame, computed over class, id, length and payload
+# ckB is the sum of the running sums of ckA, both are taken modulo 256 at the end
+def ubx_checksum(data):
+	ckA = sum(data) & 0xFF
+	ckB = sum(accumulate(data)) & 0xFF
+	return bytes((ckA, ckB))
+
+# convert the hex characters of +UGUBX into bytes
+def decode_hex(payload):
+	return binascii.unhexlify(payload)
+
+# one decoded MEASX epoch
+# message is the MEASX message without MEASX_HEADER: length(2) + payload + checksum(2)
+class MeasxEpoch:
+	def __init__(self, message):
+		view = memoryview(message)
+		if len(view) < 2:
+			raise ValueError('MEASX message too short')
+		size = view[0] | (view[1] << 8)
+		if size < MEASX_HEAD_SIZE or len(view) < size + 4:
+			raise ValueError('MEASX message truncated')
+
+		self.message = view[0:size+4]
+		self.payload = view[2:size+2]
+		(self.version, self.gpsTOW, self.gloTOW, self.bdsTOW, self.qzssTOW,
+			self.gpsTOWacc, self.gloTOWacc, self.bdsTOWacc, self.qzssTOWacc,
+			self.numSv, self.flags) = MEASX_HEAD.unpack_from(self.payload)
+
+		end = MEASX_HEAD_SIZE + MEASX_BLOCK_SIZE*self.numSv
+		if end > size:
+			raise ValueError('MEASX numSv does not fit the payload')
+		self.blocksView = self.payload[MEASX_HEAD_SIZE:end]
+
+		# strided views over the satellite blocks, one value per satellite
+		self.gnssId = array('B', self.blocksView[GNSS_ID_OFFSET::MEASX_BLOCK_SIZE])
+		self.svId = array('B', self.blocksView[SV_ID_OFFSET::MEASX_BLOCK_SIZE])
+		self.cNo = array('B', self.blocksView[CNO_OFFSET::MEASX_BLOCK_SIZE])
+		self.mpathIndic = array('B', self.blocksView[MPATH_OFFSET::MEASX_BLOCK_SIZE])
+
+	# iterate over the full satellite blocks as tuples in MEASX_BLOCK order
+	def blocks(self):
+		return MEASX_BLOCK.iter_unpack(self.blocksView)
+
+	# the complete UBX frame, as it is sent to CloudLocate
+	def frame(self):
+		return MEASX_HEADER + bytes(self.message)
+
+# decode a +UGUBX hex string holding a complete MEASX frame (starting with B5620214)
+def decode_measx_hex(hexPayload):
+	raw = decode_hex(hexPayload)
+	if raw[0:4] != MEASX_HEADER:
+		raise ValueError('not a MEASX frame')
+	return MeasxEpoch(memoryview(raw)[4:])
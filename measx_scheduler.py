@@ -0,0 +1,67 @@
+#====================================================================
+# Measurement-rate-aware scheduler for the UBX-RXM-MEASX polls
+# The receiver makes a new measurement every measRate milliseconds, a poll
+# sent before that returns the epoch we already have. The scheduler keeps
+# the gpsTOW of the last epoch, discards duplicates and tells the
+# acquisition loop how long to wait until the next epoch is due.
+# The rate comes from UBX-CFG-RATE, or from the gpsTOW steps of the epochs
+# when the modem does not answer the CFG-RATE poll.
+#====================================================================
+
+# gpsTOW (ms) wraps at the end of the GPS week
+WEEK_MS = 604800000
+
+class MeasxScheduler:
+	def __init__(self, rate=1000, retry=0.25):
+		self.rate = rate			# ms between two measurements
+		self.rateSource = 'default'	# 'default', 'gpsTOW' or 'CFG-RATE'
+		self.retry = retry			# seconds between polls while the receiver is not ready
+		self.reset()
+
+	# start a new acquisition, the rate is kept
+	def reset(self):
+		self.lastGpsTOW = None
+		self.lastTime = None		# host time the last new epoch arrived
+		self.readyTime = None		# host time of the first valid MEASX
+		self.epochs = 0
+		self.duplicates = 0
+
+	# measurement rate read from UBX-CFG-RATE
+	def set_rate(self, measRate):
+		if measRate > 0:
+			self.rate = measRate
+			self.rateSource = 'CFG-RATE'
+
+	# whether the epoch with gpsTOW received at now is new, duplicates of an older epoch return False
+	def accept(self, gpsTOW, now):
+		if self.lastGpsTOW is not None:
+			step = (gpsTOW - self.lastGpsTOW) % WEEK_MS
+			if step == 0 or step > WEEK_MS//2:
+				self.duplicates += 1
+				return False
+			# without CFG-RATE the smallest step between two epochs is the measurement rate
+			if self.rateSource == 'default' or (self.rateSource == 'gpsTOW' and step < self.rate):
+				self.rate = step
+				self.rateSource = 'gpsTOW'
+		self.lastGpsTOW = gpsTOW
+		self.lastTime = now
+		self.epochs += 1
+		return True
+
+	# an accepted epoch passed the thresholds of the acquisition, the first one makes the receiver ready
+	def mark_valid(self, now):
+		if self.readyTime is None:
+			self.readyTime = now
+
+	def ready(self):
+		return self.readyTime is not None
+
+	# seconds to wait at now before the next poll
+	def delay(self, now):
+		if self.lastTime is None:
+			return self.retry
+		due = self.lastTime + self.rate/1000.0
+		if due > now:
+			return due - now
+		# the next epoch is late, poll again soon
+		return min(self.retry, self.rate/4000.0)
@@ -0,0 +1,368 @@
+#====================================================================
+# Simulated SARA-R510M8s modem
+# Replays a recorded transcript ("Test log.txt" format, input->/output-> lines)
+# behind a pyserial-compatible object, or behind a pty when run as a script, so the whole
+# CloudLocate flow can run offline without an EVK, at recorded or accelerated time.
+#====================================================================
+
+import threading,time,sys
+import re
+import heapq
+import os
+
+# 2021-08-16 12:55:12:input->AT+UGUBX="B562021400001644"
+TRANSCRIPT_LINE = re.compile(r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d):(input|output)->(.*)$')
+
+# AT+UDWNFILE="CloudLocate_pub_data.txt",903
+DOWNLOAD_FILE = re.compile(r'^AT\+UDWNFILE="[^"]*",(\d+)', re.IGNORECASE)
+
+# AT+IPR=921600
+SET_BAUDRATE = re.compile(r'^AT\+IPR=(\d+)', re.IGNORECASE)
+
+# AT+UMQTTC=2,0,0,1,"CloudLocate/GNSS/request","7B22626F6479..." publishes the hex characters of the JSON
+HEX_PUBLISH = re.compile(r'^AT\+UMQTTC=2,.*"([0-9A-F]+)"$', re.IGNORECASE)
+
+# AT+UMQTTC=3,0,0,"CloudLocate/GNSS/request","CloudLocate_pub_data.txt" publishes the file
+FILE_PUBLISH = re.compile(r'^AT\+UMQTTC=3,', re.IGNORECASE)
+
+# the request time of a payload, and the one of the position in a reply
+UTC_DATE_TIME = re.compile(rb'"UTCDateTime":"([^"]*)"')
+MEASX_TIME = re.compile(r'"MeasxTime":"[^"]*"')
+
+# commands which are not in the transcript are answered with this reply
+DEFAULT_REPLY = [(0.0, 'OK')]
+
+# commands which are not in "Test log.txt" but need a URC, e.g. the in-command publish
+SYNTHETIC_REPLIES = {
+	'AT+UMQTTC=2,0,0,1,': [(0.0, 'OK'), (0.5, '+UUMQTTC: 2,1'), (4.0, '+UUMQTTC: 6,1')],
+	'AT+UMQTTSNC=4,0,0,1,0,': [(0.0, 'OK'), (0.5, '+UUMQTTSNC: 4,1')],
+}
+
+# the part of a command used when there is no exact match, e.g. 'AT+UMQTTC=4,0,' for a different topic
+def command_key(at_cmd):
+	return at_cmd.split('"')[0].upper()
+
+# split AT+A;+B;+C into AT+A, AT+B, AT+C, a ";" inside quotes is kept
+def split_chain(at_cmd):
+	parts = []
+	start = 0
+	quoted = False
+	for index, char in enumerate(at_cmd):
+		if char == '"':
+			quoted = not quoted
+		elif char == ';' and not quoted:
+			parts.append(at_cmd[start:index])
+			start = index + 1
+	parts.append(at_cmd[start:])
+	return [parts[0]] + ['AT'+part for part in parts[1:]]
+
+# read a transcript and return {command: [reply, ...]}, reply is a list of (delay, line)
+# delays are seconds after the command was sent, taken from the recorded timestamps
+def load_transcript(path):
+	transcript = {}
+	command = None
+	commandTime = 0
+	dataCommand = False
+	with open(path, encoding='utf-8', errors='replace') as f:
+		for line in f:
+			match = TRANSCRIPT_LINE.match(line.rstrip('\r\n'))
+			if match is None:
+				continue
+			stamp = time.mktime(time.strptime(match.group(1), "%Y-%m-%d %H:%M:%S"))
+			if match.group(2) == 'input':
+				if dataCommand:
+					# payload of AT+UDWNFILE, its replies belong to the download command
+					dataCommand = False
+					continue
+				command = match.group(3).strip()
+				commandTime = stamp
+				transcript.setdefault(command.upper(), []).append([])
+				dataCommand = DOWNLOAD_FILE.match(command) is not None
+			elif command is not None:
+				transcript[command.upper()][-1].append((stamp - commandTime, match.group(3)))
+	return transcript
+
+# pyserial-compatible modem stand-in
+class SimulatedModem:
+	def __init__(self, transcript="Test log.txt", time_scale=1.0, latency=0.0, latencies=None, timeout=2, port="SIM", line_time=False):
+		self.transcript = load_transcript(transcript) if isinstance(transcript, str) else transcript
+		self.keys = {}
+		for command in self.transcript:
+			self.keys.setdefault(command_key(command), command)
+		self.replayIndex = {}
+		self.time_scale = time_scale	# 1.0 recorded speed, 0.1 ten times faster, 0 no delay
+		self.latency = latency		# added to every reply (seconds)
+		self.latencies = latencies or {}	# command key -> fixed delay of its first reply (seconds)
+		self.timeout = timeout
+		self.port = port
+		self.baudrate = 115200		# rate of the host side, set by the host like a pyserial port
+		self.modemBaudrate = 115200	# rate of the modem side, set with AT+IPR
+		self.line_time = line_time	# True: replies take 10 bits per byte at modemBaudrate on the wire
+		self.lineFree = 0.0			# the wire is busy with earlier replies until then
+		self.garbledBytes = 0		# bytes lost because host and modem rates differ
+		self.is_open = True
+
+		self.cond = threading.Condition()
+		self.rxBuffer = bytearray()	# bytes waiting to be read by the host
+		self.txBuffer = bytearray()	# bytes written by the host, not parsed yet
+		self.dataRemaining = 0		# bytes of AT+UDWNFILE data still expected
+		self.fileData = bytearray()	# the content of the last AT+UDWNFILE
+		self.published = None		# UTCDateTime of the last published payload, the reply carries it as MeasxTime
+		self.pendingReply = []		# replies of AT+UDWNFILE, sent after the data
+		self.schedule = []			# heap of (due, seq, bytes)
+		self.seq = 0
+		self.commands = []			# every command received, for tests and benchmarks
+		self.unread = []			# (arrival time, MeasxTime) of the received MQTT messages not read yet
+		self.bytesIn = 0
+		self.bytesOut = 0
+		self.worker = threading.Thread(target=self.deliver, daemon=True)
+		self.worker.start()
+
+	def reply_for(self, at_cmd):
+		command = at_cmd.upper()
+		commands = split_chain(at_cmd)
+		if command not in self.transcript and len(commands) > 1:
+			return self.chained_reply(commands)
+		if command not in self.transcript:
+			command = self.keys.get(command_key(at_cmd))
+		if command is None:
+			return SYNTHETIC_REPLIES.get(command_key(at_cmd), DEFAULT_REPLY)
+		replies = self.transcript[command]
+		index = self.replayIndex.get(command, 0)
+		self.replayIndex[command] = index + 1
+		return replies[index % len(replies)]
+
+	# a chained line answers with the lines of every command and one final result code,
+	# it stops at the first command which does not return OK
+	def chained_reply(self, commands):
+		reply = []
+		for at_cmd in commands:
+			lines = self.reply_for(at_cmd)
+			final = [(delay, line) for delay, line in lines if line == 'OK' or 'ERROR' in line]
+			if any(line != 'OK' for delay, line in final):
+				return reply + lines
+			offset = reply[-1][0] if reply else 0
+			reply += [(offset + delay, line) for delay, line in lines if line != 'OK']
+		return reply + [((reply[-1][0] if reply else 0), 'OK')]
+
+	# the UTCDateTime of a payload published in the command or from the file
+	def note_publish(self, at_cmd):
+		payload = None
+		match = HEX_PUBLISH.match(at_cmd)
+		if match:
+			try:
+				payload = bytes.fromhex(match.group(1))
+			except ValueError:
+				return
+		elif FILE_PUBLISH.match(at_cmd):
+			payload = self.fileData
+		if payload is not None:
+			match = UTC_DATE_TIME.search(payload)
+			self.published = match.group(1).decode(errors='replace') if match else None
+
+	def queue(self, delay, data):
+		due = time.monotonic() + delay
+		if self.line_time:
+			due = max(due, self.lineFree) + len(data)*10.0/self.modemBaudrate*self.time_scale
+			self.lineFree = due
+		heapq.heappush(self.schedule, (due, self.seq, data, self.modemBaudrate))
+		self.seq += 1
+		self.cond.notify_all()
+
+	def handle_command(self, at_cmd):
+		self.commands.append(at_cmd)
+		reply = self.reply_for(at_cmd)
+		fixed = self.latencies.get(command_key(at_cmd))
+		first = reply[0][0] if reply else 0
+		now = time.monotonic()
+		self.note_publish(at_cmd)
+		if command_key(at_cmd) == 'AT+UMQTTC=6':
+			# the read returns every message received so far, the recorded one for each with the MeasxTime of its request
+			received = [measxTime for due, measxTime in self.unread if due <= now]
+			self.unread = [(due, measxTime) for due, measxTime in self.unread if due > now]
+			message = [(delay, line) for delay, line in reply if line.startswith('+UMQTTC: 6,')][0:1]
+			reply = [(delay, line if measxTime is None else MEASX_TIME.sub('"MeasxTime":"'+measxTime+'"', line))
+				for measxTime in received for delay, line in message] + [(delay, line) for delay, line in reply if not line.startswith('+UMQTTC: 6,')]
+		lines = []
+		for delay, line in reply:
+			if fixed is not None:
+				delay = fixed + delay - first
+			delay = delay*self.time_scale + self.latency
+			if line.startswith('+UUMQTTC: 6,'):
+				# the URC reports the number of unread messages
+				self.unread.append((now + delay, self.published))
+				line = '+UUMQTTC: 6,'+str(len(self.unread))
+			lines.append((delay, (line+'\r\n').encode()))
+
+		match = SET_BAUDRATE.match(at_cmd)
+		if match:
+			# OK is sent at the old rate, then the modem switches
+			for delay, data in lines:
+				self.queue(delay, data)
+			self.modemBaudrate = int(match.group(1))
+			return
+
+		match = DOWNLOAD_FILE.match(at_cmd)
+		if match:
+			# the file content follows the ">" prompt, replies are sent once it is complete
+			self.dataRemaining = int(match.group(1))
+			self.fileData = bytearray()
+			self.pendingReply = lines
+			self.queue(self.latency, b'>')
+		else:
+			for delay, data in lines:
+				self.queue(delay, data)
+
+	# parse bytes written by the host
+	def process(self):
+		while True:
+			if self.dataRemaining:
+				take = min(self.dataRemaining, len(self.txBuffer))
+				self.fileData += self.txBuffer[:take]
+				del self.txBuffer[:take]
+				self.dataRemaining -= take
+				if self.dataRemaining:
+					return
+				self.queue(0, b'\r\n')
+				for delay, data in self.pendingReply:
+					self.queue(delay, data)
+				self.pendingReply = []
+				continue
+			end = self.txBuffer.find(b'\r')
+			if end < 0:
+				return
+			at_cmd = self.txBuffer[:end].decode(errors='replace').strip()
+			del self.txBuffer[:end+1]
+			if self.txBuffer.startswith(b'\n'):
+				del self.txBuffer[:1]
+			if at_cmd:
+				self.handle_command(at_cmd)
+
+	def write(self, data):
+		with self.cond:
+			self.bytesIn += len(data)
+			if self.baudrate != self.modemBaudrate:
+				self.garbledBytes += len(data)
+				return len(data)
+			self.txBuffer.extend(data)
+			self.process()
+		return len(data)
+
+	# move scheduled replies into the receive buffer when they are due
+	def deliver(self):
+		with self.cond:
+			while self.is_open:
+				now = time.monotonic()
+				while self.schedule and self.schedule[0][0] <= now:
+					due, seq, data, baudrate = heapq.heappop(self.schedule)
+					# sent at another rate than the host reads: nothing usable arrives
+					if baudrate != self.baudrate:
+						self.garbledBytes += len(data)
+						continue
+					self.rxBuffer.extend(data)
+					self.cond.notify_all()
+				wait = self.schedule[0][0] - now if self.schedule else None
+				self.cond.wait(wait)
+
+	@property
+	def in_waiting(self):
+		return len(self.rxBuffer)
+
+	def read_until(self, expected=b'\n', size=None):
+		deadline = None if self.timeout is None else time.monotonic() + self.timeout
+		with self.cond:
+			while self.is_open:
+				end = self.rxBuffer.find(expected)
+				if end >= 0:
+					end += len(expected)
+				if size is not None and (end < 0 or end > size) and len(self.rxBuffer) >= size:
+					end = size
+				if end >= 0:
+					data = bytes(self.rxBuffer[:end])
+					del self.rxBuffer[:end]
+					self.bytesOut += len(data)
+					return data
+				remaining = None if deadline is None else deadline - time.monotonic()
+				if remaining is not None and remaining <= 0:
+					break
+				self.cond.wait(remaining)
+			data = bytes(self.rxBuffer)
+			self.rxBuffer.clear()
+			self.bytesOut += len(data)
+			return data
+
+	def readline(self, size=None):
+		return self.read_until(b'\n', size)
+
+	def read(self, size=1):
+		deadline = None if self.timeout is None else time.monotonic() + self.timeout
+		with self.cond:
+			while self.is_open and len(self.rxBuffer) < size:
+				remaining = None if deadline is None else deadline - time.monotonic()
+				if remaining is not None and remaining <= 0:
+					break
+				self.cond.wait(remaining)
+			data = bytes(self.rxBuffer[:size])
+			del self.rxBuffer[:size]
+			self.bytesOut += len(data)
+			return data
+
+	def reset_input_buffer(self):
+		with self.cond:
+			self.rxBuffer.clear()
+
+	def flush(self):
+		pass
+
+	def close(self):
+		with self.cond:
+			self.is_open = False
+			self.cond.notify_all()
+
+# expose a SimulatedModem on a pseudo terminal, so it can be opened with serial.Serial(port=...)
+class PtyModem:
+	def __init__(self, modem):
+		import tty
+		self.modem = modem
+		self.master, self.slave = os.openpty()
+		tty.setraw(self.slave)
+		self.port = os.ttyname(self.slave)
+		self.modem.timeout = 0.1
+		threading.Thread(target=self.host_to_modem, daemon=True).start()
+		threading.Thread(target=self.modem_to_host, daemon=True).start()
+
+	def host_to_modem(self):
+		while self.modem.is_open:
+			try:
+				data = os.read(self.master, 4096)
+			except OSError:
+				break
+			self.modem.write(data)
+
+	def modem_to_host(self):
+		while self.modem.is_open:
+			data = self.modem.read(max(1, self.modem.in_waiting))
+			if data:
+				os.write(self.master, data)
+
+	def close(self):
+		self.modem.close()
+		os.close(self.master)
+		os.close(self.slave)
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description='Replay a SARA-R510M8s transcript on a pseudo terminal')
+	parser.add_argument('transcript', nargs='?', default='Test log.txt')
+	parser.add_argument('--time-scale', type=float, default=1.0, help='1.0 recorded speed, 0 no delay')
+	parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every reply')
+	args = parser.parse_args()
+
+	pty = PtyModem(SimulatedModem(args.transcript, time_scale=args.time_scale, latency=args.latency))
+	print('Simulated SARA-R510M8s on '+pty.port)
+	try:
+		while True:
+			time.sleep(1)
+	except KeyboardInterrupt:
+		pty.close()
+		sys.exit()
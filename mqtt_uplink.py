@@ -0,0 +1,384 @@
+#====================================================================
+# Host-side MQTT uplink for gateways with their own network
+# Instead of the AT+UMQTTC client of the modem (one broker connection per
+# fix), the JSON payload is published over an MQTT 3.1.1 connection of the
+# host which stays open and is shared by all devices of the process (pool).
+# QoS 1 publishes are pipelined: up to window publishes wait for their
+# PUBACK at the same time. Subscriptions (e.g. MQTT_SUB_TOPIC) are kept and
+# subscribed again after a reconnect. Only the standard library is used.
+# Status lines go to log, e.g. the log of at_cloudlocate_test.
+#====================================================================
+
+import time
+import socket
+import struct
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from log_buffer import BufferedLog
+
+# control packet types
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+MQTT_PORT = 1883
+MQTT_TLS_PORT = 8883
+
+# the log of an uplink created without one
+defaultLog = BufferedLog()
+
+# the connection was lost or refused
+class UplinkError(ConnectionError):
+	pass
+
+def encode_string(value):
+	data = value.encode() if isinstance(value, str) else value
+	return struct.pack('>H', len(data)) + data
+
+# fixed header (type, flags, remaining length) + body
+def encode_packet(packetType, flags, body=b''):
+	header = bytearray([packetType << 4 | flags])
+	length = len(body)
+	while True:
+		digit = length & 0x7F
+		length >>= 7
+		header.append(digit | 0x80 if length else digit)
+		if not length:
+			break
+	return bytes(header) + body
+
+def encode_publish(topic, payload, qos=1, packetId=0, dup=False, retain=False):
+	body = encode_string(topic)
+	if qos:
+		body += struct.pack('>H', packetId)
+	data = payload.encode() if isinstance(payload, str) else payload
+	return encode_packet(PUBLISH, (0x08 if dup else 0) | qos << 1 | (0x01 if retain else 0), body + data)
+
+# (topic, packetId, qos, payload) of a PUBLISH body
+def decode_publish(flags, body):
+	length = struct.unpack_from('>H', body)[0]
+	topic = bytes(body[2:2+length]).decode()
+	qos = (flags >> 1) & 0x03
+	offset = 2 + length
+	packetId = 0
+	if qos:
+		packetId = struct.unpack_from('>H', body, offset)[0]
+		offset += 2
+	return topic, packetId, qos, bytes(body[offset:])
+
+# whether a topic filter with + and # wildcards matches the topic
+def topic_matches(topicFilter, topic):
+	filterLevels = topicFilter.split('/')
+	topicLevels = topic.split('/')
+	for i, level in enumerate(filterLevels):
+		if level == '#':
+			return True
+		if i >= len(topicLevels) or (level != '+' and level != topicLevels[i]):
+			return False
+	return len(filterLevels) == len(topicLevels)
+
+# read one packet from a socket, return (type, flags, body) or None when the connection is closed
+def read_packet(sock):
+	first = sock.recv(1)
+	if not first:
+		return None
+	length = 0
+	shift = 0
+	while True:
+		digit = sock.recv(1)
+		if not digit:
+			return None
+		length |= (digit[0] & 0x7F) << shift
+		shift += 7
+		if not digit[0] & 0x80:
+			break
+	body = bytearray()
+	while len(body) < length:
+		data = sock.recv(length - len(body))
+		if not data:
+			return None
+		body.extend(data)
+	return first[0] >> 4, first[0] & 0x0F, body
+
+class MQTTUplink:
+	def __init__(self, host, port=MQTT_PORT, clientId='', username=None, password=None, keepalive=60, window=8, tls=False, timeout=30, log=None):
+		self.host = host
+		self.log = log or defaultLog
+		self.port = port
+		self.clientId = clientId
+		self.username = username
+		self.password = password
+		self.keepalive = keepalive
+		self.tls = tls
+		self.timeout = timeout
+		self.window = threading.BoundedSemaphore(window)	# publishes waiting for their PUBACK
+		self.lock = threading.Lock()		# packet ids, in-flight publishes and socket writes
+		self.connectLock = threading.Lock()
+		self.sock = None
+		self.connected = False
+		self.nextId = 0
+		self.inflight = {}		# packetId -> Future of a publish
+		self.pending = {}		# packetId -> Future of a (un)subscribe
+		self.subscriptions = {}	# topic filter -> [callback(topic, payload)]
+		self.lastReceived = 0.0
+		self.published = 0
+		self.received = 0
+		self.connects = 0
+
+	def packet_id(self):
+		self.nextId = self.nextId % 65535 + 1
+		while self.nextId in self.inflight or self.nextId in self.pending:
+			self.nextId = self.nextId % 65535 + 1
+		return self.nextId
+
+	def send(self, data):
+		with self.lock:
+			if self.sock is None:
+				raise UplinkError('not connected')
+			self.sock.sendall(data)
+
+	# open the connection unless it is open, return True when the broker accepted it
+	def connect(self):
+		with self.connectLock:
+			if self.connected:
+				return True
+			try:
+				sock = socket.create_connection((self.host, self.port), self.timeout)
+				if self.tls:
+					import ssl
+					sock = ssl.create_default_context().wrap_socket(sock, server_hostname=self.host)
+				flags = 0x02	# clean session
+				payload = encode_string(self.clientId)
+				if self.username is not None:
+					flags |= 0x80
+					payload += encode_string(self.username)
+				if self.password is not None:
+					flags |= 0x40
+					payload += encode_string(self.password)
+				sock.sendall(encode_packet(CONNECT, 0, encode_string('MQTT') + struct.pack('>BBH', 4, flags, self.keepalive) + payload))
+				packet = read_packet(sock)
+			except OSError as e:
+				self.log.warning('.. MQTT uplink cannot connect '+self.host+':'+str(self.port)+': '+str(e))
+				return False
+			if packet is None or packet[0] != CONNACK or packet[2][1] != 0:
+				self.log.warning('.. MQTT uplink refused by '+self.host+':'+str(self.port)+(', return code '+str(packet[2][1]) if packet and packet[0] == CONNACK else ''))
+				sock.close()
+				return False
+			# the reader wakes up to send PINGREQ within the keep alive time
+			sock.settimeout(max(self.keepalive/2, 1) if self.keepalive else None)
+			self.sock = sock
+			self.connected = True
+			self.connects += 1
+			self.lastReceived = time.time()
+			threading.Thread(target=self.reader, args=(sock,), daemon=True).start()
+			for topicFilter in list(self.subscriptions):
+				self.send_subscribe(topicFilter)
+			return True
+
+	def reader(self, sock):
+		while True:
+			try:
+				packet = read_packet(sock)
+			except socket.timeout:
+				if time.time() - self.lastReceived > 1.5*self.keepalive:
+					break
+				try:
+					self.send(encode_packet(PINGREQ, 0))
+				except OSError:
+					break
+				continue
+			except OSError:
+				break
+			if packet is None:
+				break
+			self.lastReceived = time.time()
+			try:
+				self.dispatch(*packet)
+			except OSError:
+				break
+		self.dropped(sock)
+
+	def dispatch(self, packetType, flags, body):
+		if packetType == PUBACK:
+			self.settle(self.inflight, struct.unpack_from('>H', body)[0], True)
+		elif packetType == SUBACK:
+			self.settle(self.pending, struct.unpack_from('>H', body)[0], body[2] != 0x80)
+		elif packetType == UNSUBACK:
+			self.settle(self.pending, struct.unpack_from('>H', body)[0], True)
+		elif packetType == PUBLISH:
+			topic, packetId, qos, payload = decode_publish(flags, body)
+			if qos:
+				self.send(encode_packet(PUBACK, 0, struct.pack('>H', packetId)))
+			self.received += 1
+			for topicFilter, callbacks in list(self.subscriptions.items()):
+				if topic_matches(topicFilter, topic):
+					for callback in list(callbacks):
+						callback(topic, payload)
+
+	# complete the future of a packet id, a publish frees its place in the window
+	def settle(self, futures, packetId, result=None, error=None):
+		with self.lock:
+			future = futures.pop(packetId, None)
+		if future is None:
+			return
+		if futures is self.inflight:
+			self.window.release()
+			if error is None:
+				self.published += 1
+		if future.done():
+			return
+		if error is None:
+			future.set_result(result)
+		else:
+			future.set_exception(error)
+
+	# the connection is lost: publishes still waiting for PUBACK fail, the next publish connects again
+	def dropped(self, sock):
+		with self.lock:
+			if self.sock is not sock:
+				return
+			self.sock = None
+			self.connected = False
+		try:
+			sock.close()
+		except OSError:
+			pass
+		for futures in (self.inflight, self.pending):
+			for packetId in list(futures):
+				self.settle(futures, packetId, error=UplinkError('connection lost'))
+
+	# start a publish, the Future is done with True at its PUBACK (at once for qos 0) or fails with UplinkError
+	def publish_async(self, topic, payload, qos=1):
+		future = Future()
+		if not self.connect():
+			future.set_exception(UplinkError('cannot connect '+self.host))
+			return future
+		if qos == 0:
+			self.send(encode_publish(topic, payload, 0))
+			self.published += 1
+			future.set_result(True)
+			return future
+		if not self.window.acquire(timeout=self.timeout):
+			future.set_exception(UplinkError('no PUBACK within '+str(self.timeout)+' seconds'))
+			return future
+		with self.lock:
+			packetId = self.packet_id()
+			self.inflight[packetId] = future
+		future.packetId = packetId
+		try:
+			self.send(encode_publish(topic, payload, qos, packetId))
+		except OSError as e:
+			self.settle(self.inflight, packetId, error=UplinkError(str(e)))
+		return future
+
+	# publish and wait for the PUBACK, return True when the broker has it
+	def publish(self, topic, payload, qos=1, timeout=None):
+		future = self.publish_async(topic, payload, qos)
+		return self.wait(future, timeout)
+
+	# wait for a Future of publish_async(), return True when the broker has the payload
+	def wait(self, future, timeout=None):
+		try:
+			return future.result(self.timeout if timeout is None else timeout)
+		except UplinkError:
+			return False
+		except FutureTimeout:
+			pass
+		self.settle(self.inflight, getattr(future, 'packetId', None), error=UplinkError('no PUBACK'))
+		return False
+
+	def send_subscribe(self, topicFilter, qos=1):
+		future = Future()
+		with self.lock:
+			packetId = self.packet_id()
+			self.pending[packetId] = future
+		try:
+			self.send(encode_packet(SUBSCRIBE, 0x02, struct.pack('>H', packetId) + encode_string(topicFilter) + bytes([qos])))
+		except OSError as e:
+			self.settle(self.pending, packetId, error=UplinkError(str(e)))
+		return future
+
+	# call callback(topic, payload) for every message on topicFilter, also after a reconnect
+	# return True when the broker accepted the subscription
+	# the connection is opened first, connect() subscribes the filters it already has, not this one again
+	def subscribe(self, topicFilter, callback, qos=1):
+		connected = self.connect()
+		with self.lock:
+			callbacks = self.subscriptions.setdefault(topicFilter, [])
+			first = not callbacks
+			callbacks.append(callback)
+		# kept for the next connect
+		if not connected:
+			return False
+		if not first:
+			return True
+		try:
+			return self.send_subscribe(topicFilter, qos).result(self.timeout)
+		except (UplinkError, FutureTimeout):
+			return False
+
+	def unsubscribe(self, topicFilter, callback):
+		with self.lock:
+			callbacks = self.subscriptions.get(topicFilter, [])
+			if callback in callbacks:
+				callbacks.remove(callback)
+			if callbacks:
+				return
+			self.subscriptions.pop(topicFilter, None)
+			if self.sock is None:
+				return
+			packetId = self.packet_id()
+			self.pending[packetId] = Future()
+		try:
+			self.send(encode_packet(UNSUBSCRIBE, 0x02, struct.pack('>H', packetId) + encode_string(topicFilter)))
+		except OSError:
+			pass
+
+	def close(self):
+		with self.lock:
+			sock = self.sock
+		if sock is None:
+			return
+		try:
+			self.send(encode_packet(DISCONNECT, 0))
+		except OSError:
+			pass
+		self.dropped(sock)
+
+# one uplink per broker and client id, shared by all devices of the process
+class UplinkPool:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.uplinks = {}	# (host, port, clientId) -> [MQTTUplink, users]
+
+	def acquire(self, host, port=MQTT_PORT, clientId='', **options):
+		with self.lock:
+			entry = self.uplinks.get((host, port, clientId))
+			if entry is None:
+				entry = self.uplinks[(host, port, clientId)] = [MQTTUplink(host, port, clientId, **options), 0]
+			entry[1] += 1
+			return entry[0]
+
+	# the connection is closed when its last user releases it
+	def release(self, uplink):
+		with self.lock:
+			key = (uplink.host, uplink.port, uplink.clientId)
+			entry = self.uplinks.get(key)
+			if entry is None or entry[0] is not uplink:
+				return
+			entry[1] -= 1
+			if entry[1] > 0:
+				return
+			del self.uplinks[key]
+		uplink.close()
+
+pool = UplinkPool()
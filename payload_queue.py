@@ -0,0 +1,145 @@
+#====================================================================
+# Persistent store-and-forward queue for CloudLocate payloads
+# A payload which could not be published (no coverage, PDP context or broker
+# connection failed) is appended to a log segment on the host and published
+# later over the next broker session. Every record is
+#   magic "CQ", length (u4), crc32 (u4), JSON payload with its UTCDateTime
+# and is flushed to disk before put() returns. The index file keeps the
+# position of the oldest record not yet published. A record torn by a crash
+# fails its length/crc check and is cut off when the queue is opened again.
+# Payloads are published at least once: a crash between the publish and
+# ack() publishes that payload again. remove() takes out a payload behind
+# the head which was published while an older one was not; the index still
+# points at the older one, so after a crash it is published again as well.
+#====================================================================
+
+import os
+import json
+import zlib
+import struct
+import collections
+
+RECORD_HEAD = struct.Struct('<2sII')
+RECORD_MAGIC = b'CQ'
+SEGMENT_NAME = 'segment-%08d.log'
+INDEX_NAME = 'index.json'
+
+class PayloadQueue:
+	def __init__(self, path, maxBytes=1048576, segmentSize=65536):
+		self.path = path
+		self.maxBytes = maxBytes			# oldest payloads are dropped above this size
+		self.segmentSize = segmentSize		# a new segment is started above this size
+		self.records = collections.deque()	# (segment, offset, size) of every queued record, oldest first
+		self.size = 0
+		self.droppedPayloads = 0
+		os.makedirs(path, exist_ok=True)
+
+		segments = sorted(int(name[8:16]) for name in os.listdir(path) if name.startswith('segment-') and name.endswith('.log'))
+		headSegment, headOffset = self.read_index()
+		for segment in segments:
+			if segment < headSegment:
+				os.remove(self.segment_path(segment))
+				continue
+			self.scan(segment, headOffset if segment == headSegment else 0, segment == segments[-1])
+		# new records never go into a segment before the head
+		self.tail = max(segments[-1] if segments else 1, headSegment)
+		self.tailSize = os.path.getsize(self.segment_path(self.tail)) if os.path.exists(self.segment_path(self.tail)) else 0
+		self.file = open(self.segment_path(self.tail), 'ab')
+
+	def __len__(self):
+		return len(self.records)
+
+	def segment_path(self, segment):
+		return os.path.join(self.path, SEGMENT_NAME % segment)
+
+	def read_index(self):
+		try:
+			with open(os.path.join(self.path, INDEX_NAME)) as f:
+				index = json.load(f)
+			return index['segment'], index['offset']
+		except (OSError, ValueError, KeyError):
+			return 0, 0
+
+	# the index is replaced in one step, a crash leaves the old or the new one
+	def write_index(self, segment, offset):
+		indexPath = os.path.join(self.path, INDEX_NAME)
+		with open(indexPath+'.tmp', 'w') as f:
+			json.dump({'segment': segment, 'offset': offset}, f)
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(indexPath+'.tmp', indexPath)
+
+	# add the valid records of a segment from offset, a torn record at the end of the last segment is cut off
+	def scan(self, segment, offset, last):
+		with open(self.segment_path(segment), 'rb') as f:
+			data = f.read()
+		while offset + RECORD_HEAD.size <= len(data):
+			magic, length, crc = RECORD_HEAD.unpack_from(data, offset)
+			end = offset + RECORD_HEAD.size + length
+			if magic != RECORD_MAGIC or end > len(data) or zlib.crc32(data[offset+RECORD_HEAD.size:end]) != crc:
+				break
+			self.records.append((segment, offset, end - offset))
+			self.size += end - offset
+			offset = end
+		if last and offset < len(data):
+			with open(self.segment_path(segment), 'r+b') as f:
+				f.truncate(offset)
+
+	# append a payload, return the number of payloads dropped to keep maxBytes
+	def put(self, payload):
+		data = payload.encode()
+		record = RECORD_HEAD.pack(RECORD_MAGIC, len(data), zlib.crc32(data)) + data
+		if self.tailSize and self.tailSize + len(record) > self.segmentSize:
+			self.file.close()
+			self.tail += 1
+			self.tailSize = 0
+			self.file = open(self.segment_path(self.tail), 'ab')
+		self.file.write(record)
+		self.file.flush()
+		os.fsync(self.file.fileno())
+		self.records.append((self.tail, self.tailSize, len(record)))
+		self.tailSize += len(record)
+		self.size += len(record)
+
+		dropped = 0
+		while self.size > self.maxBytes and len(self.records) > 1:
+			segment, offset, size = self.records[0]
+			self.ack((segment, offset))
+			dropped += 1
+		self.droppedPayloads += dropped
+		return dropped
+
+	# up to count queued payloads as (position, payload), oldest first
+	def peek(self, count):
+		result = []
+		for segment, offset, size in list(self.records)[0:count]:
+			with open(self.segment_path(segment), 'rb') as f:
+				f.seek(offset + RECORD_HEAD.size)
+				result.append(((segment, offset), f.read(size - RECORD_HEAD.size).decode()))
+		return result
+
+	# remove the payload at position and every older one, e.g. once it is published
+	def ack(self, position):
+		while self.records and self.records[0][0:2] <= position:
+			segment, offset, size = self.records.popleft()
+			self.size -= size
+		head = self.records[0][0:2] if self.records else (self.tail, self.tailSize)
+		self.write_index(*head)
+		# segments before the head are published completely
+		for name in os.listdir(self.path):
+			if name.startswith('segment-') and name.endswith('.log') and int(name[8:16]) < head[0]:
+				os.remove(os.path.join(self.path, name))
+
+	# remove only the payload at position, e.g. published while an older one failed
+	def remove(self, position):
+		if self.records and self.records[0][0:2] == position:
+			self.ack(position)
+			return
+		for record in self.records:
+			if record[0:2] == position:
+				self.records.remove(record)
+				self.size -= record[2]
+				return
+
+	def close(self):
+		self.file.close()
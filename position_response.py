@@ -0,0 +1,135 @@
+#====================================================================
+# Positions sent back by CloudLocate, matched to the requests
+# Every published MEASX payload is submitted as a request with its response
+# topic and UTCDateTime and gets a Future. A reply such as
+#   {"Lat":25.0804284,"Lon":121.5606483,"Alt":82.648,"Acc":32.92,
+#    "MeasxTime":"2021-08-16T04:55:21","Epochs":2}
+# resolves the request with the same topic and MeasxTime == UTCDateTime,
+# or the oldest request of the topic when the reply has no MeasxTime. A reply
+# with a MeasxTime of no pending request, e.g. of an expired request, resolves
+# nothing.
+# Several requests can wait at the same time, so the next acquisition can
+# start before the earlier positions have arrived. A request without reply
+# within its timeout fails with PositionTimeout.
+#====================================================================
+
+import json
+import threading
+from concurrent.futures import Future, InvalidStateError
+
+class PositionTimeout(Exception):
+	pass
+
+class Position:
+	def __init__(self, lat, lon, accuracy, timestamp, alt=None, epochs=None, topic=None, raw=None):
+		self.lat = lat
+		self.lon = lon
+		self.accuracy = accuracy	# in meters
+		self.timestamp = timestamp	# MeasxTime, the UTCDateTime of the request
+		self.alt = alt
+		self.epochs = epochs
+		self.topic = topic
+		self.raw = raw
+
+	@classmethod
+	def from_json(cls, message, topic=None):
+		reply = json.loads(message)
+		return cls(reply['Lat'], reply['Lon'], reply.get('Acc'), reply.get('MeasxTime'),
+			reply.get('Alt'), reply.get('Epochs'), topic, message)
+
+	def __repr__(self):
+		return f'{self.lat:.7f},{self.lon:.7f} +-{self.accuracy} m at {self.timestamp}'
+
+# (topic, message) of the read line of a received message, None if it has none
+#   +UMQTTC: 6,0,175,69,"CloudLocate/<id>/GNSS/response",106,"{"Lat":...}"
+#   +UMQTTSNC: 9,...,"CloudLocate/GNSS/position",...,"{"Lat":...}"
+# the message contains quotes, so it is taken from the first "{" to the last "}"
+def parse_read_line(line):
+	start = line.find('{')
+	end = line.rfind('}')
+	if start < 0 or end < start:
+		return None
+	quote = line.find('"')
+	topic = None
+	if 0 <= quote < start:
+		topic = line[quote+1:line.find('"', quote+1)]
+	return topic, line[start:end+1]
+
+# a submitted request waiting for its position
+class PositionRequest:
+	def __init__(self, topic, utcTime):
+		self.topic = topic
+		self.utcTime = utcTime
+		self.future = Future()
+		self.timer = None
+
+class PositionRequests:
+	def __init__(self, timeout=60):
+		self.timeout = timeout
+		self.lock = threading.Lock()
+		self.pending = []		# PositionRequest, oldest first
+		self.callbacks = []		# callback(position) for every resolved request
+		self.unmatched = 0
+
+	def __len__(self):
+		return len(self.pending)
+
+	# the Future of the position of a published payload, topic None matches replies on any topic
+	def submit(self, topic, utcTime, timeout=None):
+		request = PositionRequest(topic, utcTime)
+		with self.lock:
+			self.pending.append(request)
+		request.timer = threading.Timer(self.timeout if timeout is None else timeout, self.expire, (request,))
+		request.timer.daemon = True
+		request.timer.start()
+		request.future.add_done_callback(lambda future: self.discard(request))
+		return request.future
+
+	def discard(self, request):
+		request.timer.cancel()
+		with self.lock:
+			if request in self.pending:
+				self.pending.remove(request)
+
+	def expire(self, request):
+		self.discard(request)
+		try:
+			if request.future.set_running_or_notify_cancel():
+				request.future.set_exception(PositionTimeout('no position for '+str(request.utcTime)))
+		except (InvalidStateError, RuntimeError):
+			pass
+
+	# resolve the request of a reply, return its Position or None if the reply matches no request
+	def resolve(self, topic, message):
+		try:
+			position = Position.from_json(message, topic)
+		except (ValueError, KeyError, TypeError):
+			return None
+		with self.lock:
+			candidates = [r for r in self.pending if r.topic is None or topic is None or r.topic == topic]
+			request = next((r for r in candidates if r.utcTime == position.timestamp), None)
+			if request is None and candidates and position.timestamp is None:
+				request = candidates[0]
+			if request is not None:
+				self.pending.remove(request)
+		if request is None:
+			self.unmatched += 1
+			return None
+		request.timer.cancel()
+		# expire() or cancel() may have finished the Future meanwhile, the reader thread must go on
+		try:
+			if request.future.set_running_or_notify_cancel():
+				request.future.set_result(position)
+		except (InvalidStateError, RuntimeError):
+			pass
+		for callback in list(self.callbacks):
+			callback(position)
+		return position
+
+	# the requests still waiting fail, e.g. when the device is closed
+	def cancel_all(self):
+		with self.lock:
+			pending = list(self.pending)
+		for request in pending:
+			request.future.cancel()
+			self.discard(request)
@@ -0,0 +1,130 @@
+#====================================================================
+# Binary capture of the raw serial byte stream
+# Every chunk read from or written to the modem is appended as one record
+#   time (f8, seconds since the epoch), direction (u1), length (u4), bytes
+# after the file header "CLCAP1\n", written through a file buffer from the
+# reading thread. A capture can be replayed into UBXStreamParser later, or
+# be converted into a "Test log.txt" transcript for modem_simulator:
+#   python raw_capture.py captures/COM5-20261017-120000.clcap
+#   python raw_capture.py captures/COM5-20261017-120000.clcap --transcript "My log.txt"
+#====================================================================
+
+import threading,time,sys
+import os
+import struct
+
+from ubx_stream import UBXStreamParser, AT_LINE, UBX_FRAME
+from measx_decoder import MEASX_HEADER
+
+CAPTURE_MAGIC = b'CLCAP1\n'
+RECORD_HEAD = struct.Struct('<dBI')
+RX = 0	# modem -> host
+TX = 1	# host -> modem
+
+class RawCapture:
+	def __init__(self, path, bufferSize=65536):
+		directory = os.path.dirname(path)
+		if directory:
+			os.makedirs(directory, exist_ok=True)
+		self.path = path
+		self.lock = threading.Lock()
+		self.file = open(path, 'wb', buffering=bufferSize)
+		self.file.write(CAPTURE_MAGIC)
+		self.records = 0
+
+	def record(self, direction, data):
+		if not data:
+			return
+		with self.lock:
+			if self.file is None:
+				return
+			self.file.write(RECORD_HEAD.pack(time.time(), direction, len(data)))
+			self.file.write(data)
+			self.records += 1
+
+	def close(self):
+		with self.lock:
+			if self.file is not None:
+				self.file.close()
+				self.file = None
+
+# (time, direction, data) of every record, a record torn at the end is skipped
+def read_capture(path):
+	with open(path, 'rb') as f:
+		if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+			raise ValueError(path+' is not a capture file')
+		while True:
+			head = f.read(RECORD_HEAD.size)
+			if len(head) < RECORD_HEAD.size:
+				return
+			t, direction, length = RECORD_HEAD.unpack(head)
+			data = f.read(length)
+			if len(data) < length:
+				return
+			yield t, direction, data
+
+# feed the received bytes into a parser, yield (time, kind, value) of its events
+def replay(path, parser=None):
+	parser = parser or UBXStreamParser()
+	for t, direction, data in read_capture(path):
+		if direction == RX:
+			for kind, value in parser.feed(data):
+				yield t, kind, value
+
+# the capture as "Test log.txt" lines: input-> commands and output-> lines
+def transcript_lines(path):
+	parser = UBXStreamParser()
+	command = bytearray()
+	for t, direction, data in read_capture(path):
+		stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t))
+		if direction == TX:
+			command.extend(data)
+			while b'\r' in command:
+				end = command.index(b'\r')
+				line = command[:end].decode(errors='replace').strip()
+				del command[:end+1]
+				if command.startswith(b'\n'):
+					del command[:1]
+				if line:
+					yield stamp+':input->'+line
+		else:
+			for kind, value in parser.feed(data):
+				if kind == AT_LINE and len(value) > 1:
+					yield stamp+':output->'+value
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description='Replay a raw serial capture')
+	parser.add_argument('capture')
+	parser.add_argument('--transcript', help='write the capture as a "Test log.txt" transcript')
+	args = parser.parse_args()
+
+	if args.transcript:
+		with open(args.transcript, 'w') as f:
+			for line in transcript_lines(args.capture):
+				f.write(line+'\n')
+		print('.. Transcript saved to '+args.transcript)
+		sys.exit()
+
+	records = 0
+	rxBytes = 0
+	txBytes = 0
+	first = last = None
+	for t, direction, data in read_capture(args.capture):
+		records += 1
+		first = t if first is None else first
+		last = t
+		if direction == RX:
+			rxBytes += len(data)
+		else:
+			txBytes += len(data)
+	lines = frames = measx = 0
+	streamParser = UBXStreamParser()
+	for t, kind, value in replay(args.capture, streamParser):
+		if kind == AT_LINE:
+			lines += 1
+		elif kind == UBX_FRAME:
+			frames += 1
+			measx += value[0:4] == MEASX_HEADER
+	print(f'{records} records over {(last or 0)-(first or 0):.1f} seconds, {rxBytes} bytes received, {txBytes} bytes sent')
+	print(f'{lines} AT lines, {frames} UBX frames ({measx} MEASX), {streamParser.checksumErrors} checksum errors')
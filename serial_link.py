@@ -0,0 +1,133 @@
+#====================================================================
+# Serial link manager for SARA-R510M8s
+# The modem starts at 115200 baud, at that rate a 650-character +UGUBX
+# MEASX line takes about 60 ms on the wire. negotiate() switches modem and
+# host to a higher rate with AT+IPR, checks it with "AT" and goes back to
+# the previous rate when the link does not work. restore() sets 115200
+# again before the port is closed, so the next start finds the modem at the
+# default rate; detect() finds the rate of a modem left at another one, e.g.
+# after a crash, among COMMON_BAUDRATES even when no rate is configured.
+# read_chunk() reads whatever is waiting into one preallocated buffer, and
+# the counters give the throughput of the link. A RawCapture set as capture
+# records every chunk read and written. Status lines go to log, e.g. the
+# log of at_cloudlocate_test, so the console cannot delay the serial reads.
+#====================================================================
+
+import time
+
+from raw_capture import RX, TX
+from log_buffer import BufferedLog
+
+BASE_BAUDRATE = 115200
+# rates of the SARA-R510M8s UART tried by detect(), fastest first after the default
+COMMON_BAUDRATES = [115200, 921600, 460800, 230400, 57600, 38400, 19200, 9600]
+# largest chunk read at once
+CHUNK_SIZE = 16384
+# seconds for the UART to settle after the rate changed
+SETTLE_TIME = 0.05
+# the log of a link created without one
+defaultLog = BufferedLog()
+
+class SerialLink:
+	def __init__(self, ser, chunkSize=CHUNK_SIZE, baseBaudrate=BASE_BAUDRATE, log=None):
+		self.ser = ser
+		self.log = log or defaultLog
+		self.baseBaudrate = baseBaudrate
+		self.buffer = bytearray(chunkSize)
+		self.view = memoryview(self.buffer)
+		# pyserial reads into the buffer, other ports (e.g. SimulatedModem) return bytes
+		self.readinto = getattr(ser, 'readinto', None)
+		self.bytesIn = 0
+		self.bytesOut = 0
+		self.reads = 0
+		self.startTime = time.time()
+		self.capture = None		# raw_capture.RawCapture
+
+	@property
+	def baudrate(self):
+		return self.ser.baudrate
+
+	# read what is waiting, at least one byte or nothing after the port timeout
+	# the returned view is only valid until the next call
+	def read_chunk(self):
+		size = min(self.ser.in_waiting or 1, len(self.buffer))
+		if self.readinto is not None:
+			data = self.view[:self.readinto(self.view[:size]) or 0]
+		else:
+			data = self.ser.read(size)
+		self.bytesIn += len(data)
+		self.reads += 1
+		if self.capture is not None:
+			self.capture.record(RX, data)
+		return data
+
+	def write(self, data):
+		self.bytesOut += len(data)
+		if self.capture is not None:
+			self.capture.record(TX, data)
+		return self.ser.write(data)
+
+	def set_baudrate(self, baudrate):
+		self.ser.baudrate = baudrate
+		time.sleep(SETTLE_TIME)
+		self.ser.reset_input_buffer()
+
+	# whether "AT" is answered with OK at the current rate
+	# send(at_cmd, timeout) -> (result, lines), e.g. ATEngine.send
+	def verify(self, send, tries=3):
+		for _ in range(tries):
+			result, lines = send('AT', 1)
+			if result == "OK":
+				return True
+		return False
+
+	# find the rate of the modem among baudrates and COMMON_BAUDRATES, return it or None
+	def detect(self, send, baudrates=()):
+		candidates = []
+		for baudrate in [self.ser.baudrate] + list(baudrates) + COMMON_BAUDRATES:
+			if baudrate not in candidates:
+				candidates.append(baudrate)
+		for baudrate in candidates:
+			self.set_baudrate(baudrate)
+			if self.verify(send, 1):
+				return baudrate
+		self.set_baudrate(self.baseBaudrate)
+		return None
+
+	# switch modem and host to the first rate of baudrates which works, return the rate in use
+	def negotiate(self, send, baudrates):
+		for baudrate in baudrates:
+			if baudrate == self.ser.baudrate:
+				break
+			previous = self.ser.baudrate
+			result, lines = send('AT+IPR='+str(baudrate), 2)
+			if result != "OK":
+				continue
+			self.set_baudrate(baudrate)
+			if self.verify(send):
+				break
+			self.log.warning('.. No response at '+str(baudrate)+' baud, back to '+str(previous))
+			self.fallback(send, baudrate, previous)
+		return self.ser.baudrate
+
+	# the link does not work at failed: host back to previous, and the modem too if it has switched
+	def fallback(self, send, failed, previous):
+		self.set_baudrate(previous)
+		if self.verify(send, 1):
+			return True
+		self.set_baudrate(failed)
+		send('AT+IPR='+str(previous), 2)
+		self.set_baudrate(previous)
+		return self.verify(send)
+
+	# modem and host back to the base rate
+	def restore(self, send):
+		if self.ser.baudrate != self.baseBaudrate:
+			send('AT+IPR='+str(self.baseBaudrate), 2)
+			self.set_baudrate(self.baseBaudrate)
+
+	def throughput(self):
+		elapsed = max(time.time() - self.startTime, 1e-9)
+		return {'baudrate': self.ser.baudrate, 'bytesIn': self.bytesIn, 'bytesOut': self.bytesOut,
+			'reads': self.reads, 'bytesPerRead': self.bytesIn/self.reads if self.reads else 0.0,
+			'inBytesPerSecond': self.bytesIn/elapsed}
@@ -0,0 +1,39 @@
+#====================================================================
+# Shared fixtures: the modules are flat at the top level of the project,
+# devices run against modem_simulator replaying "Test log.txt" at full speed
+#====================================================================
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TEST_LOG = os.path.join(ROOT, "Test log.txt")
+
+import at_cloudlocate_test as app
+from modem_simulator import SimulatedModem
+
+# nothing is written into the working directory, the settings changed by a test are restored
+@pytest.fixture(autouse=True)
+def app_settings(monkeypatch, tmp_path):
+	monkeypatch.setattr(app, 'QUEUE_DIR', str(tmp_path / 'queue'))
+	monkeypatch.setattr(app, 'METRICS_FILE', None)
+	monkeypatch.setattr(app, 'CAPTURE_DIR', None)
+	return monkeypatch
+
+# devices on simulated modems, closed after the test
+@pytest.fixture
+def make_device():
+	devices = []
+	def make(time_scale=0, timeout=0.2, **options):
+		ser = SimulatedModem(TEST_LOG, time_scale=time_scale, timeout=timeout, **options)
+		device = app.CloudLocateDevice(ser)
+		devices.append(device)
+		return device
+	yield make
+	for device in devices:
+		device.close()
+	app.log.flush()
@@ -0,0 +1,48 @@
+from at_batch import ATBatch, chain, chain_line
+
+# send() of a modem which fails the commands in failing, also inside a chained line
+class FakeModem:
+	def __init__(self, failing=()):
+		self.failing = failing
+		self.lines = []
+
+	def send(self, at_cmd, timeout):
+		self.lines.append(at_cmd)
+		if any(command[2:] in at_cmd for command in self.failing):
+			return 'ERROR', []
+		return 'OK', ['+X: '+at_cmd]
+
+COMMANDS = ['AT+UMQTT=0,"id"', 'AT+UMQTT=2,"host"', 'AT+UMQTTNV=2']
+
+def test_commands_are_chained_into_one_line():
+	assert chain_line(chain(COMMANDS)[0]) == 'AT+UMQTT=0,"id";+UMQTT=2,"host";+UMQTTNV=2'
+	modem = FakeModem()
+	batch = ATBatch(modem.send).run(COMMANDS)
+	assert batch.ok and len(modem.lines) == 1
+
+def test_unchainable_commands_and_line_limit():
+	assert chain(['AT+CGATT?', 'AT+UDWNFILE="f",3', 'AT+UPSD=0,0,0']) == [['AT+CGATT?'], ['AT+UDWNFILE="f",3'], ['AT+UPSD=0,0,0']]
+	assert chain(['ATE0', 'AT+CSQ']) == [['ATE0'], ['AT+CSQ']]
+	assert [len(group) for group in chain(['AT+A=' + 'x'*10]*4, lineLimit=30)] == [2, 2]
+
+def test_failed_line_is_sent_again_command_by_command():
+	modem = FakeModem(failing=['AT+UMQTT=2,"host"'])
+	batch = ATBatch(modem.send).run(COMMANDS)
+	assert not batch.ok
+	assert batch.failed == 'AT+UMQTT=2,"host"' and batch.result == 'ERROR'
+	# the chained line, then the commands up to the failing one
+	assert modem.lines[1:] == COMMANDS[0:2]
+
+def test_unchained_batch():
+	modem = FakeModem(failing=['AT+UMQTTNV=2'])
+	batch = ATBatch(modem.send, chained=False).run(COMMANDS)
+	assert modem.lines == COMMANDS
+	assert batch.failed == 'AT+UMQTTNV=2'
+	assert batch.lines == ['+X: '+COMMANDS[0], '+X: '+COMMANDS[1]]
+
+def test_run_stops_when_the_profile_cannot_be_saved(make_device):
+	device = make_device()
+	device.ser.transcript['AT+UMQTTNV=2'] = [[(0.0, 'ERROR')]]
+	assert device.prepare() is None
+	assert device.run(1, 0) == 0
+	assert not any(command.startswith('at+UGPS') for command in device.ser.commands)
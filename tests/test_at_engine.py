@@ -0,0 +1,70 @@
+import threading
+import time
+
+from at_engine import ATEngine
+
+# a modem answering every written command from a thread
+class Replier:
+	def __init__(self, replies):
+		self.replies = replies		# command -> lines
+		self.written = []
+		self.engine = ATEngine(self.write)
+
+	def write(self, data):
+		at_cmd = data.decode().strip()
+		self.written.append(at_cmd)
+		lines = self.replies.get(at_cmd, [])
+		threading.Timer(0.01, lambda: [self.engine.on_line(line) for line in lines]).start()
+
+def test_send_returns_the_final_result_and_intermediate_lines():
+	modem = Replier({'AT+CSQ': ['+CSQ: 15,7', 'OK'], 'AT+UMQTTNV=9': ['+CME ERROR: 4']})
+	assert modem.engine.send('AT+CSQ', 2) == ('OK', ['+CSQ: 15,7'])
+	assert modem.engine.send('AT+UMQTTNV=9', 2) == ('+CME ERROR: 4', [])
+
+def test_send_times_out_without_final_result():
+	modem = Replier({'AT+CSQ': ['+CSQ: 15,7']})
+	start = time.monotonic()
+	result, lines = modem.engine.send('AT+CSQ', 0.1)
+	assert result is None and lines == ['+CSQ: 15,7']
+	assert time.monotonic() - start < 1
+
+def test_urc_is_dispatched_and_not_part_of_the_command():
+	modem = Replier({'AT+UMQTTC=1': ['+UUMQTTC: 1,1', 'OK']})
+	received = []
+	modem.engine.register_urc('+UUMQTTC:', received.append)
+	assert modem.engine.send('AT+UMQTTC=1', 2) == ('OK', [])
+	assert received == ['+UUMQTTC: 1,1']
+	modem.engine.unregister_urc('+UUMQTTC:', received.append)
+	modem.engine.on_line('+UUMQTTC: 0,1')
+	assert received == ['+UUMQTTC: 1,1']
+
+def test_wait_for_consumes_the_matched_line():
+	engine = ATEngine(lambda data: None)
+	engine.on_line('+UUPSDA: 0,"10.0.0.1"')
+	assert engine.wait_for('+UUPSDA', 0.1)
+	# the same URC is not matched twice
+	assert not engine.wait_for('+UUPSDA', 0.05)
+	threading.Timer(0.05, engine.on_line, ('+UUMQTTC: 1,1',)).start()
+	assert engine.wait_for('+UUMQTTC: 1,1', 2)
+	engine.on_line('ERROR')
+	assert not engine.wait_for('+UUMQTTC', 1)
+
+def test_commands_are_serialized_on_the_channel():
+	modem = Replier({'AT+A': ['OK'], 'AT+B': ['OK']})
+	results = []
+	threads = [threading.Thread(target=lambda at_cmd=at_cmd: results.append(modem.engine.send(at_cmd, 2))) for at_cmd in ('AT+A', 'AT+B')*5]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	assert results == [('OK', [])]*10
+
+def test_device_runs_the_recorded_flow(make_device):
+	device = make_device()
+	assert device.setupLink()
+	result, lines = device.command_send('at+cops?;+CSQ;+CGATT?', 2)
+	assert result == 'OK' and '+CSQ: 15,7' in lines
+	device.command_send('AT+UMQTTNV=1', 2)
+	device.command_send('AT+UMQTTC=1', 10)
+	assert device.Waitfor('+UUMQTTC: 1,1', 5)
+	assert device.URC_STATE['mqttConnected']
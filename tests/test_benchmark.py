@@ -0,0 +1,29 @@
+import json
+import os
+import subprocess
+import sys
+
+from conftest import ROOT
+
+import benchmark
+
+def run(tmp_path, *args):
+	return subprocess.run([sys.executable, os.path.join(ROOT, 'benchmark.py'), '--epochs', '2', '--repeat', '2', *args],
+		cwd=str(tmp_path), capture_output=True, text=True, timeout=120, check=True).stdout
+
+def test_report_without_output_file(tmp_path):
+	stdout = run(tmp_path)
+	assert 'pack_epochs' in stdout
+	assert list(tmp_path.iterdir()) == []
+
+def test_results_saved_and_compared(tmp_path):
+	run(tmp_path, '-o', 'before.json')
+	with open(tmp_path / 'before.json') as f:
+		report = json.load(f)
+	assert {result['stage'] for result in report['results']} >= {'pack_epochs', 'getJSONPayload'}
+	assert 'x p50' in run(tmp_path, '--compare', 'before.json')
+
+def test_uplink_benchmark_publishes_every_fix():
+	report = benchmark.run_uplink_benchmark(fixes=20, windows=(1, 4), latency=0)
+	# a connection per fix only runs a tenth of the fixes
+	assert [(result['mode'], result['window'], result['fixes']) for result in report['uplink']] == [('per-fix', 1, 2), ('pooled', 1, 20), ('pooled', 4, 20)]
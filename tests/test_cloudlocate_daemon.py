@@ -0,0 +1,116 @@
+import json
+import socket
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+import cloudlocate_daemon
+import at_cloudlocate_test as app
+from cloudlocate_daemon import CloudLocateDaemon, parse_timeout
+from position_response import Position
+
+# stands in for a warm CloudLocateDevice, requestFix() takes acquire seconds
+class FakeDevice:
+	def __init__(self, acquire=0.0, position=None):
+		self.acquire = acquire
+		self.position = position
+		self.positions = []
+		self.URC_STATE = {'pdpActive': True}
+		self.gnssOn = True
+		self.fixes = []
+
+	def requestFix(self):
+		time.sleep(self.acquire)
+		future = Future()
+		if self.position is not None:
+			future.set_result(self.position)
+		self.fixes.append(future)
+		return future
+
+	def collectPositions(self, timeout):
+		pass
+
+	def disconnect(self):
+		pass
+
+	def close(self):
+		pass
+
+@pytest.fixture
+def daemon(tmp_path):
+	daemon = CloudLocateDaemon(path=str(tmp_path / 'cloudlocate.sock'), lazy=True)
+	daemon.device = FakeDevice()
+	threading.Thread(target=daemon.serve_forever, daemon=True).start()
+	yield daemon
+	daemon.close()
+
+def ask(daemon, line):
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+		sock.settimeout(5)
+		sock.connect(daemon.path)
+		sock.sendall(line.encode() + b'\n')
+		return json.loads(sock.makefile().readline())
+
+def test_parse_timeout():
+	assert parse_timeout('2.5') == 2.5
+	assert parse_timeout(None) is None
+	assert parse_timeout('soon') is None
+	assert parse_timeout(-1) is None
+	assert parse_timeout(float('nan')) is None
+
+def test_fix_replies_with_the_position(daemon):
+	daemon.device.position = Position(25.08, 121.56, 32.9, '2021-08-16T04:55:21')
+	reply = ask(daemon, '{"cmd": "fix", "timeout": 5}')
+	assert reply['ok'] and reply['position']['lat'] == 25.08
+	assert daemon.fixes == 1
+
+def test_invalid_requests_get_a_reply(daemon):
+	assert ask(daemon, '{"cmd": "fix", "timeout": "soon"}') == {'ok': False, 'error': 'invalid timeout'}
+	assert ask(daemon, '[1]') == {'ok': False, 'error': 'invalid request'}
+	assert ask(daemon, '{"cmd"') == {'ok': False, 'error': 'invalid JSON'}
+	# the connection is still served
+	assert ask(daemon, '{"cmd": "status"}')['ok']
+
+def test_timeout_cancels_the_awaited_position(daemon):
+	reply = daemon.fix(0.2)
+	assert not reply['ok']
+	assert daemon.device.fixes[0].cancelled()
+
+def test_timeout_while_acquiring_cancels_the_position_once_published(daemon):
+	daemon.device.acquire = 0.5
+	assert not daemon.fix(0.1)['ok']
+	# and a request still queued is not acquired at all
+	assert not daemon.fix(0.1)['ok']
+	time.sleep(1.2)
+	assert len(daemon.device.fixes) == 1
+	assert daemon.device.fixes[0].cancelled()
+
+def test_open_fails_when_the_profile_cannot_be_saved(tmp_path, app_settings):
+	from conftest import TEST_LOG
+	app_settings.setattr(app, 'SIMULATED_MODEM', True)
+	app_settings.setattr(app, 'SIMULATED_LOG', TEST_LOG)
+	app_settings.setattr(app, 'SIMULATED_TIME_SCALE', 0)
+	app_settings.setattr(app.CloudLocateDevice, 'SetMQTTProfile', lambda device: False)
+	daemon = CloudLocateDaemon(path=str(tmp_path / 'cloudlocate.sock'), lazy=True)
+	threading.Thread(target=daemon.serve_forever, daemon=True).start()
+	try:
+		with pytest.raises(RuntimeError):
+			daemon.open()
+		assert daemon.device is None
+	finally:
+		daemon.close()
+
+# the fixes of the daemon end their metrics cycle, the spans do not pile up
+def test_request_fix_finishes_its_cycle(make_device, app_settings, tmp_path):
+	app_settings.setattr(app, 'METRICS_FILE', str(tmp_path / 'metrics.jsonl'))
+	device = make_device()
+	counts = []
+	for index in range(3):
+		device.requestFix()
+		counts.append((device.metrics.cycle, len(device.metrics.spans)))
+	assert counts == [(1, 0), (2, 0), (3, 0)]
+	records = [json.loads(line) for line in (tmp_path / 'metrics.jsonl').read_text().splitlines()]
+	assert [record['result'] for record in records] == ['published']*3
+	assert all(record['spans'] for record in records)
@@ -0,0 +1,35 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cloudlocate_fleet import DeviceSession, run_fleet
+from conftest import TEST_LOG
+
+import at_cloudlocate_test as app
+
+def test_fleet_of_simulated_modems(app_settings):
+	app_settings.setattr(app, 'SIMULATED_LOG', TEST_LOG)
+	results = asyncio.run(run_fleet(['SIM0', 'SIM1'], parallel=2, timeout=60, retry_times=1, wait_time=0, simulated=True, time_scale=0))
+	assert [result.status for result in results] == ['done', 'done']
+	assert all(result.published for result in results)
+
+def test_device_opened_after_the_timeout_is_closed(app_settings):
+	app_settings.setattr(app, 'SIMULATED_LOG', TEST_LOG)
+	devices = []
+	CloudLocateDevice = app.CloudLocateDevice
+	# the port opens after the session has given up
+	def slowDevice(ser, name=''):
+		time.sleep(0.3)
+		devices.append(CloudLocateDevice(ser, name=name))
+		return devices[-1]
+	app_settings.setattr(app, 'CloudLocateDevice', slowDevice)
+	executor = ThreadPoolExecutor(max_workers=1)
+	session = DeviceSession('SIM0', executor, 1, 0, simulated=True, time_scale=0)
+	result = asyncio.run(session.run(0.1))
+	executor.shutdown(wait=False)
+	assert result.status == 'timeout'
+	deadline = time.time() + 5
+	while not (devices and not devices[0].ser.is_open) and time.time() < deadline:
+		time.sleep(0.05)
+	assert session.device is None
+	assert len(devices) == 1 and not devices[0].ser.is_open
@@ -0,0 +1,52 @@
+import json
+
+from cycle_metrics import BUCKETS, Histogram, MetricsRegistry, CycleMetrics
+
+import at_cloudlocate_test as app
+
+def test_metrics_file_is_off_by_default():
+	assert app.METRICS_FILE is None
+
+def test_histogram_buckets():
+	histogram = Histogram()
+	for value in (0.01, 0.05, 0.3, 1000):
+		histogram.observe(value)
+	assert histogram.counts[0] == 2		# le is inclusive
+	assert histogram.counts[BUCKETS.index(0.5)] == 1
+	assert histogram.counts[-1] == 1
+	assert histogram.count == 4
+
+def test_spans_count_serial_bytes_and_are_written(tmp_path):
+	counters = [0, 0]
+	path = tmp_path / 'metrics.jsonl'
+	metrics = CycleMetrics('ttyUSB0', lambda: tuple(counters), str(path), registry=MetricsRegistry())
+	with metrics.span('gnss_on'):
+		counters[0] += 30
+		counters[1] += 12
+	metrics.end('never_begun')
+	record = metrics.finish('ok')
+	assert record['cycle'] == 1
+	assert [(span['stage'], span['bytesIn'], span['bytesOut']) for span in record['spans']] == [('gnss_on', 30, 12)]
+	assert json.loads(path.read_text()) == record
+	# the next cycle starts empty
+	assert metrics.finish('timeout')['spans'] == []
+	assert len(path.read_text().splitlines()) == 2
+
+def test_no_file_without_path(tmp_path, monkeypatch):
+	monkeypatch.chdir(tmp_path)
+	metrics = CycleMetrics(None, lambda: (0, 0), registry=MetricsRegistry())
+	with metrics.span('publish'):
+		pass
+	assert metrics.finish('ok')['device'] == 'default'
+	assert list(tmp_path.iterdir()) == []
+
+def test_registry_renders_prometheus_text():
+	registry = MetricsRegistry()
+	metrics = CycleMetrics('dev', lambda: (0, 0), registry=registry)
+	with metrics.span('publish'):
+		pass
+	metrics.finish('ok')
+	text = registry.render()
+	assert 'cloudlocate_stage_seconds_bucket{device="dev",stage="publish",le="+Inf"} 1' in text
+	assert 'cloudlocate_stage_seconds_count{device="dev",stage="publish"} 1' in text
+	assert 'cloudlocate_cycles_total{device="dev",result="ok"} 1' in text
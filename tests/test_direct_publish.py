@@ -0,0 +1,32 @@
+import at_cloudlocate_test as app
+
+def commands(device, prefix):
+	return [command for command in device.ser.commands if command.upper().startswith(prefix)]
+
+def test_small_payload_is_published_in_the_command(make_device, app_settings):
+	app_settings.setattr(app, 'PUBLISH_MODE', 'auto')
+	device = make_device()
+	assert device.stagePayload('{"body":"x"}') == '{"body":"x"}'
+	assert not commands(device, 'AT+UDWNFILE')
+	assert device.PubDataCloud('{"body":"x"}')
+	publish, = commands(device, 'AT+UMQTTC=2,')
+	# hex, the JSON has quotes
+	assert publish.endswith('"'+'{"body":"x"}'.encode().hex().upper()+'"')
+	assert not commands(device, 'AT+UMQTTC=3,')
+
+def test_large_payload_and_file_mode_go_through_ffs(make_device, app_settings):
+	app_settings.setattr(app, 'PUBLISH_MODE', 'auto')
+	device = make_device()
+	assert device.stagePayload('x'*(app.DIRECT_PUBLISH_LIMIT + 1)) is None
+	app_settings.setattr(app, 'PUBLISH_MODE', 'file')
+	assert device.stagePayload('x'*10) is None
+	assert [command.split(',')[-1] for command in commands(device, 'AT+UDWNFILE')] == [str(app.DIRECT_PUBLISH_LIMIT + 1), '10']
+	assert device.PubDataCloud(None)
+	assert commands(device, 'AT+UMQTTC=3,')
+
+def test_run_with_one_epoch_skips_the_file(make_device, app_settings):
+	app_settings.setattr(app, 'PUBLISH_MODE', 'auto')
+	app_settings.setattr(app, 'EPOCHS', 1)
+	device = make_device()
+	assert device.run(1, 0) == 1
+	assert not commands(device, 'AT+UDWNFILE') and commands(device, 'AT+UMQTTC=2,')
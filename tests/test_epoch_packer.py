@@ -0,0 +1,50 @@
+import random
+
+from benchmark import make_measx_message
+from epoch_packer import pack_epochs, raw_budget, split_measx
+from measx_decoder import MEASX_HEADER, ubx_checksum
+
+import at_cloudlocate_test as app
+
+GPS = 0
+GLONASS = 6
+
+def measx(epochs, numSv, gnssIds, seed=3):
+	rng = random.Random(seed)
+	message = bytearray()
+	for index in range(epochs):
+		message += MEASX_HEADER + make_measx_message(numSv, gnssIds, (32, 8), 5000 + 1000*index, rng)
+	return message
+
+def test_raw_budget_fits_the_json_limit():
+	overhead = len(app.getJSONPayload(b'', '2021-08-16T04:55:21'))
+	for limit in (1017, 8192):
+		budget = raw_budget(limit, overhead)
+		assert len(app.getJSONPayload(bytes(budget), '2021-08-16T04:55:21')) <= limit
+		assert len(app.getJSONPayload(bytes(budget + 3), '2021-08-16T04:55:21')) > limit
+
+def test_epochs_within_the_budget_are_kept_as_they_are():
+	message = measx(2, 8, [GPS])
+	packed = pack_epochs(split_measx(message), 8192, GPS, 4)
+	assert packed.measxMessage == message
+	assert (packed.droppedEpochs, packed.droppedSatellites) == (0, 0)
+
+def test_packed_epochs_fit_mqtt_sn():
+	message = measx(4, 32, [GPS, GLONASS])
+	budget = raw_budget(app.MQTTSN_PAYLOAD_LIMIT, len(app.getJSONPayload(b'', '2021-08-16T04:55:21')))
+	packed = pack_epochs(split_measx(message), budget, GPS, 6)
+	assert len(packed.measxMessage) <= budget
+	assert len(app.getJSONPayload(packed.measxMessage, '2021-08-16T04:55:21')) <= app.MQTTSN_PAYLOAD_LIMIT
+	epochs = split_measx(packed.measxMessage)
+	assert len(epochs) == packed.epochs and packed.droppedEpochs + packed.epochs == 4
+	for epoch in epochs:
+		frame = epoch.frame()
+		assert ubx_checksum(frame[2:-2]) == frame[-2:]
+		assert epoch.numSv >= 6
+		# the other constellation goes first
+		assert set(epoch.gnssId) == {GPS}
+	# measurement order is kept
+	assert [epoch.gpsTOW for epoch in epochs] == sorted(epoch.gpsTOW for epoch in epochs)
+
+def test_nothing_fits():
+	assert pack_epochs(split_measx(measx(1, 16, [GPS])), 100, GPS, 6) is None
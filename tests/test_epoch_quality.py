@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+from epoch_quality import QualityEstimator, required_quality
+
+import at_cloudlocate_test as app
+
+GPS = 0
+
+# an epoch of (gnss, svId, cNo, multipathIndex, dopplerMS) blocks
+class Epoch:
+	def __init__(self, *blocks):
+		self.satellites = blocks
+
+	def blocks(self):
+		return [block + (0, 0, 0, 0, 0, 0) for block in self.satellites]
+
+def test_best_cno_of_accepted_satellites():
+	quality = QualityEstimator(GPS, 22, 1)
+	quality.add(Epoch((GPS, 1, 30, 1, 100), (GPS, 2, 20, 1, 0), (GPS, 3, 40, 2, 0), (6, 4, 40, 1, 0)))
+	quality.add(Epoch((GPS, 1, 34, 1, -100), (GPS, 5, 40, 1, 500)))
+	# 2: C/No, 3: multipath, 4: another constellation
+	assert quality.quality() == {'satellites': 2, 'cno': 37.0, 'doppler_spread': pytest.approx(24.0)}
+	assert quality.meets({'satellites': 2, 'cno': 35})
+	assert not quality.meets({'satellites': 3})
+
+def test_required_quality_relaxes_to_the_minimum():
+	target = {'satellites': 8, 'cno': 35}
+	minimum = {'satellites': 6, 'cno': 22}
+	assert required_quality(target, minimum, 0) == target
+	assert required_quality(target, minimum, 0.5) == {'satellites': 7, 'cno': 28.5}
+	assert required_quality(target, minimum, 2) == minimum
+
+def test_adaptive_epochs_is_off_by_default():
+	assert app.ADAPTIVE_EPOCHS is False
+
+@pytest.mark.parametrize('methodology, expected', [
+	(app.FallbackConfig.FALLBACK_EPOCHS, 2),
+	(app.FallbackConfig.FALLBACK_DO_NOT_SEND, 3),
+	(app.FallbackConfig.FALLBACK_NO_OF_SATELLITIES_ONLY, 3),
+])
+def test_minimum_epochs_follow_the_fallback(app_settings, methodology, expected):
+	app_settings.setattr(app, 'EPOCHS', 3)
+	app_settings.setattr(app, 'FALLBACK_METHODOLOGY', methodology)
+	app_settings.setitem(app.FALLBACK_CONFIG, app.FallbackConfig.FALLBACK_EPOCHS, 2)
+	assert app.minimumEpochs() == expected
+
+# no valid epoch at all, only the fallback finds epochs: without ADAPTIVE_EPOCHS it is applied after the whole GNSS_READY_TIMEOUT
+@pytest.mark.parametrize('adaptive, seconds', [(False, 2), (True, 1)])
+def test_fallback_waits_for_timeout_unless_adaptive(make_device, app_settings, adaptive, seconds):
+	app_settings.setattr(app, 'ADAPTIVE_EPOCHS', adaptive)
+	app_settings.setattr(app, 'GNSS_READY_TIMEOUT', 2)
+	app_settings.setattr(app, 'CNO_THRESHOLD', 60)
+	app_settings.setattr(app, 'FALLBACK_METHODOLOGY', app.FallbackConfig.FALLBACK_NO_OF_SATELLITIES_ONLY)
+	device = make_device()
+	start = time.time()
+	assert device.CloudLocate_run()
+	assert device.validMessageCounter == 0
+	assert seconds <= time.time() - start < seconds + 0.9
+
+# the recorded log has two distinct epochs: with EPOCHS 3 the default run waits the whole TIMEOUT, then uses the fallback
+def test_default_run_lasts_the_whole_timeout(make_device, app_settings):
+	app_settings.setattr(app, 'EPOCHS', 3)
+	app_settings.setattr(app, 'TIMEOUT', 2)
+	device = make_device()
+	start = time.time()
+	assert device.CloudLocate_run()
+	assert device.validMessageCounter == 2
+	assert 2 <= time.time() - start < 2.9
@@ -0,0 +1,43 @@
+import random
+
+from epoch_store import EpochStore
+
+def add(store, maxCNO, cnoCount=8):
+	return store.add(b'\x01'*4, 1000*store.seq, maxCNO, cnoCount, cnoCount, cnoCount)
+
+def test_oldest_epoch_is_overwritten():
+	store = EpochStore(3)
+	for maxCNO in (30, 40, 35, 20):
+		add(store, maxCNO)
+	assert len(store) == 3
+	assert store.slots() == [1, 2, 0]
+	assert [store.maxCNO[slot] for slot in store.slots()] == [40, 35, 20]
+
+def test_top_by_max_cno_skips_overwritten_and_rejected_epochs():
+	store = EpochStore(4)
+	for maxCNO, cnoCount in ((50, 8), (45, 3), (30, 8), (40, 8), (35, 8)):
+		add(store, maxCNO, cnoCount)
+	# 50 is overwritten by 35, 45 has too few satellites
+	assert [store.maxCNO[slot] for slot in store.top_by_max_cno(2, lambda slot: store.cnoCount[slot] >= 6)] == [40, 35]
+	assert store.top_by_max_cno(0, lambda slot: True) == []
+	# the heap is not changed by a selection
+	heap = list(store.heap)
+	store.top_by_max_cno(4, lambda slot: True)
+	assert store.heap == heap
+
+def test_top_by_max_cno_matches_a_sort():
+	rng = random.Random(7)
+	store = EpochStore(16)
+	for index in range(300):
+		add(store, rng.randrange(20, 50), rng.randrange(0, 12))
+		accept = lambda slot: store.cnoCount[slot] >= 6
+		expected = sorted((slot for slot in store.slots() if accept(slot)), key=lambda slot: (-store.maxCNO[slot], store.seqs[slot]))[0:3]
+		assert store.top_by_max_cno(3, accept) == expected
+	# stale heap entries are compacted
+	assert len(store.heap) <= 2*16 + 1
+
+def test_reset_starts_a_new_run():
+	store = EpochStore(4)
+	add(store, 40)
+	store.reset()
+	assert len(store) == 0 and store.top_by_max_cno(1, lambda slot: True) == []
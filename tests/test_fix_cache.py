@@ -0,0 +1,76 @@
+from fix_cache import Fingerprint, FixCache, distance
+
+import at_cloudlocate_test as app
+
+import random
+
+BOUNDS = {"overlap": 0.8, "cno": 4, "doppler": 2.0, "doppler_drift": 0.2, "doppler_window": 30, "rms": 10}
+
+# svId -> (cNo, line-of-sight rate, RMS index) of 10 satellites, shifted by the clock drift and by velocity on satellite 1
+def fingerprint(time, cno=40, drift=0.0, velocity=0.0, satellites=range(1, 11)):
+	return Fingerprint({svId: (cno, svId*100.0 + drift + (velocity if svId == 1 else 0), 15) for svId in satellites}, 0, time)
+
+def test_distance_within_bounds():
+	cached = fingerprint(0)
+	assert distance(cached, fingerprint(10, cno=42, drift=30.0), BOUNDS) is not None
+	assert distance(cached, cached, BOUNDS) == 0
+
+def test_distance_outside_bounds():
+	cached = fingerprint(0)
+	assert distance(cached, fingerprint(10, cno=45), BOUNDS) is None
+	assert distance(cached, fingerprint(0, satellites=range(3, 13)), BOUNDS) is None
+	assert distance(cached, fingerprint(0, velocity=3.0), BOUNDS) is None
+
+# a static receiver: the line-of-sight rate of every satellite changes by its own 0.1-0.2 m/s per second
+def drifting(cached, elapsed, velocity=0.0, seed=5):
+	rng = random.Random(seed)
+	satellites = {svId: (cNo, rate + rng.uniform(0.1, 0.2)*elapsed + (velocity if svId == 1 else 0), rms)
+		for svId, (cNo, rate, rms) in cached.satellites.items()}
+	return Fingerprint(satellites, 0, cached.time + elapsed)
+
+def test_doppler_drift_of_a_static_receiver():
+	cached = fingerprint(0)
+	# 2 m/s + 0.2 m/s per second within doppler_window
+	assert distance(cached, drifting(cached, 10), BOUNDS) is not None
+	assert distance(cached, drifting(cached, 30), BOUNDS) is not None
+	assert distance(cached, drifting(cached, 10, velocity=6.0), BOUNDS) is None
+	assert distance(cached, drifting(cached, 30, velocity=12.0), BOUNDS) is None
+	# later the rates are not compared, C/No and pseudorange RMS still are
+	assert distance(cached, drifting(cached, 300), BOUNDS) is not None
+	assert distance(cached, fingerprint(300, cno=45), BOUNDS) is None
+
+def test_hit_and_miss():
+	cache = FixCache(600, 4, BOUNDS)
+	cache.add(fingerprint(0), 'here')
+	assert cache.lookup(fingerprint(5, cno=41)) == 'here'
+	assert cache.lookup(fingerprint(5, velocity=10.0)) is None
+	assert (cache.hits, cache.misses) == (1, 1)
+
+def test_entries_expire_after_the_ttl():
+	cache = FixCache(60, 4, BOUNDS)
+	cache.add(fingerprint(0), 'here')
+	assert cache.lookup(fingerprint(61)) is None
+	assert len(cache) == 0
+
+def test_least_recently_used_is_dropped():
+	cache = FixCache(600, 2, BOUNDS)
+	cache.add(fingerprint(0, satellites=range(1, 11)), 'a')
+	cache.add(fingerprint(0, satellites=range(21, 31)), 'b')
+	assert cache.lookup(fingerprint(1, satellites=range(1, 11))) == 'a'
+	cache.add(fingerprint(2, satellites=range(41, 51)), 'c')
+	assert cache.lookup(fingerprint(3, satellites=range(21, 31))) is None
+	assert cache.lookup(fingerprint(3, satellites=range(1, 11))) == 'a'
+
+def test_second_run_of_a_static_device_is_cached(make_device, app_settings):
+	for name, value in (('FIX_CACHE', True), ('EPOCHS', 1), ('KEEP_CONNECTION', True), ('POSITION_WAIT', True),
+			('MQTT_SUB_TOPIC', 'CloudLocate/<Your device ID>/GNSS/response')):
+		app_settings.setattr(app, name, value)
+	device = make_device()
+	assert device.CloudLocate_run()
+	assert not device.positionCached
+	position = device.positionFuture.result(10)
+	commands = len(device.ser.commands)
+	assert device.CloudLocate_run()
+	assert device.positionCached and device.positionFuture.result(0) is position
+	assert not any(command.startswith('AT+UMQTTC=2') for command in device.ser.commands[commands:])
+	device.disconnect()
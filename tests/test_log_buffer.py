@@ -0,0 +1,50 @@
+import io
+import threading
+
+from log_buffer import BufferedLog, DEBUG, INFO, WARNING
+
+import at_cloudlocate_test as app
+
+def test_records_are_written_at_flush():
+	stream = io.StringIO()
+	log = BufferedLog(INFO, stream)
+	log.info('first')
+	log.debug('hidden')
+	log.stamped('output->OK')
+	log.flush()
+	lines = stream.getvalue().splitlines()
+	assert lines[0] == 'first'
+	# "Test log.txt" timestamp format
+	assert lines[1][19:] == ':output->OK' and lines[1][4] == '-' and len(lines) == 2
+
+def test_level_is_read_at_every_call():
+	setting = ['INFO']
+	log = BufferedLog(lambda: setting[0], io.StringIO())
+	assert not log.enabled(DEBUG)
+	setting[0] = 'DEBUG'
+	assert log.enabled(DEBUG)
+	log.level = WARNING
+	assert not log.enabled(INFO)
+
+def test_app_log_follows_log_level(app_settings):
+	app_settings.setattr(app, 'LOG_LEVEL', 'WARNING')
+	assert not app.log.enabled(INFO)
+	app_settings.setattr(app, 'LOG_LEVEL', 'DEBUG')
+	assert app.log.enabled(DEBUG)
+
+def test_dropped_records_are_counted():
+	stream = io.StringIO()
+	log = BufferedLog(INFO, stream, capacity=100)
+	threads = [threading.Thread(target=lambda: [log.info('x') for _ in range(1000)]) for _ in range(4)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	dropped = log.dropped
+	log.flush()
+	lines = stream.getvalue().splitlines()
+	assert lines[-1] == '.. Log dropped '+str(dropped)+' records'
+	assert len(lines) == 101
+	# approximate, but no increment is lost
+	assert 3900 - 4 <= dropped <= 3900 + 4
+	assert log.dropped == 0
@@ -0,0 +1,154 @@
+import gzip
+import random
+
+import pytest
+
+from benchmark import make_measx_message
+from measx_decoder import MEASX_HEADER
+from measx_analytics import load_archive, evaluate, set_archive, sweep, parse_fallback, parse_list, send_seconds, json_size
+
+import at_cloudlocate_test as app
+from at_cloudlocate_test import FallbackConfig
+
+GPS = 0
+
+# a +UGUBX line of one epoch, every satellite has the C/No cno
+def ugubx_line(cno, numSv, gpsTOW, rng):
+	message = make_measx_message(numSv, [GPS], (cno, 0), gpsTOW, rng)
+	return '2021-08-16 12:55:12:output->+UGUBX: "' + (MEASX_HEADER + message).hex().upper() + '"\n'
+
+# acquisitions of (cno, epochs) or (cno, epochs, weak), the first weak epochs have a C/No of 12
+# the same epoch is polled twice in every acquisition
+def write_log(path, runs, seed=1):
+	rng = random.Random(seed)
+	gpsTOW = 100000
+	opener = gzip.open if path.endswith('.gz') else open
+	with opener(path, 'wt') as f:
+		for run in runs:
+			cno, epochs, weak = (run + (0,))[0:3]
+			for index in range(epochs):
+				line = ugubx_line(12 if index < weak else cno, 8, gpsTOW, rng)
+				f.write(line)
+				if index == 1:
+					f.write(line)
+				gpsTOW += 1000
+			gpsTOW += 60000
+
+def test_files_are_split_into_acquisitions(tmp_path):
+	(tmp_path / 'logs').mkdir()
+	write_log(str(tmp_path / 'logs' / 'a.txt'), [(35, 15), (15, 15)])
+	write_log(str(tmp_path / 'logs' / 'b.txt.gz'), [(35, 3)])
+	archive = load_archive([str(tmp_path / 'logs')], GPS, [22], [3], jobs=1)
+	assert (archive.files, archive.frames, archive.duplicates) == (2, 36, 3)
+	assert archive.ranges() == [(0, 15), (15, 30), (30, 33)]
+	assert list(archive.offset[0:3]) == [0, 1000, 2000]
+	assert archive.offset[15] == 0
+	assert set(archive.maxCNO[0:15]) == {35}
+	assert set(archive.cnoCount[22][0:15]) == {8}
+	assert set(archive.cnoCount[22][15:30]) == {0}
+
+def test_acceptance_fallback_and_censored_runs(tmp_path, app_settings):
+	app_settings.setattr(app, 'GNSS_READY_TIMEOUT', 12)
+	write_log(str(tmp_path / 'a.txt'), [(35, 15), (15, 15), (15, 3)])
+	archive = load_archive([str(tmp_path / 'a.txt')], GPS, [22], [3], jobs=1)
+	set_archive(archive, 12, 115200)
+
+	result = evaluate((22, 3, 6, 2, FallbackConfig.FALLBACK_DO_NOT_SEND, 0))
+	assert (result['runs'], result['passed'], result['censored']) == (3, 1, 1)
+	assert result['fallback'] == 'DO_NOT_SEND'
+	assert result['epochs_to_accept'] == 2.0
+	assert result['payload_mean'] == json_size(archive.size[0] + archive.size[1])
+	assert result['send_p50'] == pytest.approx(1.0 + send_seconds(result['payload_mean'], 115200))
+
+	# the weak acquisitions are sent with their satellites of any C/No at TIMEOUT
+	result = evaluate((22, 3, 6, 2, FallbackConfig.FALLBACK_NO_OF_SATELLITIES_ONLY, 4))
+	assert result['fallback'] == 'NO_OF_SATELLITIES_ONLY:4'
+	assert result['passed'] == 3
+	assert result['fallback_rate'] == pytest.approx(2/3)
+
+	# a longer TIMEOUT does not help an acquisition without a valid epoch, it ends at GNSS_READY_TIMEOUT
+	result = evaluate((22, 3, 6, 2, FallbackConfig.FALLBACK_EXTEND_TIMEOUT, 5))
+	assert (result['passed'], result['censored']) == (1, 1)
+
+# TIMEOUT counts from the first valid epoch
+def test_timeout_starts_at_the_first_valid_epoch(tmp_path, app_settings):
+	app_settings.setattr(app, 'GNSS_READY_TIMEOUT', 12)
+	# the receiver reaches the thresholds 10 seconds in
+	write_log(str(tmp_path / 'a.txt'), [(35, 13, 10)])
+	archive = load_archive([str(tmp_path / 'a.txt')], GPS, [22], [3], jobs=1)
+	set_archive(archive, 2, 115200)
+	result = evaluate((22, 3, 6, 3, FallbackConfig.FALLBACK_DO_NOT_SEND, 0))
+	assert (result['passed'], result['epochs_to_accept']) == (1, 13)
+	# the first valid epoch comes after GNSS_READY_TIMEOUT
+	app_settings.setattr(app, 'GNSS_READY_TIMEOUT', 9)
+	assert evaluate((22, 3, 6, 3, FallbackConfig.FALLBACK_DO_NOT_SEND, 0))['passed'] == 0
+
+# CloudLocate_run() epoch by epoch: the index of the epoch the payload is sent at and whether it was a fallback
+def naive_replay(archive, start, end, config, timeout, adaptive):
+	cno, multipath, satellites, epochs, fallback, fallbackValue = config
+	if fallback == FallbackConfig.FALLBACK_EXTEND_TIMEOUT:
+		timeout += fallbackValue
+	if fallback == FallbackConfig.FALLBACK_EPOCHS:
+		column, threshold, needed = archive.cnoCount[cno], satellites, fallbackValue
+	elif fallback == FallbackConfig.FALLBACK_NO_OF_SATELLITIES_ONLY:
+		column, threshold, needed = archive.gnssCount, fallbackValue, epochs
+	else:
+		column = None
+	readyMs = app.GNSS_READY_TIMEOUT*1000
+	valid = 0
+	startOffset = None
+	last = start
+	for index in range(start, end):
+		offset = archive.offset[index]
+		if startOffset is None and offset > readyMs:
+			break
+		if startOffset is not None and offset - startOffset > timeout*1000:
+			break
+		last = index
+		if archive.validCount[(cno, multipath)][index] >= satellites:
+			valid += 1
+			if startOffset is None:
+				startOffset = offset
+		if valid >= epochs:
+			return index, False
+		if adaptive and column is not None and startOffset is None and offset >= app.FALLBACK_AFTER*readyMs:
+			if sum(1 for i in range(start, index+1) if column[i] >= threshold) >= needed:
+				return index, True
+	if column is not None and sum(1 for i in range(start, last+1) if column[i] >= threshold) >= needed:
+		return last, True
+	return None, False
+
+@pytest.mark.parametrize('adaptive', [False, True])
+def test_evaluate_matches_an_epoch_by_epoch_replay(tmp_path, app_settings, adaptive):
+	app_settings.setattr(app, 'ADAPTIVE_EPOCHS', adaptive)
+	rng = random.Random(7)
+	runs = [(rng.choice([16, 22, 28, 34]), rng.randint(4, 24), rng.choice([0, 0, 3, 8, 14, 20])) for i in range(40)]
+	write_log(str(tmp_path / 'a.txt'), runs, seed=7)
+	archive = load_archive([str(tmp_path / 'a.txt')], GPS, [18, 22, 26, 30], [1, 2, 3], jobs=1)
+	set_archive(archive, 12, 115200)
+	fallbacks = [(FallbackConfig.FALLBACK_EPOCHS, 1), (FallbackConfig.FALLBACK_EPOCHS, 2), (FallbackConfig.FALLBACK_NO_OF_SATELLITIES_ONLY, 4),
+		(FallbackConfig.FALLBACK_DO_NOT_SEND, 0), (FallbackConfig.FALLBACK_EXTEND_TIMEOUT, 5)]
+	for n in range(40):
+		config = (rng.choice([18, 22, 26, 30]), rng.choice([1, 2, 3]), rng.randint(3, 9), rng.randint(1, 3)) + rng.choice(fallbacks)
+		replays = [naive_replay(archive, start, end, config, 12, adaptive) for start, end in archive.ranges()]
+		sent = [(index, start) for (index, fallback), (start, end) in zip(replays, archive.ranges()) if index is not None]
+		result = evaluate(config)
+		assert result['passed'] == len(sent), config
+		assert round(result['fallback_rate']*result['runs']) == sum(1 for index, fallback in replays if fallback), config
+		assert round((result['epochs_to_accept'] or 0)*result['passed']) == sum(index - start + 1 for index, start in sent), config
+
+def test_sweep_returns_the_results_of_evaluate(tmp_path):
+	write_log(str(tmp_path / 'a.txt'), [(35, 15), (20, 15), (15, 4)])
+	archive = load_archive([str(tmp_path / 'a.txt')], GPS, [18, 22], [1, 3], jobs=1)
+	configs = [(cno, 3, 6, epochs, FallbackConfig.FALLBACK_EPOCHS, 1) for cno in (18, 22) for epochs in (1, 2)]
+	results = sweep(archive, configs, 12, 115200, jobs=1)
+	set_archive(archive, 12, 115200)
+	assert results == [evaluate(config) for config in configs]
+
+def test_command_line_values():
+	assert parse_list('18,22,26') == [18, 22, 26]
+	assert parse_fallback('EPOCHS:2') == (FallbackConfig.FALLBACK_EPOCHS, 2)
+	assert parse_fallback('do_not_send') == (FallbackConfig.FALLBACK_DO_NOT_SEND, 0)
+	assert parse_fallback('EXTEND_TIMEOUT') == (FallbackConfig.FALLBACK_EXTEND_TIMEOUT, app.FALLBACK_CONFIG[FallbackConfig.FALLBACK_EXTEND_TIMEOUT])
+	with pytest.raises(KeyError):
+		parse_fallback('NEVER')
@@ -0,0 +1,47 @@
+import re
+import struct
+
+import pytest
+
+from conftest import TEST_LOG
+from measx_decoder import MEASX_HEADER, MEASX_BLOCK, MeasxEpoch, decode_measx_hex, ubx_checksum
+
+# the MEASX frames of "Test log.txt", as hex characters of +UGUBX
+def recorded_frames():
+	with open(TEST_LOG, encoding='utf-8', errors='replace') as f:
+		return re.findall(r'\+UGUBX: "(B5620214[0-9A-F]+)"', f.read())
+
+FRAMES = recorded_frames()
+
+def test_the_log_has_measx_frames():
+	assert len(FRAMES) >= 2
+
+@pytest.mark.parametrize('hexFrame', FRAMES)
+def test_recorded_frame(hexFrame):
+	raw = bytes.fromhex(hexFrame)
+	epoch = decode_measx_hex(hexFrame)
+	assert epoch.frame() == raw
+	assert ubx_checksum(raw[2:-2]) == raw[-2:]
+	assert epoch.version == 1 and 0 < epoch.numSv <= 64
+	# the strided columns match the satellite blocks unpacked one by one
+	offset = 6 + 44
+	for index, block in enumerate(epoch.blocks()):
+		assert block == MEASX_BLOCK.unpack_from(raw, offset + 24*index)
+		assert (epoch.gnssId[index], epoch.svId[index], epoch.cNo[index], epoch.mpathIndic[index]) == block[0:4]
+	assert len(epoch.cNo) == epoch.numSv
+	# gpsTOW in ms, within a week
+	assert struct.unpack_from('<I', raw, 6 + 4)[0] == epoch.gpsTOW < 7*86400*1000
+
+def test_invalid_messages():
+	raw = bytes.fromhex(FRAMES[0])
+	with pytest.raises(ValueError):
+		decode_measx_hex('B562050102000000')
+	with pytest.raises(ValueError):
+		MeasxEpoch(raw[4:-10])
+	with pytest.raises(ValueError):
+		MeasxEpoch(b'\x01')
+	# a numSv beyond the payload
+	message = bytearray(raw[4:])
+	message[2 + 34] = 200
+	with pytest.raises(ValueError):
+		MeasxEpoch(bytes(message))
@@ -0,0 +1,103 @@
+import threading
+
+import pytest
+
+from measx_scheduler import MeasxScheduler, WEEK_MS
+
+import at_cloudlocate_test as app
+
+def test_duplicates_and_older_epochs_are_discarded():
+	scheduler = MeasxScheduler()
+	assert scheduler.accept(5000, 10.0)
+	assert not scheduler.accept(5000, 10.3)
+	assert not scheduler.accept(4000, 10.4)
+	assert scheduler.accept(6000, 11.0)
+	assert (scheduler.epochs, scheduler.duplicates) == (2, 2)
+
+# an epoch with satellites is not enough, the receiver is ready at the first valid one
+def test_ready_at_the_first_valid_epoch():
+	scheduler = MeasxScheduler()
+	scheduler.accept(5000, 10.0)
+	assert not scheduler.ready()
+	scheduler.accept(6000, 11.0)
+	scheduler.mark_valid(11.0)
+	scheduler.mark_valid(12.0)
+	assert scheduler.ready() and scheduler.readyTime == 11.0
+
+def test_rate_is_learned_from_gps_tow():
+	scheduler = MeasxScheduler()
+	scheduler.accept(5000, 0)
+	scheduler.accept(7000, 2)
+	assert (scheduler.rate, scheduler.rateSource) == (2000, 'gpsTOW')
+	# a missed epoch does not make the rate slower, a shorter step makes it faster
+	scheduler.accept(11000, 6)
+	scheduler.accept(11500, 6.5)
+	assert scheduler.rate == 500
+
+def test_cfg_rate_wins_over_gps_tow():
+	scheduler = MeasxScheduler()
+	scheduler.set_rate(1000)
+	scheduler.accept(5000, 0)
+	scheduler.accept(5200, 0.2)
+	assert (scheduler.rate, scheduler.rateSource) == (1000, 'CFG-RATE')
+	scheduler.set_rate(0)
+	assert scheduler.rate == 1000
+
+def test_week_rollover():
+	scheduler = MeasxScheduler()
+	assert scheduler.accept(WEEK_MS - 1000, 0)
+	assert scheduler.accept(0, 1)
+	assert scheduler.rate == 1000
+
+def test_delay_until_the_next_epoch():
+	scheduler = MeasxScheduler(rate=1000, retry=0.25)
+	assert scheduler.delay(0) == 0.25
+	scheduler.accept(5000, 10.0)
+	assert scheduler.delay(10.4) == pytest.approx(0.6)
+	# late: poll again soon
+	assert scheduler.delay(11.5) == 0.25
+	scheduler.reset()
+	assert not scheduler.ready() and scheduler.rate == 1000
+
+def test_device_polls_once_per_measurement(make_device, app_settings):
+	app_settings.setattr(app, 'EPOCHS', 2)
+	device = make_device()
+	assert device.CloudLocate_run()
+	assert device.measxScheduler.epochs >= 2 and device.measxScheduler.ready()
+
+# UBX-CFG-GNSS of GPS, and its UBX-ACK-ACK
+CFG_GNSS = 'AT+UGUBX="B562063E3C000000200700081000010001010101030000000101020408000000010103081000000001010400080000000101050003000100050106080E0000000001307F"'
+ACK_CFG_GNSS = bytes.fromhex('B56205010200063E4C75')
+
+def cfg_gnss_ack_seconds(device):
+	return [span['seconds'] for span in device.metrics.spans if span['stage'] == 'cfg_gnss_ack'][0]
+
+def test_cfg_gnss_span_ends_with_its_ack(make_device, app_settings):
+	app_settings.setattr(app, 'UBX_ACK_TIMEOUT', 2)
+	device = make_device()
+	# the ACK comes 0.3 seconds after the OK
+	device.ser.transcript[CFG_GNSS] = [[(0.0, 'OK')]]
+	threading.Timer(0.3, device.onUBXFrame, (ACK_CFG_GNSS,)).start()
+	device.GNSSOn()
+	assert 0.25 <= cfg_gnss_ack_seconds(device) < 1.5
+	assert device.ubxAck[(0x06, 0x3E)] is True
+
+def test_cfg_gnss_without_ack_waits_for_the_timeout(make_device, app_settings):
+	app_settings.setattr(app, 'UBX_ACK_TIMEOUT', 0.2)
+	device = make_device()
+	device.ser.transcript[CFG_GNSS] = [[(0.0, 'OK')]]
+	device.GNSSOn()
+	assert 0.15 <= cfg_gnss_ack_seconds(device) < 1
+	assert (0x06, 0x3E) not in device.ubxAck
+
+# epochs with satellites but none within the thresholds: the receiver is not ready
+def test_device_is_ready_at_the_first_valid_epoch(make_device, app_settings):
+	app_settings.setattr(app, 'CNO_THRESHOLD', 60)
+	app_settings.setattr(app, 'GNSS_READY_TIMEOUT', 1)
+	app_settings.setattr(app, 'FALLBACK_METHODOLOGY', app.FallbackConfig.FALLBACK_DO_NOT_SEND)
+	device = make_device()
+	assert not device.CloudLocate_run()
+	assert device.measxScheduler.epochs >= 1 and not device.measxScheduler.ready()
+
+def test_cold_start_gets_the_time_of_the_original_wait():
+	assert app.GNSS_READY_TIMEOUT >= 5 + app.TIMEOUT
@@ -0,0 +1,81 @@
+import time
+
+from conftest import TEST_LOG
+from modem_simulator import SimulatedModem, load_transcript, split_chain
+
+# send a command and read its reply lines up to the final result code
+def ask(modem, at_cmd):
+	modem.write((at_cmd+'\r\n').encode())
+	lines = []
+	while not lines or lines[-1] not in ('OK', 'ERROR'):
+		line = modem.readline()
+		if not line:
+			break
+		if line.strip():
+			lines.append(line.decode().strip())
+	return lines
+
+def test_transcript_keeps_replies_with_their_delays():
+	transcript = load_transcript(TEST_LOG)
+	# the recorded seconds between a command and its URC
+	assert transcript['AT+UMQTTC=1'][0] == [(0.0, 'OK'), (0.0, '+CSCON: 1'), (2.0, '+UUMQTTC: 1,1')]
+	# every MEASX poll is kept, they are replayed in turn
+	assert len(transcript['AT+UGUBX="B562021400001644"']) == 2
+
+def test_split_chain_keeps_quoted_semicolons():
+	assert split_chain('AT+A="x;y";+B;+C=1') == ['AT+A="x;y"', 'AT+B', 'AT+C=1']
+
+def test_recorded_and_default_replies():
+	modem = SimulatedModem(TEST_LOG, time_scale=0, timeout=0.5)
+	assert ask(modem, 'at+cops?;+CSQ;+CGATT?') == ['+COPS: 0,0,"Chunghwa Telecom",7', '+CSQ: 15,7', '+CGATT: 1', 'OK']
+	first, second, third = (ask(modem, 'AT+UGUBX="B562021400001644"')[0] for _ in range(3))
+	assert first != second and first == third
+	# a command which is not in the transcript is answered with OK
+	assert ask(modem, 'AT+NOTRECORDED') == ['OK']
+	assert modem.commands[-1] == 'AT+NOTRECORDED' and len(modem.commands) == 5
+	modem.close()
+
+def test_chained_line_stops_at_the_first_error():
+	modem = SimulatedModem({'AT+A': [[(0.0, '+A: 1'), (0.0, 'OK')]], 'AT+B': [[(0.0, 'ERROR')]]}, time_scale=0, timeout=0.5)
+	assert ask(modem, 'AT+A;+B;+A') == ['+A: 1', 'ERROR']
+	assert ask(modem, 'AT+A;+A') == ['+A: 1', '+A: 1', 'OK']
+	modem.close()
+
+def test_download_waits_for_the_file_content():
+	modem = SimulatedModem(TEST_LOG, time_scale=0, timeout=0.5)
+	modem.write(b'AT+UDWNFILE="CloudLocate_pub_data.txt",5\r\n')
+	assert modem.read_until(b'>') == b'>'
+	modem.write(b'12345')
+	assert b'OK' in modem.read_until(b'OK\r\n')
+	modem.close()
+
+def test_latency_and_time_scale():
+	modem = SimulatedModem({'AT': [[(2.0, 'OK')]]}, time_scale=0.05, latency=0.1, timeout=2)
+	start = time.monotonic()
+	modem.write(b'AT\r\n')
+	assert modem.readline() == b'OK\r\n'
+	assert 0.15 <= time.monotonic() - start < 1.5
+	modem.close()
+
+def test_whole_run_against_the_recorded_log(make_device):
+	device = make_device()
+	assert device.setupLink()
+	assert device.run(1, 0) == 1
+	assert any(command.startswith('AT+UGUBX="B562021400001644"') for command in device.ser.commands)
+
+# the recorded position reply carries the UTCDateTime of the payload it answers, as CloudLocate does
+def test_reply_has_the_measx_time_of_the_published_payload():
+	modem = SimulatedModem(TEST_LOG, time_scale=0, timeout=0.5)
+	payload = b'{"body":"x","headers":{"UTCDateTime":"2026-10-17T12:00:00"}}'
+	modem.write(b'AT+UDWNFILE="CloudLocate_pub_data.txt",%d\r\n' % len(payload))
+	assert modem.read_until(b'>') == b'>'
+	modem.write(payload)
+	assert b'OK' in modem.read_until(b'OK\r\n')
+	ask(modem, 'AT+UMQTTC=3,0,0,"CloudLocate/GNSS/request","CloudLocate_pub_data.txt"')
+	ask(modem, 'AT+UMQTTC=2,0,0,1,"CloudLocate/GNSS/request","%s"' % b'{"headers":{"UTCDateTime":"2026-10-17T12:00:30"}}'.hex().upper())
+	time.sleep(0.1)
+	replies = [line for line in ask(modem, 'AT+UMQTTC=6') if line.startswith('+UMQTTC: 6,')]
+	assert len(replies) == 2
+	assert '"MeasxTime":"2026-10-17T12:00:00"' in replies[0]
+	assert '"MeasxTime":"2026-10-17T12:00:30"' in replies[1]
+	modem.close()
@@ -0,0 +1,143 @@
+import io
+import socket
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from broker_simulator import SimulatedBroker
+from log_buffer import BufferedLog, INFO
+from mqtt_uplink import MQTTUplink, UplinkError, topic_matches
+
+import at_cloudlocate_test as app
+
+@pytest.fixture
+def broker():
+	broker = SimulatedBroker(response_delay=None)
+	yield broker
+	broker.close()
+
+def wait_until(condition, timeout=2):
+	deadline = time.time() + timeout
+	while not condition() and time.time() < deadline:
+		time.sleep(0.01)
+	return condition()
+
+# drop every client connection on the broker side
+def disconnect_all(broker):
+	with broker.lock:
+		sessions = list(broker.sessions)
+	for session in sessions:
+		session.request.shutdown(socket.SHUT_RDWR)
+
+def count_subscribes(uplink):
+	sent = []
+	send_subscribe = uplink.send_subscribe
+	def counting(topicFilter, qos=1):
+		sent.append(topicFilter)
+		return send_subscribe(topicFilter, qos)
+	uplink.send_subscribe = counting
+	return sent
+
+def test_topic_matches():
+	assert topic_matches('CloudLocate/+/GNSS/response', 'CloudLocate/dev/GNSS/response')
+	assert topic_matches('CloudLocate/#', 'CloudLocate/dev/GNSS/response')
+	assert not topic_matches('CloudLocate/+', 'CloudLocate/dev/GNSS')
+
+def test_connect_error_goes_to_the_log(capsys):
+	with socket.socket() as sock:
+		sock.bind(('127.0.0.1', 0))
+		port = sock.getsockname()[1]
+	stream = io.StringIO()
+	uplink = MQTTUplink('127.0.0.1', port, 'closed', timeout=1, log=BufferedLog(INFO, stream))
+	assert not uplink.connect()
+	uplink.log.flush()
+	assert stream.getvalue().startswith('.. MQTT uplink cannot connect 127.0.0.1:'+str(port))
+	assert capsys.readouterr().out == ''
+
+def test_publish_window_waits_for_puback():
+	broker = SimulatedBroker(latency=0.3, response_delay=None)
+	uplink = MQTTUplink(broker.host, broker.port, 'window', window=2, timeout=5)
+	try:
+		futures = [uplink.publish_async('t', 'a'), uplink.publish_async('t', 'b')]
+		assert len(uplink.inflight) == 2
+		third = []
+		thread = threading.Thread(target=lambda: third.append(uplink.publish_async('t', 'c')))
+		thread.start()
+		time.sleep(0.1)
+		# no place in the window before the first PUBACK
+		assert not third
+		thread.join(5)
+		assert all(uplink.wait(future) for future in futures + third)
+		assert uplink.published == 3
+	finally:
+		uplink.close()
+		broker.close()
+
+def test_first_subscribe_is_sent_once(broker):
+	uplink = MQTTUplink(broker.host, broker.port, 'once', timeout=5)
+	sent = count_subscribes(uplink)
+	try:
+		assert uplink.subscribe('a/+', lambda topic, payload: None)
+		assert uplink.subscribe('a/+', lambda topic, payload: None)
+		assert sent == ['a/+']
+	finally:
+		uplink.close()
+
+def test_reconnect_subscribes_again(broker):
+	uplink = MQTTUplink(broker.host, broker.port, 'again', timeout=5)
+	sent = count_subscribes(uplink)
+	received = []
+	try:
+		assert uplink.subscribe('a/b', lambda topic, payload: received.append(payload))
+		disconnect_all(broker)
+		assert wait_until(lambda: not uplink.connected)
+		# the next publish connects again and the subscription is renewed
+		assert uplink.publish('a/b', 'after')
+		assert uplink.connects == 2
+		assert sent == ['a/b', 'a/b']
+		assert wait_until(lambda: received == [b'after'])
+	finally:
+		uplink.close()
+
+def test_lost_connection_fails_publishes_in_flight():
+	broker = SimulatedBroker(latency=1, response_delay=None)
+	uplink = MQTTUplink(broker.host, broker.port, 'lost', timeout=5)
+	try:
+		future = uplink.publish_async('t', 'x')
+		disconnect_all(broker)
+		with pytest.raises(UplinkError):
+			future.result(2)
+		assert not uplink.inflight
+	finally:
+		uplink.close()
+		broker.close()
+
+# publish_async() of the payloads in failing fails, the others are acknowledged
+class FakeUplink:
+	def __init__(self, failing):
+		self.host, self.port, self.clientId = 'fake', 0, ''
+		self.failing = failing
+		self.sent = []
+
+	def publish_async(self, topic, payload):
+		self.sent.append(payload)
+		future = Future()
+		future.set_result(payload not in self.failing)
+		return future
+
+	def wait(self, future, timeout=None):
+		return future.result()
+
+def test_drain_keeps_only_payloads_without_puback(make_device, app_settings):
+	app_settings.setattr(app, 'QUEUE_PAYLOADS', True)
+	app_settings.setattr(app, 'UPLINK_WINDOW', 2)
+	device = make_device()
+	for payload in '12345':
+		device.payloadQueue.put(payload)
+	device.uplink = FakeUplink({'2'})
+	device.drainQueueUplink()
+	# 3 was in flight when 2 failed, 4 and 5 are not started
+	assert device.uplink.sent == ['1', '2', '3']
+	assert [payload for position, payload in device.payloadQueue.peek(10)] == ['2', '4', '5']
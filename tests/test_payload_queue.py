@@ -0,0 +1,99 @@
+import os
+
+from payload_queue import PayloadQueue, SEGMENT_NAME
+
+import at_cloudlocate_test as app
+
+def test_put_peek_ack_survives_reopen(tmp_path):
+	queue = PayloadQueue(str(tmp_path))
+	for index in range(3):
+		queue.put('{"n": %d}' % index)
+	(first, payload), (second, _) = queue.peek(2)
+	assert payload == '{"n": 0}'
+	queue.ack(first)
+	queue.close()
+
+	queue = PayloadQueue(str(tmp_path))
+	assert [payload for position, payload in queue.peek(10)] == ['{"n": 1}', '{"n": 2}']
+	# ack is cumulative
+	queue.ack(queue.peek(2)[1][0])
+	assert len(queue) == 0
+	queue.close()
+
+def test_torn_tail_is_cut_off(tmp_path):
+	queue = PayloadQueue(str(tmp_path))
+	queue.put('{"n": 0}')
+	queue.put('{"n": 1}')
+	queue.close()
+	segment = os.path.join(str(tmp_path), SEGMENT_NAME % 1)
+	size = os.path.getsize(segment)
+	# a crash in the middle of the second record
+	with open(segment, 'r+b') as f:
+		f.truncate(size - 3)
+
+	queue = PayloadQueue(str(tmp_path))
+	assert [payload for position, payload in queue.peek(10)] == ['{"n": 0}']
+	queue.put('{"n": 2}')
+	queue.close()
+	queue = PayloadQueue(str(tmp_path))
+	assert [payload for position, payload in queue.peek(10)] == ['{"n": 0}', '{"n": 2}']
+	queue.close()
+
+def test_oldest_payloads_are_dropped_above_max_bytes(tmp_path):
+	queue = PayloadQueue(str(tmp_path), maxBytes=100, segmentSize=40)
+	dropped = sum(queue.put('x'*20) for index in range(6))
+	assert dropped == queue.droppedPayloads == 3
+	assert len(queue) == 3
+	# published segments are removed
+	assert len(os.listdir(str(tmp_path))) <= 4
+	queue.close()
+
+def test_queue_is_off_by_default():
+	assert app.QUEUE_PAYLOADS is False
+
+def test_drain_drops_a_payload_above_the_limit(make_device, app_settings):
+	app_settings.setattr(app, 'QUEUE_PAYLOADS', True)
+	app_settings.setattr(app, 'PUBLISH_MODE', 'auto')
+	device = make_device()
+	for payload in ('a'*50, 'b'*200, 'c'*50):
+		device.payloadQueue.put(payload)
+	published = []
+	device.drainQueue(lambda payload: published.append(payload) or True, 100)
+	assert published == ['a'*50, 'c'*50]
+	assert len(device.payloadQueue) == 0
+
+def test_drain_stops_at_the_first_failed_publish(make_device, app_settings):
+	app_settings.setattr(app, 'QUEUE_PAYLOADS', True)
+	app_settings.setattr(app, 'PUBLISH_MODE', 'auto')
+	device = make_device()
+	for payload in ('a', 'b', 'c'):
+		device.payloadQueue.put(payload)
+	device.drainQueue(lambda payload: payload == 'a', 100)
+	assert [payload for position, payload in device.payloadQueue.peek(10)] == ['b', 'c']
+
+def test_drain_keeps_a_payload_whose_file_cannot_be_written(make_device, app_settings):
+	app_settings.setattr(app, 'QUEUE_PAYLOADS', True)
+	app_settings.setattr(app, 'PUBLISH_MODE', 'file')
+	device = make_device()
+	for payload in ('a', 'b'):
+		device.payloadQueue.put(payload)
+	device.ser.transcript['AT+UDWNFILE="CLOUDLOCATE_PUB_DATA.TXT",1'] = [[(0.0, 'ERROR')]]
+	published = []
+	device.drainQueue(lambda payload: published.append(payload) or True, 100)
+	assert published == []
+	assert [payload for position, payload in device.payloadQueue.peek(10)] == ['a', 'b']
+
+def test_remove_behind_the_head_is_published_again_after_a_crash(tmp_path):
+	queue = PayloadQueue(str(tmp_path))
+	for payload in ('a', 'b', 'c'):
+		queue.put(payload)
+	positions = [position for position, payload in queue.peek(3)]
+	queue.remove(positions[1])
+	assert [payload for position, payload in queue.peek(10)] == ['a', 'c']
+	queue.close()
+	# the index only moves with the head
+	queue = PayloadQueue(str(tmp_path))
+	assert len(queue) == 3
+	queue.remove(positions[0])
+	assert [payload for position, payload in queue.peek(10)] == ['b', 'c']
+	queue.close()
@@ -0,0 +1,83 @@
+from concurrent.futures import Future
+
+import pytest
+
+from broker_simulator import SimulatedBroker
+
+import at_cloudlocate_test as app
+
+def count(device, prefix):
+	return sum(1 for command in device.ser.commands if command.upper().startswith(prefix))
+
+@pytest.fixture
+def pipeline(app_settings):
+	app_settings.setattr(app, 'PIPELINE', True)
+	app_settings.setattr(app, 'KEEP_CONNECTION', True)
+	app_settings.setattr(app, 'POSITION_TIMEOUT', 0.5)
+	return app_settings
+
+@pytest.fixture
+def host_uplink(pipeline):
+	broker = SimulatedBroker(response_delay=0.1)
+	pipeline.setattr(app, 'UPLINK', 'host')
+	pipeline.setattr(app, 'Hostname', broker.host)
+	pipeline.setattr(app, 'UPLINK_PORT', broker.port)
+	pipeline.setattr(app, 'UPLINK_TLS', False)
+	yield broker
+	broker.close()
+
+# publish_async() never gets a PUBACK, as without coverage
+class FailingUplink:
+	def __init__(self):
+		self.host, self.port, self.clientId = 'fake', 0, ''
+		self.connected = True
+		self.sent = []
+
+	def subscribe(self, topicFilter, callback):
+		return True
+
+	def unsubscribe(self, topicFilter, callback):
+		pass
+
+	def publish_async(self, topic, payload):
+		self.sent.append(payload)
+		future = Future()
+		future.set_result(False)
+		return future
+
+	def wait(self, future, timeout=None):
+		return future.result()
+
+def test_pipeline_reads_the_positions_later(app_settings):
+	assert app.positionWait()
+	app_settings.setattr(app, 'PIPELINE', True)
+	assert not app.positionWait()
+
+def test_host_uplink_publishes_while_the_next_acquisition_runs(make_device, host_uplink):
+	device = make_device()
+	assert device.run(3, 0) == 3
+	assert host_uplink.requests == 3
+	assert not device.uploads
+	assert not len(device.positions)
+	assert device.positionFuture.result(0).lat == pytest.approx(25.0804284)
+	# the AT channel is only used by the acquisitions
+	assert count(device, 'AT+UMQTTC') == 0
+
+def test_upload_without_puback_is_queued(make_device, pipeline):
+	pipeline.setattr(app, 'UPLINK', 'host')
+	pipeline.setattr(app, 'QUEUE_PAYLOADS', True)
+	device = make_device()
+	device.uplink = FailingUplink()
+	assert device.run(2, 0) == 0
+	assert len(device.uplink.sent) == 2
+	assert [payload for position, payload in device.payloadQueue.peek(10)] == device.uplink.sent
+	assert device.positionFuture.cancelled()
+
+def test_modem_uplink_keeps_one_session(make_device, pipeline):
+	device = make_device()
+	assert device.run(3, 0) == 3
+	assert count(device, 'AT+UMQTTC=1') == 1
+	assert count(device, 'AT+UMQTTC=2,') + count(device, 'AT+UMQTTC=3,') == 3
+	# the replies are read between the acquisitions and at the end, not after every publish
+	assert count(device, 'AT+UMQTTC=6') >= 1
+	device.disconnect()
@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+from position_response import PositionRequests, PositionRequest, PositionTimeout, parse_read_line
+
+REPLY = '{"Lat":25.0804284,"Lon":121.5606483,"Alt":82.648,"Acc":32.92,"MeasxTime":"%s","Epochs":2}'
+TOPIC = 'CloudLocate/dev/GNSS/response'
+
+def test_parse_read_line():
+	line = '+UMQTTC: 6,0,175,69,"%s",106,"%s"' % (TOPIC, REPLY % 'T1')
+	assert parse_read_line(line) == (TOPIC, REPLY % 'T1')
+	assert parse_read_line('+UMQTTC: 6,0,0') is None
+
+def test_reply_resolves_the_request_of_its_measx_time():
+	requests = PositionRequests(timeout=5)
+	first = requests.submit(TOPIC, 'T1')
+	second = requests.submit(TOPIC, 'T2')
+	position = requests.resolve(TOPIC, REPLY % 'T2')
+	assert second.result(0) is position and position.lat == 25.0804284
+	assert not first.done()
+	assert len(requests) == 1
+	# a reply without MeasxTime resolves the oldest request of the topic
+	assert requests.resolve(TOPIC, '{"Lat":25.0804284,"Lon":121.5606483,"Acc":32.92}') is first.result(0)
+
+# the late reply of an expired request, or of a payload published from the queue, is not given to another request
+def test_reply_of_another_measx_time_resolves_nothing():
+	requests = PositionRequests(timeout=5)
+	expired = requests.submit(TOPIC, '2021-08-16T04:55:21', timeout=0.01)
+	with pytest.raises(PositionTimeout):
+		expired.result(2)
+	pending = requests.submit(TOPIC, '2021-08-16T04:56:30')
+	assert requests.resolve(TOPIC, REPLY % '2021-08-16T04:55:21') is None
+	assert requests.unmatched == 1
+	assert not pending.done() and len(requests) == 1
+	assert requests.resolve(TOPIC, REPLY % '2021-08-16T04:56:30') is pending.result(0)
+
+def test_unmatched_replies():
+	requests = PositionRequests(timeout=5)
+	requests.submit(TOPIC, 'T1')
+	assert requests.resolve('other/topic', REPLY % 'T1') is None
+	assert requests.resolve(TOPIC, 'not json') is None
+	assert requests.unmatched == 1
+
+def test_request_without_reply_times_out():
+	requests = PositionRequests()
+	future = requests.submit(TOPIC, 'T1', timeout=0.05)
+	with pytest.raises(PositionTimeout):
+		future.result(2)
+	assert len(requests) == 0
+
+def test_reply_after_cancel_is_ignored():
+	requests = PositionRequests(timeout=5)
+	future = requests.submit(None, 'T1')
+	future.cancel()
+	assert requests.resolve(TOPIC, REPLY % 'T1') is None
+	assert requests.unmatched == 1
+
+# the Future is finished by expire() after resolve() took the request, resolve() must not raise
+def test_resolve_of_a_finished_future_does_not_raise():
+	requests = PositionRequests(timeout=5)
+	request = PositionRequest(TOPIC, 'T1')
+	request.timer = threading.Timer(5, lambda: None)
+	requests.pending.append(request)
+	request.future.set_running_or_notify_cancel()
+	request.future.set_exception(PositionTimeout('expired'))
+	resolved = []
+	requests.callbacks.append(resolved.append)
+	position = requests.resolve(TOPIC, REPLY % 'T1')
+	assert resolved == [position]
+	with pytest.raises(PositionTimeout):
+		request.future.result(0)
+	# and expire() after resolve()
+	requests.expire(request)
+
+def test_resolve_and_expire_race():
+	requests = PositionRequests()
+	for index in range(200):
+		future = requests.submit(TOPIC, 'T%d' % index, timeout=0.001)
+		time.sleep(0.001)
+		requests.resolve(TOPIC, REPLY % ('T%d' % index))
+		assert future.exception(2) is None or isinstance(future.exception(2), PositionTimeout)
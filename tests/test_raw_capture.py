@@ -0,0 +1,40 @@
+import glob
+import os
+
+from raw_capture import RawCapture, RX, TX, read_capture, replay, transcript_lines
+from ubx_stream import AT_LINE
+
+import at_cloudlocate_test as app
+
+def test_records_are_read_back(tmp_path):
+	path = str(tmp_path / 'sub' / 'a.clcap')
+	capture = RawCapture(path)
+	capture.record(TX, b'AT\r\n')
+	capture.record(RX, b'')
+	capture.record(RX, b'\r\nOK\r\n')
+	capture.close()
+	capture.record(RX, b'after close')
+	assert [(direction, data) for t, direction, data in read_capture(path)] == [(TX, b'AT\r\n'), (RX, b'\r\nOK\r\n')]
+	assert [value for t, kind, value in replay(path) if kind == AT_LINE] == ['OK']
+	assert [line[20:] for line in transcript_lines(path)] == ['input->AT', 'output->OK']
+
+def test_torn_record_at_the_end_is_skipped(tmp_path):
+	path = str(tmp_path / 'a.clcap')
+	capture = RawCapture(path)
+	capture.record(RX, b'\r\nOK\r\n')
+	capture.record(RX, b'\r\n+CSQ: 20,99\r\n')
+	capture.close()
+	with open(path, 'r+b') as f:
+		f.truncate(os.path.getsize(path) - 4)
+	assert len(list(read_capture(path))) == 1
+
+def test_device_records_its_serial_traffic(make_device, app_settings, tmp_path):
+	app_settings.setattr(app, 'CAPTURE_DIR', str(tmp_path / 'captures'))
+	device = make_device()
+	assert device.setupLink()
+	device.command_send('at+cops?;+CSQ;+CGATT?', 2)
+	device.close()
+	path, = glob.glob(str(tmp_path / 'captures' / '*.clcap'))
+	lines = list(transcript_lines(path))
+	assert any(line.endswith('input->at+cops?;+CSQ;+CGATT?') for line in lines)
+	assert any('output->+CSQ' in line for line in lines)
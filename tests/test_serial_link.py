@@ -0,0 +1,64 @@
+import io
+
+from log_buffer import BufferedLog, INFO
+from modem_simulator import SimulatedModem
+from serial_link import SerialLink, COMMON_BAUDRATES
+
+import at_cloudlocate_test as app
+
+def test_detect_finds_a_modem_left_at_a_common_rate(make_device):
+	device = make_device()
+	device.ser.modemBaudrate = 921600
+	# LINK_BAUDRATES is empty, the common rates are still tried
+	assert device.link.detect(device.engine.send) == 921600
+	assert device.ser.baudrate == 921600
+
+def test_setup_link_without_baudrates_stays_at_115200(make_device, app_settings):
+	app_settings.setattr(app, 'LINK_BAUDRATES', [])
+	device = make_device()
+	assert device.setupLink()
+	assert device.ser.baudrate == 115200
+	assert not any(command.startswith('AT+IPR') for command in device.ser.commands)
+
+def test_setup_link_recovers_a_modem_left_at_a_high_rate(make_device, app_settings):
+	app_settings.setattr(app, 'LINK_BAUDRATES', [])
+	device = make_device()
+	device.ser.modemBaudrate = 460800
+	assert device.setupLink()
+	assert device.ser.baudrate == 460800
+
+def test_negotiate_and_restore(make_device):
+	device = make_device()
+	assert device.link.negotiate(device.command_send, [921600]) == 921600
+	assert device.ser.modemBaudrate == 921600
+	device.link.restore(device.engine.send)
+	assert device.ser.baudrate == device.ser.modemBaudrate == 115200
+
+def test_read_chunk_counts_bytes():
+	ser = SimulatedModem({}, time_scale=0)
+	link = SerialLink(ser)
+	link.write(b'AT\r\n')
+	data = b''
+	for _ in range(10):
+		data += bytes(link.read_chunk())
+		if b'OK' in data:
+			break
+	assert b'OK' in data
+	assert link.bytesOut == 4 and link.bytesIn == len(data)
+	assert link.throughput()['baudrate'] == 115200
+	ser.close()
+
+def test_common_baudrates_start_with_the_default():
+	assert COMMON_BAUDRATES[0] == 115200
+
+# the rate switch fails, the status line goes to the buffered log and not to the console
+def test_failed_negotiation_is_logged(capsys):
+	stream = io.StringIO()
+	ser = SimulatedModem({}, time_scale=0)
+	link = SerialLink(ser, log=BufferedLog(INFO, stream))
+	send = lambda at_cmd, timeout: ('OK' if ser.baudrate == 115200 or at_cmd != 'AT' else 'ERROR', [])
+	assert link.negotiate(send, [921600]) == 115200
+	link.log.flush()
+	assert stream.getvalue() == '.. No response at 921600 baud, back to 115200\n'
+	assert capsys.readouterr().out == ''
+	ser.close()
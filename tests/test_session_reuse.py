@@ -0,0 +1,33 @@
+import at_cloudlocate_test as app
+
+def count(device, prefix):
+	return sum(1 for command in device.ser.commands if command.upper().startswith(prefix))
+
+def test_without_keep_connection_every_run_connects(make_device):
+	device = make_device()
+	assert device.run(2, 0) == 2
+	assert count(device, 'AT+UMQTTC=1') == 2
+	assert count(device, 'AT+UMQTTC=0') == 2
+
+def test_keep_connection_reuses_the_pdp_context_and_the_session(make_device, app_settings):
+	app_settings.setattr(app, 'KEEP_CONNECTION', True)
+	device = make_device()
+	assert device.run(3, 0) == 3
+	assert count(device, 'AT+UPSDA=0,3') <= 1
+	assert count(device, 'AT+UMQTTC=1') == 1
+	assert count(device, 'AT+UMQTTC=0') == 0
+	assert device.URC_STATE['mqttConnected']
+	device.disconnect()
+	assert count(device, 'AT+UMQTTC=0') == 1
+	assert not device.URC_STATE['mqttConnected']
+
+def test_dropped_session_is_connected_again(make_device, app_settings):
+	app_settings.setattr(app, 'KEEP_CONNECTION', True)
+	device = make_device()
+	assert device.run(1, 0) == 1
+	# the broker closed the session between two runs
+	device.engine.on_line('+UUMQTTC: 0,1')
+	assert not device.URC_STATE['mqttConnected']
+	assert device.run(1, 0) == 1
+	assert count(device, 'AT+UMQTTC=1') == 2
+	device.disconnect()
@@ -0,0 +1,31 @@
+import re
+
+from conftest import TEST_LOG
+from ubx_stream import UBXStreamParser, AT_LINE, AT_PROMPT, UBX_FRAME
+
+with open(TEST_LOG, encoding='utf-8', errors='replace') as f:
+	MEASX_HEX = re.search(r'\+UGUBX: "(B5620214[0-9A-F]+)"', f.read()).group(1)
+MEASX = bytes.fromhex(MEASX_HEX)
+STREAM = b'\r\nOK\r\n\r\n+UGUBX: "' + MEASX_HEX.encode() + b'"\r\nOK\r\n>' + MEASX + b'\r\n+UUMQTTC: 1,1\r\n'
+EVENTS = [(AT_LINE, 'OK'), (AT_LINE, '+UGUBX: "'+MEASX_HEX+'"'), (UBX_FRAME, MEASX), (AT_LINE, 'OK'),
+	(AT_PROMPT, '>'), (UBX_FRAME, MEASX), (AT_LINE, '+UUMQTTC: 1,1')]
+
+def test_lines_prompt_and_frames():
+	assert UBXStreamParser().feed(STREAM) == EVENTS
+
+def test_any_chunk_size_gives_the_same_events():
+	for size in (1, 2, 7, 64, 1000):
+		parser = UBXStreamParser()
+		events = []
+		for start in range(0, len(STREAM), size):
+			events += parser.feed(STREAM[start:start+size])
+		assert events == EVENTS, size
+		assert parser.buffer == b''
+
+def test_bad_checksum_is_dropped():
+	parser = UBXStreamParser()
+	broken = MEASX[:-1] + bytes([MEASX[-1] ^ 0xFF])
+	events = parser.feed(b'+UGUBX: "' + broken.hex().upper().encode() + b'"\r\n' + broken + b'\r\nOK\r\n')
+	assert UBX_FRAME not in [kind for kind, value in events]
+	assert events[-1] == (AT_LINE, 'OK')
+	assert parser.checksumErrors >= 2
@@ -0,0 +1,127 @@
+#====================================================================
+# Incremental parser for the SARA-R510M8s serial byte stream
+# feed() accepts chunks of any size and returns complete events:
+#   (AT_LINE, "OK")            an AT response or URC line
+#   (AT_PROMPT, ">")           the data prompt of e.g. AT+UDWNFILE
+#   (UBX_FRAME, frame)         a UBX frame from a +UGUBX line or raw binary,
+#                              frame is the complete frame, sync chars to checksum
+# UBX frames are only returned when the Fletcher-8 checksum is correct.
+# A partial line or frame stays in the buffer until the next chunk, so a
+# serial timeout in the middle of a +UGUBX line no longer loses the frame.
+#====================================================================
+
+import binascii
+
+from measx_decoder import ubx_checksum
+
+AT_LINE = 1
+AT_PROMPT = 2
+UBX_FRAME = 3
+
+UBX_SYNC = b"\xb5\x62"
+UGUBX_PREFIX = b'+UGUBX: "'
+
+# parser states
+STATE_IDLE = 0	# at the start of a line
+STATE_LINE = 1	# inside an AT line, waiting for LF
+STATE_UBX = 2	# inside a binary UBX frame
+
+MAX_LINE = 16384	# longer lines are garbage, they are dropped
+MAX_UBX_PAYLOAD = 8192
+
+# check sync chars, length and checksum of a UBX frame, return its total size or 0
+def ubx_frame_size(frame):
+	if len(frame) < 8 or frame[0:2] != UBX_SYNC:
+		return 0
+	length = frame[4] | (frame[5] << 8)
+	if len(frame) < length + 8:
+		return 0
+	if ubx_checksum(frame[2:length+6]) != frame[length+6:length+8]:
+		return 0
+	return length + 8
+
+class UBXStreamParser:
+	def __init__(self):
+		self.buffer = bytearray()	# the single receive buffer, consumed bytes are dropped once per feed()
+		self.state = STATE_IDLE
+		self.checksumErrors = 0
+		self.droppedBytes = 0
+
+	def feed(self, data):
+		buffer = self.buffer
+		buffer.extend(data)
+		events = []
+		pos = 0
+		size = len(buffer)
+		with memoryview(buffer) as view:
+			while pos < size:
+				if self.state == STATE_IDLE:
+					byte = buffer[pos]
+					if byte == 0x0D or byte == 0x0A or byte == 0x20:
+						pos += 1
+					elif byte == 0x3E: # '>'
+						events.append((AT_PROMPT, '>'))
+						pos += 1
+					elif byte == 0xB5:
+						if size - pos < 2:
+							break
+						self.state = STATE_UBX if buffer[pos+1] == 0x62 else STATE_LINE
+					else:
+						self.state = STATE_LINE
+
+				elif self.state == STATE_LINE:
+					end = buffer.find(b'\n', pos)
+					if end < 0:
+						if size - pos > MAX_LINE:
+							self.droppedBytes += size - pos
+							pos = size
+							self.state = STATE_IDLE
+						break
+					self.parse_line(view, pos, end, events)
+					pos = end + 1
+					self.state = STATE_IDLE
+
+				else: # STATE_UBX
+					if size - pos < 6:
+						break
+					length = buffer[pos+4] | (buffer[pos+5] << 8)
+					if length > MAX_UBX_PAYLOAD:
+						# not a frame, skip the sync char and search again
+						self.droppedBytes += 1
+						pos += 1
+						self.state = STATE_IDLE
+						continue
+					if size - pos < length + 8:
+						break
+					frameSize = ubx_frame_size(view[pos:pos+length+8])
+					if frameSize:
+						events.append((UBX_FRAME, bytes(view[pos:pos+frameSize])))
+						pos += frameSize
+					else:
+						self.checksumErrors += 1
+						self.droppedBytes += 1
+						pos += 1
+					self.state = STATE_IDLE
+		del buffer[:pos]
+		return events
+
+	def parse_line(self, view, start, end, events):
+		lineEnd = end
+		while lineEnd > start and view[lineEnd-1] in (0x0D, 0x20):
+			lineEnd -= 1
+		if lineEnd == start:
+			return
+		line = view[start:lineEnd]
+		events.append((AT_LINE, bytes(line).decode(errors='replace')))
+		# +UGUBX: "B5620214...": decode the hex in place, without stripping copies
+		if line[:len(UGUBX_PREFIX)] == UGUBX_PREFIX and line[-1] == 0x22: # '"'
+			try:
+				frame = binascii.unhexlify(line[len(UGUBX_PREFIX):-1])
+			except (binascii.Error, ValueError):
+				self.droppedBytes += len(line)
+				return
+			frameSize = ubx_frame_size(frame)
+			if frameSize == len(frame):
+				events.append((UBX_FRAME, frame))
+			else:
+				self.checksumErrors += 1